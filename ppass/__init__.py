@@ -18,10 +18,23 @@
 """Application initialisation
 """
 
-from .app import cli
+import os
 
 
 def run():
     """Application initialisation with empty context
+    Password, folder and store names completions are answered without loading the full cli
+    Read-only JSON commands are forwarded to the agent when it is running
     """
+    instruction = os.environ.get("_PPASS_COMPLETE", "")
+    if instruction != "":
+        from .completion import completion
+        if completion.complete(instruction):
+            return
+    import sys
+    from .modules.agent import agent
+    code = agent.forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    from .app import cli
     cli(obj={})
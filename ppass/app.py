@@ -20,23 +20,28 @@
 
 import os
 import json
-import webbrowser
-
 import click
-import pyclip
 from rich import print
 
 from .modules.ui import ui
 from .modules.git import git
 from .modules.gpg import gpg
+from .modules.armor import armor
 from .modules.utils import utils
 from .modules.rjson import rjson
 from .modules.params import params
 from .modules.folders import folders
+from .modules.attachments import attachments
+from .modules.batch import batch
+from .modules.metadata import metadata
+from .modules.index import index
+from .modules.rekey import rekey
 from .modules.xdotool import xdotool
-from .modules.passwords import passwords
+from .modules.agent import agent
+from .modules.passwords import passwords, PasswordItem
 
 from .appConfig import app, AppConfig, AliasedGroup
+from .completion import completion
 
 
 class Config(AppConfig):
@@ -51,6 +56,13 @@ class Config(AppConfig):
     gituser: str = ""
     gitmail: str = ""
     gitbranch: str = "main"
+    gitprefetch: int = 0
+    gitbackend: str = "subprocess"
+    gitmaintainobjects: int = 2000
+    gitmaintaindays: int = 7
+    gpgbinary: str = "gpg"
+    gpghome: str = ""
+    gpgarmor: bool = True
 
 
 # RUN #################################################################################################################
@@ -89,6 +101,12 @@ def load_config(is_json: bool, section: str, new_section: bool = False) -> Confi
         AppConfig.add_section(config_file, section, Config(config_file))
     if not config.load(section):
         handle_error(is_json, "Application cannot load config file")
+    gpg.configure(config.gpgbinary, config.gpghome, config.gpgarmor)
+    if config.usegit:
+        try:
+            git.configure(config.gitbackend)
+        except AssertionError as error:
+            handle_error(is_json, error)
     return config
 
 
@@ -123,6 +141,47 @@ def recup_context(ctx) -> (str, bool, bool):
     return (context, is_json, is_yes)
 
 
+def get_passwords(ctx, config: Config, filter: str) -> list[PasswordItem]:
+    """Get the list of password files, using the store index unless disabled
+
+    Args:
+        ctx: cli context
+        config (Config): config object
+        filter (str): name filter
+
+    Returns:
+        list[PasswordItem]: list of password files
+    """
+    return passwords.get_list(config.path, filter, ctx.obj.get("use_index", True))
+
+
+def select_password(ctx, config: Config, filter: str, is_json: bool, auto_select: bool = True) -> PasswordItem:
+    """Get the password file matching a filter, auto-selecting the best match when it is clear
+
+    Args:
+        ctx: cli context
+        config (Config): config object
+        filter (str): search filter
+        is_json (bool): is cli in JSON mode
+        auto_select (bool, optional): if False (commands modifying the password file), the best match is not
+            selected over other matches. Defaults to True.
+
+    Returns:
+        PasswordItem: selected password file
+    """
+    use_index = ctx.obj.get("use_index", True)
+    # Store read once, for both the substring probe and the ranking
+    loaded = passwords.get_search_index(config.path, use_index)
+    # A single match needs no ranking: stop at the second one
+    items = list(passwords.iter_list(config.path, filter, use_index, limit=2, files=loaded[0]))
+    if len(items) == 1:
+        return items[0]
+    results = passwords.search(config.path, filter, use_index, loaded)
+    items = [item for (score, item) in results]
+    scores = [score for (score, item) in results]
+    return params.validate_password(is_json, items, scores, auto_select)
+
+
 def init_command(ctx) -> (Config, bool, bool):
     """Initialise a command
 
@@ -136,8 +195,14 @@ def init_command(ctx) -> (Config, bool, bool):
     config: Config = init_context(is_json, context)
     if not is_json and not config.usegit:
         print("[yellow italic]WARNING: Git is not configured[/]\n")
-    # if config.usegit:
-    #     git.pull(config.path)
+    if config.usegit and config.gitprefetch > 0:
+        # Remote is fetched in the background: the command uses the local store right away
+        behind = git.prefetch(config.path, config.gitbranch, config.gitprefetch * 60).get("behind", 0)
+        if not is_json and behind > 0:
+            print(f"[yellow italic]WARNING: Store is {behind} commits behind remote[/]\n")
+    if config.usegit:
+        # Maintenance runs in the background when too many loose objects are found, or after some days
+        git.schedule_maintenance(config.path, config.gitmaintainobjects, config.gitmaintaindays * 24 * 3600)
     return (config, is_json, is_yes)
 
 
@@ -209,43 +274,58 @@ def get_content(config: Config, password: str, user: str, url: str, comment: str
     return content
 
 
+def commit_changes(is_json: bool, config: Config, message: str, added: list[str] = None,
+                   removed: list[str] = None):
+    """Commit changes of the store, warning if there was nothing to commit
+
+    Args:
+        is_json (bool): is cli in JSON mode
+        config (Config): config object
+        message (str): commit message
+        added (list[str], optional): paths of created or modified files. Defaults to None.
+        removed (list[str], optional): paths of deleted files or directories. Defaults to None.
+    """
+    committed = git.commit(config.path, message, config.gitbranch, added=added, removed=removed)
+    if not is_json and not committed:
+        print("[yellow italic]WARNING: No change to commit[/]\n")
+
+
 # COMPLETION ##########################################################################################################
 
 def complete_store(ctx, param, incomplete):
-    items = app.sections()
-    return list(filter(lambda i: incomplete.lower() in i.lower(), items))
+    return completion.get_stores(incomplete)
 
 
 def complete_filter(ctx, param, incomplete):
-    store = ctx.parent.params["context"]
-    config: Config = init_context(False, store)
-    items = passwords.get_list(config.path, incomplete)
-    return list(map(lambda i: f"\"{i.f_name}\"", items))
+    path = completion.get_store_path(ctx.find_root().params["context"])
+    return [] if path is None else completion.get_passwords(path, incomplete)
 
 
 def complete_folder(ctx, param, incomplete):
-    store = ctx.parent.parent.params["context"]
-    config: Config = init_context(False, store)
-    items = folders.get_list(config.path)
-    items = list(filter(lambda i: incomplete.lower() in i.name.lower(), items))
-    return list(map(lambda i: f"\"{i.name}\"", items))
+    path = completion.get_store_path(ctx.find_root().params["context"])
+    return [] if path is None else completion.get_folders(path, incomplete)
 
 
 # CLI #################################################################################################################
 
 @click.group(cls=AliasedGroup)
 @click.pass_context
-@click.version_option(app.version())
+@click.version_option(package_name=app.name())
 @click.option("-c", "--context", default="DEFAULT", help="Section of config file to load (default is DEFAULT)",
               shell_complete=complete_store)
 @click.option("-y", "--yes", is_flag=True, help="Auto confirm all prompts")
 @click.option("--json", is_flag=True, help="Return json values instead of ui")
-def cli(ctx, context, yes, json):
+@click.option("--compact", is_flag=True, help="Return json values without indentation")
+@click.option("--ndjson", is_flag=True, help="Return json values one per line, streaming lists (implies --json)")
+@click.option("--no-index", is_flag=True, help="Walk the store instead of using the store index")
+def cli(ctx, context, yes, json, compact, ndjson, no_index):
     """GPG Password Manager
     """
     ctx.obj["context"] = context
     ctx.obj["is_yes"] = yes
-    ctx.obj["is_json"] = json
+    ctx.obj["is_json"] = json or ndjson
+    rjson.configure(compact, ndjson)
+    ctx.obj["use_index"] = not no_index
     pass
 
 
@@ -286,7 +366,12 @@ def cli_init(ctx, new_section: bool, path: str, identity: str, edit: bool):
 @click.option("--mail", default="", help="Git email")
 @click.option("--branch", default="", help="Git branch")
 @click.option("--pull", is_flag=True, help="Pull existing git repository")
-def cli_init_git(ctx, repo: str, user: str, mail: str, branch: str, pull: bool):
+@click.option("--depth", type=click.IntRange(min=0), default=0, help="With --pull, number of commits of history")
+@click.option("--partial", is_flag=True, help="With --pull, download past versions of files only when needed")
+@click.option("--backend", type=click.Choice(["subprocess", "dulwich"]), default=None,
+              help="Git backend (default: subprocess, git binary)")
+def cli_init_git(ctx, repo: str, user: str, mail: str, branch: str, pull: bool, depth: int, partial: bool,
+                 backend: str):
     """Initialize git
     """
     (context, is_json, is_yes) = recup_context(ctx)
@@ -297,6 +382,9 @@ def cli_init_git(ctx, repo: str, user: str, mail: str, branch: str, pull: bool):
         config.gituser = params.validate(is_json, user, "Git username")
         config.gitmail = params.validate(is_json, mail, "Git email")
         config.gitbranch = params.validate(is_json, branch, "Git branch", "main")
+        if backend is not None:
+            config.gitbackend = backend
+        git.configure(config.gitbackend)
         config.save(context)
         if not pull:
             # Write default files
@@ -306,7 +394,7 @@ def cli_init_git(ctx, repo: str, user: str, mail: str, branch: str, pull: bool):
             f = open(os.path.join(config.path, ".gpg-id"), "w")
             f.write(config.identity)
             f.close()
-        git.init(config.path, config.gitrepo, config.gitbranch, config.gituser, config.gitmail, pull)
+        git.init(config.path, config.gitrepo, config.gitbranch, config.gituser, config.gitmail, pull, depth, partial)
         handle_success(is_json, "Git initialized")
     except Exception as error:
         handle_error(is_json, error)
@@ -320,6 +408,7 @@ def cli_init_git(ctx, repo: str, user: str, mail: str, branch: str, pull: bool):
 def cli_otp(ctx, text):
     """ Create a one time password, not saved to file
     """
+    import pyclip
     (context, is_json, is_yes) = recup_context(ctx)
     password = utils.generate_password()
     if is_json:
@@ -337,12 +426,25 @@ def cli_otp(ctx, text):
 @cli.command("list")
 @click.pass_context
 @click.argument("filter", default="", shell_complete=complete_filter)
-def cli_list(ctx, filter: str):
+@click.option("--limit", default=0, help="Maximum number of passwords to list (default is no limit)")
+@click.option("--user", default="", help="Only list passwords whose username contains this value")
+@click.option("--url", default="", help="Only list passwords whose url contains this value")
+def cli_list(ctx, filter: str, limit: int, user: str, url: str):
     """List passwords
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
+        limit = None if limit <= 0 else limit
+        if user != "" or url != "":
+            # Usernames and urls are read from the encrypted metadata cache
+            entries = metadata.refresh(config.path, config.identity, config.sep_username, config.sep_url)
+            items = get_passwords(ctx, config, filter)
+            items = metadata.filter(config.path, items, entries, user, url)[:limit]
+        elif filter == "":
+            # Store order: rows are displayed while the store is read
+            items = passwords.iter_list(config.path, filter, ctx.obj.get("use_index", True), limit)
+        else:
+            items = get_passwords(ctx, config, filter)[:limit]
         handle_data(is_json, items, ui.show_passwords)
     except Exception as error:
         handle_error(is_json, error)
@@ -351,13 +453,19 @@ def cli_list(ctx, filter: str):
 @cli.command("show")
 @click.pass_context
 @click.argument("filter", default="", shell_complete=complete_filter)
-def cli_show(ctx, filter: str):
+@click.option("--all-matching", is_flag=True, help="Show all passwords matching the filter")
+def cli_show(ctx, filter: str, all_matching: bool):
     """Show password details
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        if all_matching:
+            items = get_passwords(ctx, config, filter)
+            assert (len(items) != 0), "No password"
+            results = gpg.decrypt_many([item.path for item in items], config.sep_username, config.sep_url)
+            handle_data(is_json, ui.decrypt_results(items, results), ui.show_decrypt_results)
+            return
+        password = select_password(ctx, config, filter, is_json)
         password = gpg.decrypt_to_password(password["path"], config.sep_username, config.sep_url)
         handle_data(is_json, password, ui.show_password)
     except Exception as error:
@@ -372,16 +480,17 @@ def cli_delete(ctx, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        password = select_password(ctx, config, filter, is_json, auto_select=False)
         # CONFIRM DELETION
         if (not is_yes) and (not is_json):
             confirmed = ui.confirm("Delete password file")
             assert (confirmed), "Password deletion has been cancelled"
         # DELETE
         os.remove(password.path)
+        attachments.delete_all(password)
         if config.usegit:
-            git.commit(config.path, f"Password file <{password.f_name}> has been deleted", config.gitbranch)
+            commit_changes(is_json, config, f"Password file <{password.f_name}> has been deleted",
+                           removed=[password.path, attachments.get_dir(password)])
         handle_success(is_json, f"Password file <{password.f_name}> has been deleted")
     except Exception as error:
         handle_error(is_json, error)
@@ -396,17 +505,18 @@ def cli_open(ctx, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        password = select_password(ctx, config, filter, is_json)
         password = gpg.decrypt_to_password(password["path"], config.sep_username, config.sep_url)
         assert (password.url != ""), "Missing url"
         if is_json:
+            import pyclip
             pyclip.copy(password.url)
             rjson.success(data=password.url)
         elif password.url.startswith("ssh+"):
             domain = password.url.removeprefix("ssh+")
             xdotool.ssh_open(password.username, domain, password.password)
         else:
+            import webbrowser
             webbrowser.open_new_tab(password.url)
     except Exception as error:
         handle_error(is_json, error)
@@ -420,10 +530,10 @@ def cli_user(ctx, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        password = select_password(ctx, config, filter, is_json)
         password = gpg.decrypt_to_password(password["path"], config.sep_username, config.sep_url)
         assert (password.username != ""), "Missing username"
+        import pyclip
         if is_json:
             pyclip.copy(password.username)
             rjson.success(data=password.username)
@@ -442,9 +552,9 @@ def cli_pass(ctx, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        password = select_password(ctx, config, filter, is_json)
         password = gpg.decrypt_to_password(password["path"], config.sep_username, config.sep_url)
+        import pyclip
         if is_json:
             pyclip.copy(password.password)
             rjson.success(data=password.password)
@@ -465,8 +575,7 @@ def cli_clip(ctx, filter: str):
     (config, is_json, is_yes) = init_command(ctx)
     try:
         assert (not is_json), "Clip is not available in JSON mode"
-        items = passwords.get_list(config.path, filter)
-        password = params.validate_password(is_json, items)
+        password = select_password(ctx, config, filter, is_json)
         password = gpg.decrypt_to_password(password["path"], config.sep_username, config.sep_url)
         assert (password.username != ""), "Missing username"
         if password.url.startswith("ssh+"):
@@ -489,7 +598,7 @@ def cli_generate(ctx, folder: str, name: str, user: str, url: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        folder_items = folders.get_list(config.path)
+        folder_items = folders.get_list(config.path, ctx.obj.get("use_index", True))
         folder = params.validate_folder(is_json, folder, folder_items)
         name = params.validate(is_json, name, "Password name")
         password = utils.generate_password()
@@ -499,7 +608,7 @@ def cli_generate(ctx, folder: str, name: str, user: str, url: str):
         filepath = os.path.join(config.path, folder, name + ".gpg")
         gpg.encrypt_to_file(content, config.identity, filepath)
         if config.usegit:
-            git.commit(config.path, "Password file created", config.gitbranch)
+            commit_changes(is_json, config, "Password file created", added=[filepath])
         handle_success(is_json, "Password file created")
     except Exception as error:
         handle_error(is_json, error)
@@ -517,7 +626,7 @@ def cli_insert(ctx, folder: str, name: str, password: str, user: str, url: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        folder_items = folders.get_list(config.path)
+        folder_items = folders.get_list(config.path, ctx.obj.get("use_index", True))
         folder = params.validate_folder(is_json, folder, folder_items)
         name = params.validate(is_json, name, "Password name")
         password = params.validate_passwordvalue(is_json, password)
@@ -527,7 +636,7 @@ def cli_insert(ctx, folder: str, name: str, password: str, user: str, url: str):
         filepath = os.path.join(config.path, folder, name + ".gpg")
         gpg.encrypt_to_file(content, config.identity, filepath)
         if config.usegit:
-            git.commit(config.path, "Password file created", config.gitbranch)
+            commit_changes(is_json, config, "Password file created", added=[filepath])
         handle_success(is_json, "Password file created")
     except Exception as error:
         handle_error(is_json, error)
@@ -541,20 +650,67 @@ def cli_edit(ctx: click.Context, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         content = gpg.decrypt_file(password_item["path"])
         new_content = click.edit(content)
         assert (new_content is not None), "Edition cancelled"
         os.remove(password_item["path"])
         gpg.encrypt_to_file(new_content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "File modified", config.gitbranch)
+            commit_changes(is_json, config, "File modified", added=[password_item.path])
         handle_success(is_json, "File modified")
     except Exception as error:
         handle_error(is_json, error)
 
 
+# ATTACHMENTS #########################################################################################################
+
+@cli.command("attach")
+@click.pass_context
+@click.argument("filter", default="", shell_complete=complete_filter)
+@click.option("--file", "source", default="", help="File to attach (- for stdin)")
+@click.option("--name", default="", help="Attachment name (default is file name)")
+def cli_attach(ctx: click.Context, filter: str, source: str, name: str):
+    """Attach a file to a password file (saved encrypted)
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
+        source = params.validate(is_json, source, "File to attach")
+        if name.strip() == "":
+            assert (source != "-"), "Attachment name is required when reading stdin"
+            name = os.path.basename(source)
+        filepath = attachments.add(password_item, source, name, config.identity)
+        if config.usegit:
+            commit_changes(is_json, config, f"Attachment <{name}> added", added=[filepath])
+        handle_success(is_json, f"Attachment <{name}> added")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+@cli.command("extract")
+@click.pass_context
+@click.argument("filter", default="", shell_complete=complete_filter)
+@click.option("--name", default="", help="Attachment name")
+@click.option("--output", default="", help="Output file (- for stdout, default is attachment name)")
+def cli_extract(ctx: click.Context, filter: str, name: str, output: str):
+    """Extract an attachment of a password file
+    """
+    # No git warning: stdout may receive the attachment
+    (context, is_json, is_yes) = recup_context(ctx)
+    config: Config = init_context(is_json, context)
+    try:
+        password_item = select_password(ctx, config, filter, is_json)
+        attachment = params.validate_attachment(is_json, name, attachments.get_list(password_item))
+        output = output if output != "" else attachment.name
+        assert (not (is_json and output == "-")), "Output to stdout is not available in JSON mode"
+        attachments.extract(attachment, output)
+        if output != "-":
+            handle_success(is_json, f"Attachment <{attachment.name}> extracted to <{output}>")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
 # MODIFY ##############################################################################################################
 
 @cli.group("modify", cls=AliasedGroup)
@@ -574,15 +730,14 @@ def cli_modify_user(ctx: click.Context, filter: str, new: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         password = gpg.decrypt_to_password(password_item["path"], config.sep_username, config.sep_url)
         new = params.validate(is_json, new, "New username", print_old=True, old_value=password.username)
         content = get_content(config, password.password, new, password.url, password.comment)
         os.remove(password_item["path"])
         gpg.encrypt_to_file(content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "Username modified", config.gitbranch)
+            commit_changes(is_json, config, "Username modified", added=[password_item.path])
         handle_success(is_json, "Username modified")
     except Exception as error:
         handle_error(is_json, error)
@@ -597,15 +752,14 @@ def cli_modify_url(ctx: click.Context, filter: str, new: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         password = gpg.decrypt_to_password(password_item["path"], config.sep_username, config.sep_url)
         new = params.validate(is_json, new, "New url", print_old=True, old_value=password.url)
         content = get_content(config, password.password, password.username, new, password.comment)
         os.remove(password_item["path"])
         gpg.encrypt_to_file(content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "Url modified", config.gitbranch)
+            commit_changes(is_json, config, "Url modified", added=[password_item.path])
         handle_success(is_json, "Url modified")
     except Exception as error:
         handle_error(is_json, error)
@@ -620,15 +774,14 @@ def cli_modify_comment(ctx: click.Context, filter: str, new: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         password = gpg.decrypt_to_password(password_item["path"], config.sep_username, config.sep_url)
         new = params.validate_multiline(is_json, new, password.comment, "New comment")
         content = get_content(config, password.password, password.username, password.url, new)
         os.remove(password_item["path"])
         gpg.encrypt_to_file(content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "Comment modified", config.gitbranch)
+            commit_changes(is_json, config, "Comment modified", added=[password_item.path])
         handle_success(is_json, "Comment modified")
     except Exception as error:
         handle_error(is_json, error)
@@ -650,15 +803,14 @@ def cli_modify_password_generate(ctx: click.Context, filter: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         password = gpg.decrypt_to_password(password_item["path"], config.sep_username, config.sep_url)
         new = utils.generate_password()
         content = get_content(config, new, password.username, password.url, password.comment)
         os.remove(password_item["path"])
         gpg.encrypt_to_file(content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "New password generated", config.gitbranch)
+            commit_changes(is_json, config, "New password generated", added=[password_item.path])
         handle_success(is_json, "New password generated")
     except Exception as error:
         handle_error(is_json, error)
@@ -673,20 +825,48 @@ def cli_modify_password_insert(ctx: click.Context, filter: str, new: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = passwords.get_list(config.path, filter)
-        password_item = params.validate_password(is_json, items)
+        password_item = select_password(ctx, config, filter, is_json, auto_select=False)
         password = gpg.decrypt_to_password(password_item["path"], config.sep_username, config.sep_url)
         new = params.validate_passwordvalue(is_json, new)
         content = get_content(config, new, password.username, password.url, password.comment)
         os.remove(password_item["path"])
         gpg.encrypt_to_file(content, config.identity, password_item["path"])
         if config.usegit:
-            git.commit(config.path, "New password saved", config.gitbranch)
+            commit_changes(is_json, config, "New password saved", added=[password_item.path])
         handle_success(is_json, "New password saved")
     except Exception as error:
         handle_error(is_json, error)
 
 
+# BATCH ###############################################################################################################
+
+@cli.command("batch")
+@click.pass_context
+@click.option("--file", "source", default="-", help="File of operations, one JSON object per line (default is stdin)")
+@click.option("--workers", default=0, help="Number of parallel gpg processes (default is one per cpu, up to 8)")
+def cli_batch(ctx: click.Context, source: str, workers: int):
+    """Apply a batch of modifications, with a single commit
+    Each line is a JSON object: {"name": "<folder>/<name>", "user": "...", "url": "...", "comment": "...",
+    "password": "..."} with only the fields to modify ("generate": true for a random password)
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        if source == "-":
+            operations = batch.read_operations(click.get_text_stream("stdin"))
+        else:
+            with open(source, "r") as f:
+                operations = batch.read_operations(f)
+        assert (len(operations) != 0), "No operation"
+        filepaths = batch.apply(config.path, operations, config.identity, config.sep_username, config.sep_url,
+                                lambda password, user, url, comment: get_content(config, password, user, url, comment),
+                                workers)
+        if config.usegit:
+            commit_changes(is_json, config, f"Batch of {len(operations)} modifications", added=filepaths)
+        handle_success(is_json, f"Batch of {len(operations)} modifications applied")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
 # FOLDERS #############################################################################################################
 
 @cli.group("folders", cls=AliasedGroup, invoke_without_command=True)
@@ -705,7 +885,7 @@ def cli_folders_list(ctx: click.Context):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        items = folders.get_list(config.path)
+        items = folders.get_list(config.path, ctx.obj.get("use_index", True))
         handle_data(is_json, items, ui.show_folders)
     except Exception as error:
         handle_error(is_json, error)
@@ -723,7 +903,8 @@ def cli_folders_create(ctx: click.Context, name: str):
         path = os.path.join(config.path, name)
         folders.create(name, path)
         if config.usegit:
-            git.commit(config.path, f"Folder <{name}> has been created", config.gitbranch)
+            # Empty folders are not tracked by git: nothing may be committed
+            git.commit(config.path, f"Folder <{name}> has been created", config.gitbranch, added=[path])
         handle_success(is_json, f"Folder <{name}> has been created")
     except Exception as error:
         handle_error(is_json, error)
@@ -737,7 +918,7 @@ def cli_folders_delete(ctx: click.Context, name: str):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        folder_items = folders.get_list(config.path)
+        folder_items = folders.get_list(config.path, ctx.obj.get("use_index", True))
         # CHECK VALID NAME
         name = params.validate_folder(is_json, name, folder_items)
         # CONFIRM DELETION
@@ -748,12 +929,142 @@ def cli_folders_delete(ctx: click.Context, name: str):
         path = os.path.join(config.path, name)
         folders.delete(name, path)
         if config.usegit:
-            git.commit(config.path, f"Folder <{name}> has been deleted", config.gitbranch)
+            # Empty folders are not tracked by git: nothing may be committed
+            git.commit(config.path, f"Folder <{name}> has been deleted", config.gitbranch, removed=[path])
         handle_success(is_json, f"Folder <{name}> has been deleted")
     except Exception as error:
         handle_error(is_json, error)
 
 
+# REKEY ###############################################################################################################
+
+@cli.command("rekey")
+@click.pass_context
+@click.option("--identity", default="", help="New identity")
+@click.option("--workers", default=0, help="Number of parallel gpg processes (default is one per cpu, up to 8)")
+def cli_rekey(ctx: click.Context, identity: str, workers: int):
+    """Re-encrypt the whole store for a new identity
+    Resumes an interrupted re-encryption
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        identity = params.validate_identity(is_json, identity)
+        # Fail once, instead of once per file, if the identity cannot encrypt
+        gpg.encrypt_data("", identity)
+        (files, done) = rekey.get_pending(config.path, identity)
+        # CONFIRM RE-ENCRYPTION
+        if (not is_yes) and (not is_json):
+            if done != 0:
+                ui.print_info(f"Resuming: {done} files already re-encrypted")
+            confirmed = ui.confirm(f"Re-encrypt {len(files)} files for <{identity}>")
+            assert (confirmed), "Re-encryption has been cancelled"
+        # RE-ENCRYPT
+        if is_json:
+            errors = rekey.run(config.path, identity, files, workers)
+        else:
+            with ui.create_progress() as progress:
+                task = progress.add_task("Re-encrypting", total=len(files))
+                errors = rekey.run(config.path, identity, files, workers,
+                                   lambda f, error: progress.advance(task))
+        if len(errors) != 0:
+            for (f, error) in errors[:-1]:
+                ui.print_error(f"{f}: {error}", must_exit=False)
+            (f, error) = errors[-1]
+            raise Exception(f"{len(errors)} files could not be re-encrypted, run rekey again to resume. {f}: {error}")
+        # SAVE NEW IDENTITY
+        config.identity = identity
+        config.save(recup_context(ctx)[0])
+        gpgid_path = os.path.join(config.path, ".gpg-id")
+        if os.path.exists(gpgid_path):
+            with open(gpgid_path, "w") as f:
+                f.write(identity)
+        # The metadata cache is encrypted for the previous identity
+        if os.path.exists(metadata.get_filepath(config.path)):
+            os.remove(metadata.get_filepath(config.path))
+        if config.usegit:
+            filepaths = [os.path.join(config.path, f) for f in rekey.list_files(config.path)]
+            if os.path.exists(gpgid_path):
+                filepaths.append(gpgid_path)
+            commit_changes(is_json, config, f"Store re-encrypted for <{identity}>", added=filepaths)
+        handle_success(is_json, f"Store re-encrypted for <{identity}>")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+@cli.command("convert")
+@click.pass_context
+@click.option("--format", "file_format", type=click.Choice(["binary", "armor"]), default="binary",
+              help="Format of password files (default is binary)")
+def cli_convert(ctx: click.Context, file_format: str):
+    """Convert all password files to binary or armored format
+    New password files are then written in this format
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        use_index = ctx.obj.get("use_index", True)
+        filepaths = [os.path.join(root, f) for (root, f) in passwords.iter_files(config.path, use_index)]
+        results = armor.convert_many(filepaths, file_format == "armor")
+        errors = [(f, result) for (f, result) in zip(filepaths, results) if isinstance(result, Exception)]
+        converted = len([result for result in results if result is True])
+        if len(errors) != 0:
+            for (f, error) in errors[:-1]:
+                ui.print_error(f"{f}: {error}", must_exit=False)
+            (f, error) = errors[-1]
+            raise Exception(f"{len(errors)} files could not be converted, run convert again. {f}: {error}")
+        # SAVE FORMAT
+        config.gpgarmor = (file_format == "armor")
+        config.save(recup_context(ctx)[0])
+        if config.usegit and converted != 0:
+            converted_paths = [f for (f, result) in zip(filepaths, results) if result is True]
+            commit_changes(is_json, config, f"Password files converted to {file_format} format",
+                           added=converted_paths)
+        handle_success(is_json, f"{converted} password files converted to {file_format} format")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+# INDEX ###############################################################################################################
+
+@cli.group("index", cls=AliasedGroup)
+@click.pass_context
+def cli_index(ctx: click.Context):
+    """Store index commands
+    """
+    pass
+
+
+@cli_index.command("rebuild")
+@click.pass_context
+def cli_index_rebuild(ctx: click.Context):
+    """Rebuild the store index from scratch
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        index.refresh(config.path, rebuild=True)
+        handle_success(is_json, "Store index rebuilt")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+@cli_index.command("watch")
+@click.pass_context
+def cli_index_watch(ctx: click.Context):
+    """Keep the store index up to date from file system events (Linux only)
+    Runs until interrupted
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        from .modules.watcher import StoreWatcher
+        watcher = StoreWatcher(config.path)
+        if not is_json:
+            ui.print_info(f"Watching <{config.path}>, press Ctrl+C to stop")
+        watcher.run()
+    except KeyboardInterrupt:
+        handle_success(is_json, "Store watcher stopped")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
 # GIT #################################################################################################################
 
 @cli.group("git", cls=AliasedGroup)
@@ -771,7 +1082,9 @@ def cli_git_status(ctx: click.Context):
     """
     (config, is_json, is_yes) = init_command(ctx)
     try:
-        git.status(config.path)
+        if not is_json:
+            git.status(config.path)
+        handle_data(is_json, git.get_status(config.path, config.gitbranch), ui.show_push_status)
     except Exception as error:
         handle_error(is_json, error)
 
@@ -800,6 +1113,18 @@ def cli_git_push(ctx: click.Context):
         handle_error(is_json, error)
 
 
+@cli_git.command("maintain")
+@click.pass_context
+def cli_git_maintain(ctx: click.Context):
+    """Git repository maintenance (repack, commit-graph, multi-pack-index, prune)
+    """
+    (config, is_json, is_yes) = init_command(ctx)
+    try:
+        handle_data(is_json, git.maintain(config.path), ui.show_maintenance)
+    except Exception as error:
+        handle_error(is_json, error)
+
+
 @cli_git.command("sync")
 @click.pass_context
 def cli_git_sync(ctx: click.Context):
@@ -810,3 +1135,56 @@ def cli_git_sync(ctx: click.Context):
         git.sync(config.path, config.gitbranch)
     except Exception as error:
         handle_error(is_json, error)
+
+
+# AGENT ###############################################################################################################
+
+@cli.group("agent", cls=AliasedGroup)
+@click.pass_context
+def cli_agent(ctx: click.Context):
+    """Agent commands (read-only JSON commands are answered by a resident process)
+    """
+    pass
+
+
+@cli_agent.command("start")
+@click.pass_context
+@click.option("--ttl", default=60, type=int, help="Seconds decrypted contents are kept in memory (0 to disable)")
+@click.option("--foreground", is_flag=True, help="Do not detach from the terminal")
+def cli_agent_start(ctx: click.Context, ttl: int, foreground: bool):
+    """Start the agent
+    """
+    (context, is_json, is_yes) = recup_context(ctx)
+    try:
+        assert (ttl >= 0), "TTL must be positive"
+        if foreground:
+            agent.serve(ttl)
+            return
+        handle_data(is_json, agent.start(ttl), ui.show_agent)
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+@cli_agent.command("stop")
+@click.pass_context
+def cli_agent_stop(ctx: click.Context):
+    """Stop the agent
+    """
+    (context, is_json, is_yes) = recup_context(ctx)
+    try:
+        agent.stop()
+        handle_success(is_json, "Agent stopped")
+    except Exception as error:
+        handle_error(is_json, error)
+
+
+@cli_agent.command("status")
+@click.pass_context
+def cli_agent_status(ctx: click.Context):
+    """Agent status
+    """
+    (context, is_json, is_yes) = recup_context(ctx)
+    try:
+        handle_data(is_json, agent.status(), ui.show_agent)
+    except Exception as error:
+        handle_error(is_json, error)
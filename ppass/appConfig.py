@@ -18,17 +18,21 @@
 """Utils for application configuration
 """
 
-import os
-import configparser
-import pkg_resources
+import click
 
-from pathlib import Path
+from typing import TYPE_CHECKING
 
-import click
+from .appInfo import app  # noqa: F401
+
+if TYPE_CHECKING:
+    import configparser
 
 
 class AppConfig:
     """Base application configuration class
+
+    Fields are the annotated class attributes of extended classes, with their default values. Supported types are
+    str, bool and int. Values are read from the compiled config file (see app.read_rc).
     """
     __filepath__: str = ''
 
@@ -40,6 +44,28 @@ class AppConfig:
         """
         self.__filepath__ = filepath
 
+    @classmethod
+    def get_fields(cls) -> dict:
+        """Get the declared fields
+
+        Returns:
+            dict: type of each field, in declaration order
+        """
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            for (name, kind) in vars(klass).get("__annotations__", {}).items():
+                if not name.startswith("__"):
+                    fields[name] = kind
+        return fields
+
+    def get_values(self) -> dict:
+        """Get the values of the fields, as written in config file
+
+        Returns:
+            dict: value of each field
+        """
+        return {name: str(getattr(self, name)) for name in self.get_fields()}
+
     def load(self, section: str) -> bool:
         """Load config file
 
@@ -50,18 +76,20 @@ class AppConfig:
             bool: is loaded
         """
         try:
-            if not os.path.exists(self.__filepath__):
-                return False
-            cfg = configparser.ConfigParser()
-            cfg.read(self.__filepath__)
-            if (section not in cfg.sections()) and (section != cfg.default_section):
+            values = app.read_rc(self.__filepath__)
+            if section not in values:
                 return False
-            members = [attr for attr in dir(self) if not callable(getattr(self, attr)) and not attr.startswith("__")]
-            for member in members:
-                if isinstance(getattr(self, member), str):
-                    setattr(self, member, cfg[section][member])
-                elif isinstance(getattr(self, member), bool):
-                    setattr(self, member, cfg[section][member] == 'True')
+            for (name, kind) in self.get_fields().items():
+                if name not in values[section]:
+                    # Option added after config file creation: keep default value
+                    continue
+                value = values[section][name]
+                if kind is bool:
+                    setattr(self, name, value == 'True')
+                elif kind is int:
+                    setattr(self, name, int(value) if value.strip().lstrip("-").isdigit() else getattr(self, name))
+                else:
+                    setattr(self, name, value)
             return True
         except Exception:
             return False
@@ -72,13 +100,10 @@ class AppConfig:
         Args:
             section (str, optional): section of config file. Defaults to "DEFAULT".
         """
+        import configparser
         cfg = configparser.ConfigParser()
-        members = [attr for attr in dir(self) if not callable(getattr(self, attr)) and not attr.startswith("__")]
-        for member in members:
-            cfg[section][member] = str(getattr(self, member))
-        with open(self.__filepath__, "w") as configfile:
-            cfg.write(configfile)
-            configfile.close()
+        cfg[section] = self.get_values()
+        AppConfig.write(self.__filepath__, cfg)
 
     def save(self, section: str):
         """Save config file
@@ -86,14 +111,25 @@ class AppConfig:
         Args:
             section (str): section of config file
         """
+        import configparser
         cfg = configparser.ConfigParser()
         cfg.read(self.__filepath__)
-        members = [attr for attr in dir(self) if not callable(getattr(self, attr)) and not attr.startswith("__")]
-        for member in members:
-            cfg[section][member] = str(getattr(self, member))
-        with open(self.__filepath__, "w") as configfile:
+        for (name, value) in self.get_values().items():
+            cfg[section][name] = value
+        AppConfig.write(self.__filepath__, cfg)
+
+    @staticmethod
+    def write(filepath: str, cfg: "configparser.ConfigParser"):
+        """Write config file, and compile it again
+
+        Args:
+            filepath (str): config file path
+            cfg (configparser.ConfigParser): config values
+        """
+        with open(filepath, "w") as configfile:
             cfg.write(configfile)
-            configfile.close()
+        # Several writes may happen within the resolution of modification time
+        app.compile_rc(filepath)
 
     @staticmethod
     def add_section(filepath: str, section: str, item):
@@ -105,16 +141,12 @@ class AppConfig:
             section (str): section of config file
             item: AppConfig extended class
         """
+        import configparser
         cfg = configparser.ConfigParser()
         cfg.read(filepath)
         assert (section not in cfg.sections()), f"Section <{section}> already exists"
-        cfg.add_section(section)
-        members = [attr for attr in dir(item) if not callable(getattr(item, attr)) and not attr.startswith("__")]
-        for member in members:
-            cfg[section][member] = str(getattr(item, member))
-        with open(filepath, "w") as configfile:
-            cfg.write(configfile)
-            configfile.close()
+        cfg[section] = item.get_values()
+        AppConfig.write(filepath, cfg)
 
     @staticmethod
     def get_sections(filepath: str) -> list[str]:
@@ -126,9 +158,7 @@ class AppConfig:
         Returns:
             list(str): List of section names
         """
-        cfg = configparser.ConfigParser()
-        cfg.read(filepath)
-        return cfg.sections()
+        return [name for name in app.read_rc(filepath) if name != "DEFAULT"]
 
 
 class AliasedGroup(click.Group):
@@ -151,48 +181,3 @@ class AliasedGroup(click.Group):
         # always return the full command name
         _, cmd, args = super().resolve_command(ctx, args)
         return cmd.name, cmd, args
-
-
-class app:
-    """Static class for handling application
-    """
-
-    @staticmethod
-    def name() -> str:
-        """Get application name
-
-        Returns:
-            str: application name
-        """
-        return "ppass"
-
-    @staticmethod
-    def version() -> str:
-        """Get application version
-
-        Returns:
-            str: application version
-        """
-        return pkg_resources.get_distribution(app.name()).version
-
-    @staticmethod
-    def default_path() -> str:
-        """Get application data path
-
-        Returns:
-            str: application data path
-        """
-        return os.path.join(Path.home(), "." + app.name() + "/")
-
-    @staticmethod
-    def default_rcpath() -> str:
-        """Get application config file path
-
-        Returns:
-            str: application config file path
-        """
-        return os.path.join(Path.home(), "." + app.name() + "rc")
-
-    @staticmethod
-    def sections() -> list[str]:
-        return AppConfig.get_sections(app.default_rcpath())
@@ -0,0 +1,151 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Application information and paths
+Only depends on the standard library, so that it can be used by shell completion
+"""
+
+import os
+import json
+
+from pathlib import Path
+
+
+class app:
+    """Static class for handling application
+    """
+
+    @staticmethod
+    def name() -> str:
+        """Get application name
+
+        Returns:
+            str: application name
+        """
+        return "ppass"
+
+    @staticmethod
+    def version() -> str:
+        """Get application version
+
+        Returns:
+            str: application version
+        """
+        from importlib.metadata import version
+        return version(app.name())
+
+    @staticmethod
+    def default_path() -> str:
+        """Get application data path
+
+        Returns:
+            str: application data path
+        """
+        return os.path.join(Path.home(), "." + app.name() + "/")
+
+    @staticmethod
+    def default_rcpath() -> str:
+        """Get application config file path
+
+        Returns:
+            str: application config file path
+        """
+        return os.path.join(Path.home(), "." + app.name() + "rc")
+
+    @staticmethod
+    def default_cachepath() -> str:
+        """Get application cache path
+
+        Returns:
+            str: application cache path
+        """
+        cache_home = os.environ.get("XDG_CACHE_HOME", "") or os.path.join(Path.home(), ".cache")
+        return os.path.join(cache_home, app.name())
+
+    @staticmethod
+    def sections() -> list[str]:
+        """Get the list of sections in application config file
+
+        Returns:
+            list[str]: list of section names
+        """
+        return [name for name in app.read_rc() if name != "DEFAULT"]
+
+    @staticmethod
+    def get_rc_cachepath() -> str:
+        """Get the compiled config file path
+
+        Returns:
+            str: compiled config file path
+        """
+        return os.path.join(app.default_cachepath(), "rc.json")
+
+    @staticmethod
+    def read_rc(filepath: str = "") -> dict:
+        """Get the values of config file, from the compiled config file if the config file did not change
+        Config file is only parsed again when its modification time or size changed
+
+        Args:
+            filepath (str, optional): config file path. Defaults to application config file path.
+
+        Returns:
+            dict: values of each section (DEFAULT first), with DEFAULT values inherited. Empty if no config file
+        """
+        filepath = filepath or app.default_rcpath()
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return {}
+        key = [os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size]
+        try:
+            with open(app.get_rc_cachepath(), "r") as f:
+                data = json.load(f)
+            if data["key"] == key:
+                return data["sections"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return app.compile_rc(filepath, key)
+
+    @staticmethod
+    def compile_rc(filepath: str = "", key: list = None) -> dict:
+        """Parse config file, and save its values in the compiled config file
+
+        Args:
+            filepath (str, optional): config file path. Defaults to application config file path.
+            key (list, optional): config file path, modification time and size before parsing. Defaults to current.
+
+        Returns:
+            dict: values of each section (DEFAULT first), with DEFAULT values inherited
+        """
+        import configparser
+        filepath = filepath or app.default_rcpath()
+        if key is None:
+            stat = os.stat(filepath)
+            key = [os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size]
+        cfg = configparser.ConfigParser()
+        cfg.read(filepath)
+        sections = {name: dict(cfg[name]) for name in [cfg.default_section] + cfg.sections()}
+        cachepath = app.get_rc_cachepath()
+        try:
+            os.makedirs(os.path.dirname(cachepath), exist_ok=True)
+            with open(f"{cachepath}.{os.getpid()}.tmp", "w") as f:
+                json.dump({"key": key, "sections": sections}, f)
+            os.replace(f"{cachepath}.{os.getpid()}.tmp", cachepath)
+        except OSError:
+            # Read-only cache: config file is parsed every time
+            pass
+        return sections
@@ -0,0 +1,401 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Fast shell completion of password, folder and store names
+Only depends on the standard library: the full cli is not loaded for these completions
+"""
+
+import os
+import json
+import shlex
+
+from .appInfo import app
+from .modules.index import index
+from .modules.passwords import passwords
+from .modules.search import SearchIndex
+
+
+class completion:
+    """Static class for fast shell completion
+
+    Only completions of password filters, folder names and store names are handled here. Anything else
+    (commands, options, ...) is left to click.
+    """
+    # Command tables, read without loading click. They mirror app.py: completion.check compares them with the click
+    # command tree, and runs in the completion workflow
+    # Sub commands of each group, used to resolve aliases
+    commands: dict = {
+        "": ["init", "init-git", "otp", "list", "show", "delete", "open", "user", "pass", "clip", "generate", "insert",
+             "edit", "attach", "extract", "modify", "batch", "folders", "rekey", "convert", "index", "git", "agent"],
+        "modify": ["user", "url", "comment", "password"],
+        "folders": ["list", "create", "delete"],
+        "index": ["rebuild", "watch"],
+        "git": ["status", "pull", "push", "maintain", "sync"],
+        "agent": ["start", "stop", "status"],
+        "modify password": ["generate", "insert"],
+    }
+    # Commands with a password filter argument
+    filter_commands: tuple = ("list", "show", "delete", "open", "user", "pass", "clip", "edit", "attach", "extract",
+                              "modify user", "modify url", "modify comment", "modify password generate",
+                              "modify password insert")
+    # Options of each command expecting a value, with value completed as folder name if True
+    value_options: dict = {
+        "init": {"--path": False, "--identity": False},
+        "init-git": {"--repo": False, "--user": False, "--mail": False, "--branch": False, "--depth": False,
+                     "--backend": False},
+        "list": {"--limit": False, "--user": False, "--url": False},
+        "generate": {"--folder": True, "--name": False, "--user": False, "--url": False},
+        "insert": {"--folder": True, "--name": False, "--password": False, "--user": False, "--url": False},
+        "attach": {"--file": False, "--name": False},
+        "extract": {"--name": False, "--output": False},
+        "batch": {"--file": False, "--workers": False},
+        "rekey": {"--identity": False, "--workers": False},
+        "convert": {"--format": False},
+        "modify user": {"--new": False},
+        "modify url": {"--new": False},
+        "modify comment": {"--new": False},
+        "modify password insert": {"--new": False},
+        "folders create": {"--name": False},
+        "folders delete": {"--name": True},
+        "agent start": {"--ttl": False},
+    }
+    # Flags of each command
+    flag_options: dict = {
+        "init": ("--new-section", "--edit"),
+        "init-git": ("--pull", "--partial"),
+        "otp": ("--text",),
+        "show": ("--all-matching",),
+        "agent start": ("--foreground",),
+    }
+    global_flags: tuple = ("-y", "--yes", "--json", "--compact", "--ndjson", "--no-index")
+    global_values: tuple = ("-c", "--context")
+    # Version of the completion cache, see load_cache
+    cache_version: int = 2
+
+    @staticmethod
+    def split_arg_string(string: str) -> list[str]:
+        """Split command line words, keeping a partial last token (same as click)
+
+        Args:
+            string (str): command line
+
+        Returns:
+            list[str]: words
+        """
+        lex = shlex.shlex(string, posix=True)
+        lex.whitespace_split = True
+        lex.commenters = ""
+        out = []
+        try:
+            for token in lex:
+                out.append(token)
+        except ValueError:
+            out.append(lex.token)
+        return out
+
+    @staticmethod
+    def resolve(group: str, name: str) -> str:
+        """Resolve a command name or alias
+
+        Args:
+            group (str): parent group path
+            name (str): command name or prefix
+
+        Returns:
+            str: full command path, or None if unknown or ambiguous
+        """
+        names = completion.commands.get(group, [])
+        if name not in names:
+            matches = [n for n in names if n.startswith(name)]
+            if len(matches) != 1:
+                return None
+            name = matches[0]
+        return name if group == "" else f"{group} {name}"
+
+    @staticmethod
+    def parse(args: list[str]) -> (str, str):
+        """Find what is being completed
+
+        Args:
+            args (list[str]): complete args before the incomplete value
+
+        Returns:
+            (str, str): tuple of kind ("filter", "folder", "store" or None), store context
+        """
+        context = "DEFAULT"
+        position = 0
+        # Global options
+        while position < len(args) and args[position].startswith("-"):
+            if args[position] in completion.global_values:
+                if position + 1 == len(args):
+                    return ("store", context)
+                context = args[position + 1]
+                position += 2
+            elif args[position] in completion.global_flags:
+                position += 1
+            else:
+                return (None, context)
+        if position == len(args):
+            return (None, context)
+        # Commands
+        command = ""
+        while position < len(args) and command in completion.commands:
+            command = completion.resolve(command, args[position])
+            if command is None:
+                return (None, context)
+            position += 1
+        if command in completion.commands:
+            return (None, context)
+        # Command arguments
+        options = completion.value_options.get(command, {})
+        flags = completion.flag_options.get(command, ())
+        has_filter = False
+        while position < len(args):
+            if args[position] in options:
+                if position + 1 == len(args):
+                    return ("folder" if options[args[position]] else None, context)
+                position += 2
+            elif args[position] in flags:
+                position += 1
+            elif args[position].startswith("-"):
+                return (None, context)
+            else:
+                has_filter = True
+                position += 1
+        if command in completion.filter_commands and not has_filter:
+            return ("filter", context)
+        return (None, context)
+
+    @staticmethod
+    def get_store_path(context: str) -> str:
+        """Get the store path of a context
+
+        Args:
+            context (str): config section
+
+        Returns:
+            str: store path, or None if not initialized
+        """
+        values = app.read_rc()
+        if context not in values:
+            return None
+        path = values[context].get("path", "")
+        return path if path != "" and os.path.isdir(path) else None
+
+    @staticmethod
+    def get_cachepath(path: str) -> str:
+        """Get the completion cache file path of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: completion cache file path
+        """
+        return index.get_filepath(path).replace(".json", ".complete.json")
+
+    @staticmethod
+    def load_cache(path: str) -> dict:
+        """Get the completion cache of a store, rebuilt if any store directory changed
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dict: completion cache, with password keys and folder names
+        """
+        filepath = completion.get_cachepath(path)
+        try:
+            with open(filepath, "r") as f:
+                data = json.load(f)
+            if data.get("version") != completion.cache_version:
+                raise ValueError("Outdated completion cache")
+            for (rel, mtime) in data["dirs"].items():
+                if os.stat(os.path.join(path, rel) if rel != "" else path).st_mtime_ns != mtime:
+                    raise ValueError(f"Directory <{rel}> has changed")
+            return data
+        except (OSError, ValueError, KeyError):
+            pass
+        dirs = index.refresh(path)
+        keys = [[passwords.get_root_name(path, root), f.replace(".gpg", "")]
+                for (root, f, mtime, size) in index.iter_files(path, dirs)]
+        data = {
+            "version": completion.cache_version,
+            "dirs": {rel: item["mtime"] for (rel, item) in dirs.items()},
+            "keys": keys,
+            "folders": dirs.get("", {"dirs": []})["dirs"],
+        }
+        try:
+            with open(f"{filepath}.{os.getpid()}.tmp", "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(f"{filepath}.{os.getpid()}.tmp", filepath)
+        except OSError:
+            pass
+        return data
+
+    @staticmethod
+    def get_passwords(path: str, incomplete: str) -> list[str]:
+        """Get password names matching an incomplete filter, best match first
+
+        Args:
+            path (str): working directory
+            incomplete (str): incomplete filter
+
+        Returns:
+            list[str]: quoted password names
+        """
+        keys = completion.load_cache(path)["keys"]
+        return [f"\"{keys[position][1]}\"" for (score, position) in SearchIndex(keys).rank(incomplete)]
+
+    @staticmethod
+    def get_folders(path: str, incomplete: str) -> list[str]:
+        """Get folder names containing an incomplete value
+
+        Args:
+            path (str): working directory
+            incomplete (str): incomplete folder name
+
+        Returns:
+            list[str]: quoted folder names
+        """
+        folders = completion.load_cache(path)["folders"]
+        return [f"\"{name}\"" for name in folders if incomplete.lower() in name.lower()]
+
+    @staticmethod
+    def get_stores(incomplete: str) -> list[str]:
+        """Get store names containing an incomplete value
+
+        Args:
+            incomplete (str): incomplete store name
+
+        Returns:
+            list[str]: store names
+        """
+        return [name for name in app.sections() if incomplete.lower() in name.lower()]
+
+    @staticmethod
+    def complete(instruction: str) -> bool:
+        """Answer a shell completion request, when it can be handled without the full cli
+
+        Args:
+            instruction (str): value of the completion environment variable (bash_complete, ...)
+
+        Returns:
+            bool: True if the completion has been answered
+        """
+        if instruction not in ("bash_complete", "zsh_complete"):
+            return False
+        try:
+            cwords = completion.split_arg_string(os.environ["COMP_WORDS"])
+            cword = int(os.environ["COMP_CWORD"])
+        except (KeyError, ValueError):
+            return False
+        args = cwords[1:cword]
+        incomplete = cwords[cword] if cword < len(cwords) else ""
+        if incomplete.startswith("-"):
+            return False
+        (kind, context) = completion.parse(args)
+        if kind is None:
+            return False
+        if kind == "store":
+            values = completion.get_stores(incomplete)
+        else:
+            path = completion.get_store_path(context)
+            if path is None:
+                values = []
+            elif kind == "filter":
+                values = completion.get_passwords(path, incomplete)
+            else:
+                values = completion.get_folders(path, incomplete)
+        if instruction == "bash_complete":
+            lines = [f"plain,{value}" for value in values]
+        else:
+            lines = [f"plain\n{value}\n_" for value in values]
+        print("\n".join(lines))
+        return True
+
+    @staticmethod
+    def describe(cli, complete_folder) -> dict:
+        """Build the command tables of the completion class from the click command tree
+        Only used to check the tables (see check): completions never load click
+
+        Args:
+            cli (click.Group): root command
+            complete_folder (function): shell completion function of folder names
+
+        Returns:
+            dict: commands, filter_commands, value_options, flag_options, global_flags and global_values tables
+        """
+        import click
+
+        def get_options(command) -> (dict, tuple):
+            values = {}
+            flags = ()
+            for param in command.params:
+                if not isinstance(param, click.Option) or param.is_eager:
+                    # --help and --version stop the command
+                    continue
+                names = tuple(name for name in param.opts + param.secondary_opts)
+                if param.is_flag or param.count:
+                    flags += names
+                else:
+                    values.update({name: param._custom_shell_complete is complete_folder for name in names})
+            return (values, flags)
+
+        tables = {"commands": {}, "filter_commands": (), "value_options": {}, "flag_options": {}}
+        (values, flags) = get_options(cli)
+        tables["global_flags"] = flags
+        tables["global_values"] = tuple(values)
+        stack = [("", cli)]
+        while len(stack) != 0:
+            (group_path, group) = stack.pop(0)
+            tables["commands"][group_path] = list(group.commands)
+            for (name, command) in group.commands.items():
+                command_path = name if group_path == "" else f"{group_path} {name}"
+                if isinstance(command, click.Group):
+                    stack.append((command_path, command))
+                    continue
+                if any(isinstance(param, click.Argument) and param.name == "filter" for param in command.params):
+                    tables["filter_commands"] += (command_path,)
+                (values, flags) = get_options(command)
+                if len(values) != 0:
+                    tables["value_options"][command_path] = values
+                if len(flags) != 0:
+                    tables["flag_options"][command_path] = flags
+        return tables
+
+    @staticmethod
+    def check(cli, complete_folder) -> list[str]:
+        """Compare the command tables of the completion class with the click command tree
+
+        Args:
+            cli (click.Group): root command
+            complete_folder (function): shell completion function of folder names
+
+        Returns:
+            list[str]: differences (empty if tables are in sync)
+        """
+        differences = []
+        for (name, expected) in completion.describe(cli, complete_folder).items():
+            actual = getattr(completion, name)
+            if isinstance(expected, dict):
+                keys = sorted(set(expected) | set(actual))
+                differences += [f"{name}[{key!r}]: {actual.get(key)!r} != {expected.get(key)!r}"
+                                for key in keys if actual.get(key) != expected.get(key)]
+            elif tuple(actual) != tuple(expected):
+                differences.append(f"{name}: {actual!r} != {expected!r}")
+        return differences
@@ -0,0 +1,328 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Resident ppass agent, serving commands over a Unix socket
+The client side only depends on the standard library, so that commands are forwarded without loading the full cli
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+
+from ..appInfo import app
+
+
+class agent:
+    """Static class for the ppass agent
+
+    The agent is a long-running process, in the spirit of ssh-agent. It keeps in memory the loaded cli, the GPG
+    session, the store indexes and, for a short time, the decrypted contents. Read-only commands in JSON mode are
+    forwarded to it by the cli when it is running, and run locally otherwise.
+    The socket is only accessible to the user running the agent.
+    """
+    # Forwarded commands (read-only, no prompt nor side effect)
+    commands: tuple = ("list", "show", "folders list")
+    connect_timeout: float = 0.5
+    request_timeout: float = 60
+    state: dict = {}
+
+    @staticmethod
+    def get_sockpath() -> str:
+        """Get the agent socket path, in the user runtime directory if any
+
+        Returns:
+            str: socket path
+        """
+        runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+        if runtime_dir != "":
+            return os.path.join(runtime_dir, app.name(), "agent.sock")
+        return os.path.join(app.default_cachepath(), "agent.sock")
+
+    @staticmethod
+    def get_command(args: list[str]) -> (str, bool):
+        """Get the command of cli arguments
+
+        Args:
+            args (list[str]): cli arguments, without program name
+
+        Returns:
+            (str, bool): tuple of full command path (aliases resolved, "" if unknown), is JSON mode
+        """
+        from ..completion import completion
+        is_json = False
+        position = 0
+        while position < len(args) and args[position].startswith("-"):
+            if args[position] in completion.global_values:
+                position += 2
+            elif args[position] in completion.global_flags:
+                is_json = is_json or args[position] in ("--json", "--ndjson")
+                position += 1
+            else:
+                return ("", False)
+        command = ""
+        while position < len(args) and command in completion.commands:
+            command = completion.resolve(command, args[position])
+            if command is None:
+                return ("", False)
+            position += 1
+        return (command, is_json)
+
+    @staticmethod
+    def request(message: dict, timeout: float = None) -> dict:
+        """Send a request to the agent
+
+        Args:
+            message (dict): request
+            timeout (float, optional): maximum duration of the request (seconds). Defaults to request_timeout.
+
+        Returns:
+            dict: response, None if the agent is not running
+        """
+        sockpath = agent.get_sockpath()
+        if not os.path.exists(sockpath):
+            return None
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.settimeout(agent.connect_timeout)
+            client.connect(sockpath)
+            client.settimeout(timeout or agent.request_timeout)
+            client.sendall(json.dumps(message).encode() + b"\n")
+            client.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return json.loads(b"".join(chunks))
+        except (OSError, ValueError):
+            return None
+        finally:
+            client.close()
+
+    @staticmethod
+    def forward(args: list[str]) -> int:
+        """Run a command in the agent, if it is running and the command can be forwarded
+
+        Args:
+            args (list[str]): cli arguments, without program name
+
+        Returns:
+            int: exit code, None if the command must run locally
+        """
+        if "--help" in args or "--version" in args or os.environ.get("PPASS_NO_AGENT", "") != "":
+            return None
+        (command, is_json) = agent.get_command(args)
+        if not is_json or command not in agent.commands:
+            return None
+        response = agent.request({"args": args})
+        if response is None or "code" not in response:
+            # Agent stopped or crashed: the command is read-only, it can run again locally
+            return None
+        sys.stdout.write(response["stdout"])
+        sys.stderr.write(response["stderr"])
+        return response["code"]
+
+    @staticmethod
+    def start(ttl: int):
+        """Start the agent in a detached process, and wait until it answers
+
+        Args:
+            ttl (int): lifetime of decrypted contents in memory (seconds)
+        """
+        import subprocess
+        assert (agent.request({"control": "status"}) is None), "Agent is already running"
+        code = "import sys; from ppass.modules.agent import agent; agent.serve(int(sys.argv[1]))"
+        subprocess.Popen([sys.executable, "-c", code, str(ttl)], stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            status = agent.request({"control": "status"})
+            if status is not None:
+                return status
+            time.sleep(0.05)
+        raise AssertionError("Agent did not start")
+
+    @staticmethod
+    def stop() -> dict:
+        """Stop the agent
+
+        Returns:
+            dict: last agent status
+        """
+        status = agent.request({"control": "stop"})
+        assert (status is not None), "Agent is not running"
+        return status
+
+    @staticmethod
+    def status() -> dict:
+        """Get the agent status
+
+        Returns:
+            dict: pid, socket path, start time, lifetime of cached contents, number of requests and cached contents
+        """
+        status = agent.request({"control": "status"})
+        assert (status is not None), "Agent is not running"
+        return status
+
+    @staticmethod
+    def create_socket() -> socket.socket:
+        """Create the listening socket, only accessible to the current user
+
+        Returns:
+            socket.socket: listening socket
+        """
+        sockpath = agent.get_sockpath()
+        os.makedirs(os.path.dirname(sockpath), mode=0o700, exist_ok=True)
+        os.chmod(os.path.dirname(sockpath), 0o700)
+        if os.path.exists(sockpath):
+            # Left by an agent which did not stop cleanly
+            assert (agent.request({"control": "status"}) is None), "Agent is already running"
+            os.remove(sockpath)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            server.bind(sockpath)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        return server
+
+    @staticmethod
+    def get_peer_uid(conn: socket.socket) -> int:
+        """Get the user id of the process connected to the socket (Linux only)
+
+        Args:
+            conn (socket.socket): connection
+
+        Returns:
+            int: user id, current user id if not available
+        """
+        if not hasattr(socket, "SO_PEERCRED"):
+            return os.getuid()
+        credentials = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", credentials)[1]
+
+    @staticmethod
+    def run_command(args: list[str]) -> dict:
+        """Run a cli command in the agent process, capturing its output
+
+        Args:
+            args (list[str]): cli arguments, without program name
+
+        Returns:
+            dict: exit code, stdout and stderr
+        """
+        import io
+        import click
+        import contextlib
+        from ..app import cli
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                cli.main(args=args, prog_name=app.name(), standalone_mode=False, obj={})
+                code = 0
+            except SystemExit as error:
+                code = error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+            except click.exceptions.Exit as error:
+                code = error.exit_code
+            except click.exceptions.ClickException as error:
+                error.show()
+                code = error.exit_code
+            except click.exceptions.Abort:
+                code = 1
+            except Exception as error:
+                print(f"ERROR: {error}", file=sys.stderr)
+                code = 2
+        return {"code": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+    @staticmethod
+    def handle(conn: socket.socket) -> bool:
+        """Answer a request
+
+        Args:
+            conn (socket.socket): connection
+
+        Returns:
+            bool: False if the agent must stop
+        """
+        from .gpg import gpg
+        if agent.get_peer_uid(conn) != os.getuid():
+            return True
+        chunks = []
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        message = json.loads(b"".join(chunks))
+        agent.state["requests"] += 1
+        if "args" in message:
+            (command, is_json) = agent.get_command(message["args"])
+            if is_json and command in agent.commands:
+                response = agent.run_command(message["args"])
+            else:
+                response = {"code": 2, "stdout": "", "stderr": "ERROR: Command cannot run in agent\n"}
+        else:
+            response = dict(agent.state, cached=len(gpg.cache))
+        conn.sendall(json.dumps(response).encode())
+        return message.get("control", "") != "stop"
+
+    @staticmethod
+    def serve(ttl: int):
+        """Serve requests until stopped
+        Run in a detached process by start
+
+        Args:
+            ttl (int): lifetime of decrypted contents in memory (seconds)
+        """
+        import signal
+        from .gpg import gpg
+        from .index import index
+        from .passwords import passwords
+        from ..app import cli  # noqa: F401 (loaded once, before the first request)
+        server = agent.create_socket()
+        server.settimeout(1)
+        gpg.configure_cache(ttl)
+        index.memory = {}
+        passwords.memory = {}
+        agent.state = {"pid": os.getpid(), "socket": agent.get_sockpath(), "started": time.time(), "ttl": ttl,
+                       "requests": 0}
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        running = True
+        try:
+            while running:
+                gpg.purge_cache()
+                try:
+                    (conn, address) = server.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    try:
+                        conn.settimeout(agent.request_timeout)
+                        running = agent.handle(conn)
+                    except (OSError, ValueError):
+                        pass
+        finally:
+            gpg.configure_cache(0)
+            server.close()
+            if os.path.exists(agent.get_sockpath()):
+                os.remove(agent.get_sockpath())
@@ -0,0 +1,167 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Conversion between ASCII armored and binary OpenPGP files
+"""
+
+import os
+import re
+import binascii
+
+
+class armor:
+    """Static class for OpenPGP ASCII armor (RFC 4880, section 6)
+
+    Armor is only an encoding of the binary OpenPGP data: files are converted without being decrypted, so neither
+    gpg nor the secret key is needed. Base64 is done by binascii, and the checksum with a lookup table: conversion
+    is CPU bound, files are converted one after the other.
+    """
+    prefix: bytes = b"-----BEGIN PGP"
+    header: str = "-----BEGIN PGP MESSAGE-----"
+    footer: str = "-----END PGP MESSAGE-----"
+    # 48 bytes per line, encoded to 64 characters
+    line_bytes: int = 48
+    base64_pattern: re.Pattern = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+    crc24_table: list[int] = None
+
+    @staticmethod
+    def is_armored(filepath: str) -> bool:
+        """Check if a gpg file is ASCII armored
+
+        Args:
+            filepath (str): path of gpg file
+
+        Returns:
+            bool: True if armored, False if binary OpenPGP
+        """
+        with open(filepath, "rb") as stream:
+            return stream.read(len(armor.prefix)) == armor.prefix
+
+    @staticmethod
+    def crc24(data: bytes) -> int:
+        """Compute the armor checksum, one table lookup per byte
+
+        Args:
+            data (bytes): binary OpenPGP data
+
+        Returns:
+            int: CRC-24 of data
+        """
+        table = armor.crc24_table
+        if table is None:
+            table = []
+            for byte in range(256):
+                crc = byte << 16
+                for _ in range(8):
+                    crc <<= 1
+                    if crc & 0x1000000:
+                        crc ^= 0x1864CFB
+                table.append(crc & 0xFFFFFF)
+            armor.crc24_table = table
+        crc = 0xB704CE
+        for byte in data:
+            crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ byte]
+        return crc
+
+    @staticmethod
+    def encode(data: bytes) -> str:
+        """Armor binary OpenPGP data
+
+        Args:
+            data (bytes): binary OpenPGP data
+
+        Returns:
+            str: armored data
+        """
+        body = b"".join(binascii.b2a_base64(data[i:i + armor.line_bytes])
+                        for i in range(0, len(data), armor.line_bytes))
+        checksum = binascii.b2a_base64(armor.crc24(data).to_bytes(3, "big"), newline=False)
+        return f"{armor.header}\n\n{body.decode('ascii')}={checksum.decode('ascii')}\n{armor.footer}\n"
+
+    @staticmethod
+    def decode(text: str) -> bytes:
+        """Remove armor of OpenPGP data
+
+        Args:
+            text (str): armored data
+
+        Returns:
+            bytes: binary OpenPGP data
+        """
+        lines = [line.strip() for line in text.strip().splitlines()]
+        assert (len(lines) >= 3 and lines[0] == armor.header and lines[-1] == armor.footer), "Invalid armored data"
+        # Armor headers end with the first blank line
+        start = lines.index("") + 1 if "" in lines else 1
+        body = lines[start:-1]
+        checksum = None
+        if len(body) != 0 and body[-1].startswith("="):
+            checksum = body.pop()[1:]
+        body = "".join(body)
+        # a2b_base64 ignores invalid characters
+        assert (armor.base64_pattern.fullmatch(body) is not None), "Invalid armored data"
+        try:
+            data = binascii.a2b_base64(body)
+            checksum = None if checksum is None else int.from_bytes(binascii.a2b_base64(checksum), "big")
+        except binascii.Error as error:
+            raise AssertionError(f"Invalid armored data: {error}")
+        assert (checksum is None or checksum == armor.crc24(data)), "Invalid armor checksum"
+        return data
+
+    @staticmethod
+    def convert_file(filepath: str, armored: bool) -> bool:
+        """Convert a gpg file to armored or binary format
+        The file is replaced atomically
+
+        Args:
+            filepath (str): path of gpg file
+            armored (bool): if True, convert to armored format, else to binary format
+
+        Returns:
+            bool: True if converted, False if already in the requested format
+        """
+        if armor.is_armored(filepath) == armored:
+            return False
+        with open(filepath, "rb") as f:
+            content = f.read()
+        if armored:
+            content = armor.encode(content).encode("ascii")
+        else:
+            content = armor.decode(content.decode("ascii"))
+        tmppath = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmppath, "wb") as f:
+            f.write(content)
+        os.replace(tmppath, filepath)
+        return True
+
+    @staticmethod
+    def convert_many(filepaths: list[str], armored: bool) -> list:
+        """Convert several gpg files to armored or binary format
+
+        Args:
+            filepaths (list[str]): paths of gpg files
+            armored (bool): if True, convert to armored format, else to binary format
+
+        Returns:
+            list: for each file, in input order, True if converted, False if unchanged, or the Exception raised
+        """
+        results = []
+        for filepath in filepaths:
+            try:
+                results.append(armor.convert_file(filepath, armored))
+            except Exception as error:
+                results.append(error)
+        return results
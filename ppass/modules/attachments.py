@@ -0,0 +1,144 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Binary attachments of password files
+"""
+
+import os
+import shutil
+
+from .gpg import gpg
+
+
+class AttachmentItem:
+    """Helper class for attachment file
+    Immutable
+    """
+    __slots__ = ("path", "name", "size")
+
+    def __init__(self, path: str, name: str, size: int):
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "size", size)
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("AttachmentItem is immutable")
+
+    def __getitem__(self, key: str):
+        if key not in AttachmentItem.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_json(self) -> dict:
+        """Convert object to JSON
+
+        Returns:
+            dict: attachment in json format
+        """
+        return {"path": self.path, "name": self.name, "size": self.size}
+
+
+class attachments:
+    """Static class for attachments
+
+    Attachments of <folder>/<name>.gpg are saved encrypted in <folder>/.attachments/<name>/. Being in a hidden
+    directory, they are never listed as password files.
+    """
+
+    @staticmethod
+    def get_dir(item) -> str:
+        """Get the attachments directory of a password file
+
+        Args:
+            item (PasswordItem): password file
+
+        Returns:
+            str: attachments directory
+        """
+        return os.path.join(item.root, ".attachments", item.f_name)
+
+    @staticmethod
+    def get_list(item) -> list[AttachmentItem]:
+        """Get the attachments of a password file
+
+        Args:
+            item (PasswordItem): password file
+
+        Returns:
+            list[AttachmentItem]: list of attachments, sorted by name
+        """
+        dirpath = attachments.get_dir(item)
+        if not os.path.isdir(dirpath):
+            return []
+        items = []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".gpg"):
+                    items.append(AttachmentItem(entry.path, entry.name[:-len(".gpg")], entry.stat().st_size))
+        items.sort(key=lambda a: a.name)
+        return items
+
+    @staticmethod
+    def add(item, source: str, name: str, identity: str) -> str:
+        """Encrypt a file as attachment of a password file
+
+        Args:
+            item (PasswordItem): password file
+            source (str): path of file to attach, or "-" for stdin
+            name (str): attachment name
+            identity (str): gpg identity
+
+        Returns:
+            str: attachment path
+        """
+        assert (name.strip() != "" and os.sep not in name), f"Incorrect attachment name <{name}>"
+        dirpath = attachments.get_dir(item)
+        filepath = os.path.join(dirpath, name + ".gpg")
+        assert (not os.path.exists(filepath)), f"Attachment <{name}> already exists"
+        os.makedirs(dirpath, exist_ok=True)
+        gpg.encrypt_stream(source, identity, filepath)
+        return filepath
+
+    @staticmethod
+    def extract(attachment: AttachmentItem, output: str):
+        """Decrypt an attachment
+
+        Args:
+            attachment (AttachmentItem): attachment
+            output (str): path of decrypted file, or "-" for stdout
+        """
+        assert (output == "-" or not os.path.exists(output)), f"File <{output}> already exists"
+        gpg.decrypt_stream(attachment.path, output)
+
+    @staticmethod
+    def delete_all(item) -> bool:
+        """Delete all attachments of a password file
+
+        Args:
+            item (PasswordItem): password file
+
+        Returns:
+            bool: True if there were attachments
+        """
+        dirpath = attachments.get_dir(item)
+        if not os.path.isdir(dirpath):
+            return False
+        shutil.rmtree(dirpath)
+        parent = os.path.dirname(dirpath)
+        if len(os.listdir(parent)) == 0:
+            os.rmdir(parent)
+        return True
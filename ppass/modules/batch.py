@@ -0,0 +1,140 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Batch modification of password files
+"""
+
+import os
+import json
+
+from .gpg import gpg
+from .utils import utils
+
+
+class batch:
+    """Static class for batch modifications
+
+    A batch is a list of operations, one JSON object per line:
+        {"name": "<folder>/<name>", "user": "...", "url": "...", "comment": "...", "password": "..."}
+    Only given fields are modified. "generate": true replaces the password with a random one.
+
+    A batch is applied in all-or-nothing steps: all files are decrypted, then all new contents are encrypted to
+    temporary files, then temporary files are renamed over password files. Nothing is modified if a decryption or
+    an encryption fails, and a crash never leaves a password file partially written.
+    """
+    fields: tuple = ("user", "url", "comment", "password")
+
+    @staticmethod
+    def read_operations(lines) -> list[dict]:
+        """Parse and validate batch operations
+
+        Args:
+            lines: iterable of JSON lines (blank lines are ignored)
+
+        Returns:
+            list[dict]: list of operations
+        """
+        operations = []
+        names = set()
+        for (number, line) in enumerate(lines, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                operation = json.loads(line)
+            except ValueError as error:
+                raise AssertionError(f"Line {number}: invalid JSON ({error})")
+            assert (isinstance(operation, dict)), f"Line {number}: operation must be a JSON object"
+            name = operation.get("name", "")
+            assert (isinstance(name, str) and name.strip().strip("/") != ""), f"Line {number}: missing password name"
+            # Same password file for "a/b", "/a/b" or "a//b/"
+            name = os.path.normpath(name.strip().strip("/"))
+            assert (not os.path.isabs(name) and name != ".." and not name.startswith(f"..{os.sep}")), \
+                f"Line {number}: password <{operation['name']}> is outside of the store"
+            operation["name"] = name
+            unknown = [key for key in operation if key not in batch.fields + ("name", "generate")]
+            assert (len(unknown) == 0), f"Line {number}: unknown fields {', '.join(unknown)}"
+            assert (all(isinstance(operation[key], str) for key in batch.fields if key in operation)), \
+                f"Line {number}: field values must be strings"
+            assert (not (operation.get("generate", False) and "password" in operation)), \
+                f"Line {number}: password and generate cannot be used together"
+            assert (name not in names), f"Line {number}: password <{name}> is already modified by this batch"
+            names.add(name)
+            operations.append(operation)
+        return operations
+
+    @staticmethod
+    def apply(path: str, operations: list[dict], identity: str, username_prefix: str, url_prefix: str,
+              get_content, workers: int = 0) -> list[str]:
+        """Apply batch operations
+
+        Args:
+            path (str): working directory
+            operations (list[dict]): list of operations, see read_operations
+            identity (str): gpg identity
+            username_prefix (str): prefix for username line
+            url_prefix (str): prefix for url line
+            get_content: function returning file content from (password, user, url, comment)
+            workers (int, optional): maximum number of parallel gpg processes. Defaults to 0 (one per cpu, up to 8).
+
+        Returns:
+            list[str]: paths of modified password files
+        """
+        filepaths = [os.path.join(path, operation["name"].strip("/") + ".gpg") for operation in operations]
+        root = os.path.abspath(path)
+        for (operation, filepath) in zip(operations, filepaths):
+            assert (os.path.commonpath([root, os.path.abspath(filepath)]) == root), \
+                f"Password <{operation['name']}> is outside of the store"
+            assert (os.path.isfile(filepath)), f"Password <{operation['name']}> does not exist"
+        if len(filepaths) == 0:
+            return []
+        if workers <= 0:
+            workers = min(8, os.cpu_count() or 1)
+        # DECRYPT
+        passwords = gpg.decrypt_many(filepaths, username_prefix, url_prefix, workers)
+        for (operation, password) in zip(operations, passwords):
+            if isinstance(password, Exception):
+                raise AssertionError(f"Password <{operation['name']}> cannot be decrypted: {password}")
+        contents = []
+        for (operation, password) in zip(operations, passwords):
+            new_password = utils.generate_password() if operation.get("generate", False) \
+                else operation.get("password", password.password)
+            contents.append(get_content(new_password, operation.get("user", password.username),
+                                        operation.get("url", password.url),
+                                        operation.get("comment", password.comment)))
+        # ENCRYPT TO TEMPORARY FILES
+        tmppaths = [f"{filepath}.{os.getpid()}.tmp" for filepath in filepaths]
+
+        def encrypt(args: tuple):
+            (content, tmppath) = args
+            try:
+                gpg.encrypt_to_file(content, identity, tmppath)
+            except Exception as error:
+                return error
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(workers, len(filepaths))) as executor:
+            errors = list(executor.map(encrypt, zip(contents, tmppaths)))
+        if any(error is not None for error in errors):
+            for tmppath in tmppaths:
+                if os.path.exists(tmppath):
+                    os.remove(tmppath)
+            (operation, error) = next((o, e) for (o, e) in zip(operations, errors) if e is not None)
+            raise AssertionError(f"Password <{operation['name']}> cannot be encrypted: {error}")
+        # REPLACE
+        for (tmppath, filepath) in zip(tmppaths, filepaths):
+            os.replace(tmppath, filepath)
+        return filepaths
@@ -19,17 +19,48 @@
 """
 
 import os
+import json
 import shutil
 
+from .index import index
+
 
 # TODO rename class
-class FolderItem(dict):
+class FolderItem:
     """Helper class for folder item
+    Immutable
     """
+    __slots__ = ("path", "name")
+
     def __init__(self, path: str, name: str):
-        dict.__init__(self, path=path, name=name)
-        self.path = path
-        self.name = name
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "name", name)
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("FolderItem is immutable")
+
+    def __getitem__(self, key: str):
+        # Compatibility with the former dict based item
+        if key not in FolderItem.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FolderItem) and (self.path, self.name) == (other.path, other.name)
+
+    def __hash__(self) -> int:
+        return hash((self.path, self.name))
+
+    def __repr__(self) -> str:
+        return f"FolderItem({self.path!r})"
+
+    def to_json(self) -> json:
+        """Convert object to JSON
+
+        Returns:
+            json: folder in json format
+        """
+        return {"path": self.path, "name": self.name}
 
 
 # TODO rename class
@@ -38,17 +69,21 @@ class folders:
     """
 
     @staticmethod
-    def get_list(path: str) -> list[FolderItem]:
+    def get_list(path: str, use_index: bool = True) -> list[FolderItem]:
         """Get the list of folders
 
         Args:
             path (str): working directory
+            use_index (bool, optional): if True, read folders from the store index. Defaults to True.
 
         Returns:
             list[FolderItem]: list of folders
         """
         assert (os.path.exists(path)), f"Path <{path}> does not exist"
         assert (os.path.isdir(path)), f"Path <{path}> is not a valid directory"
+        if use_index:
+            root = index.refresh(path).get("", {"dirs": []})
+            return list(map(lambda p: FolderItem(os.path.join(path, p), p), root["dirs"]))
         paths = os.listdir(path)
         paths.sort()
         # Remove hidden folders
@@ -19,24 +19,56 @@
 """
 
 import os
+import sys
+import json
+import time
+import fcntl
 import subprocess
 
+from .gitbackend import GitBackend, SubprocessBackend, DulwichBackend
+
 
 class git:
     """Static class for git actions
+
+    Git operations are run by the configured backend (see gitbackend module).
+    Commits are local: pushes go through a queue, drained by a detached worker process. The worker pushes the
+    branch head (all queued commits at once), retrying with backoff while the remote is unreachable. At most one
+    worker runs and one waits for it, so that no queued push is missed.
+    Optionally, remote is also fetched in the background (prefetch), and the store fast-forwarded when it is safe.
+    Repository maintenance (repack, commit-graph, multi-pack-index, prune) also runs in a detached process when due.
     """
+    push_delays: tuple = (5, 15, 30, 60, 120)
+    push_timeout: int = 120
+    maintain_pack_limit: int = 50
+    maintain_expire: int = 14 * 24 * 3600
+    maintain_retry: int = 24 * 3600
+    backends: dict = {"subprocess": SubprocessBackend, "dulwich": DulwichBackend}
+    backend: GitBackend = SubprocessBackend()
+
+    @staticmethod
+    def configure(backend: str):
+        """Set the git backend
+
+        Args:
+            backend (str): backend name (subprocess, dulwich)
+        """
+        assert (backend in git.backends), f"Unknown git backend <{backend}>: use {', '.join(git.backends)}"
+        if git.backend.name != backend:
+            git.backend = git.backends[backend]()
 
     @staticmethod
     def status(path: str):
-        """Return git status
+        """Print git status
 
         Args:
             path (str): working directory
         """
-        subprocess.run(["git", "-C", path, "status"])
+        git.backend.status(path)
 
     @staticmethod
-    def init(path: str, repo: str, branch: str, user: str, mail: str, pull: bool = False):
+    def init(path: str, repo: str, branch: str, user: str, mail: str, pull: bool = False, depth: int = 0,
+             partial: bool = False):
         """Initialise working directory
 
         Args:
@@ -46,15 +78,16 @@ class git:
             user (str): remote git repository user
             mail (str): remote git repository email
             pull (bool, optional): If True, pull git repo instead of creating a new one. Defaults to False.
+            depth (int, optional): if not 0, pulled history is truncated to this number of commits. Defaults to 0.
+            partial (bool, optional): if True, blobs of past commits are not pulled. Defaults to False.
         """
-        subprocess.run(["git", "-C", path, "init"], capture_output=False)
-        subprocess.run(["git", "-C", path, "config", "user.name", user], capture_output=False)
-        subprocess.run(["git", "-C", path, "config", "user.email", mail], capture_output=False)
-        subprocess.run(["git", "-C", path, "remote", "add", "origin", repo], capture_output=False)
+        git.backend.init(path, branch)
+        git.backend.set_config(path, "user", "name", user)
+        git.backend.set_config(path, "user", "email", mail)
+        git.backend.add_remote(path, "origin", repo)
         if pull:
-            git.pull(path, branch)
+            assert git.backend.pull(path, branch, depth, partial), "Pull from remote failed"
         else:
-            subprocess.run(["git", "-C", path, "branch", "-M", branch], capture_output=False)
             fpath = os.path.join(path, ".gitignore")
             f = open(fpath, "w")
             f.close()
@@ -66,9 +99,14 @@ class git:
 
         Args:
             path (str): working directory
+            branch (str): pull branch
         """
-        subprocess.run(["git", "-C", path, "pull", "origin", branch])
-        subprocess.run(["git", "-C", path, "checkout", branch])
+        pulled = git.backend.pull(path, branch)
+        if not pulled and git.is_shallow(path) and git.ensure_history(path, branch):
+            pulled = git.backend.pull(path, branch)
+        assert pulled, "Pull from remote failed"
+        if os.path.exists(git.get_statepath(path, "fetch")):
+            git.update_state(path, "fetch", behind=0)
 
     @staticmethod
     def push(path: str, branch: str):
@@ -78,7 +116,8 @@ class git:
             path (str): working directory
             branch (str): push branch
         """
-        subprocess.run(["git", "-C", path, "push", "-u", "origin", branch])
+        (pushed, error) = git.backend.push(path, branch)
+        assert pushed, "Push to remote failed" + (f": {error}" if error != "" else "")
 
     @staticmethod
     def sync(path: str, branch: str):
@@ -92,14 +131,384 @@ class git:
         git.push(path, branch)
 
     @staticmethod
-    def commit(path: str, message: str, branch: str):
-        """Commit and push changes to remote
+    def stage(path: str, added: list[str] = (), removed: list[str] = ()):
+        """Stage changes of given paths only
+
+        Args:
+            path (str): working directory
+            added (list[str], optional): paths of created or modified files. Defaults to ().
+            removed (list[str], optional): paths of deleted files or directories (recursive). Defaults to ().
+        """
+        if len(added) != 0:
+            git.backend.add(path, list(added))
+        if len(removed) != 0:
+            git.backend.remove(path, list(removed))
+
+    @staticmethod
+    def commit(path: str, message: str, branch: str, added: list[str] = None, removed: list[str] = None) -> bool:
+        """Commit changes, then queue a push to remote
+        If paths are given, only they are staged, else the whole working directory is
 
         Args:
             path (str): working directory
             message (str): commit message
             branch (str): commit branch
+            added (list[str], optional): paths of created or modified files. Defaults to None.
+            removed (list[str], optional): paths of deleted files or directories. Defaults to None.
+
+        Returns:
+            bool: False if there was nothing to commit (no push is then queued)
         """
-        subprocess.run(["git", "-C", path, "add", "."], capture_output=False)
-        subprocess.run(["git", "-C", path, "commit", "-m", message], capture_output=False)
-        git.push(path, branch)
+        with open(os.path.join(path, ".git", "ppass-commit.lock"), "w") as commit_lock:
+            # Held until HEAD is updated: the background fast-forward (fetch_worker) cannot move it meanwhile
+            fcntl.flock(commit_lock, fcntl.LOCK_EX)
+            if added is None and removed is None:
+                git.backend.add_all(path)
+            else:
+                git.stage(path, added or (), removed or ())
+            if not git.backend.commit(path, message):
+                return False
+        git.queue_push(path, branch)
+        return True
+
+    @staticmethod
+    def is_shallow(path: str) -> bool:
+        """Check if the history of the store is truncated (shallow clone)
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            bool: True if history is truncated
+        """
+        return os.path.exists(os.path.join(path, ".git", "shallow"))
+
+    @staticmethod
+    def ensure_history(path: str, branch: str) -> bool:
+        """Fetch the full history of a shallow store, if local and remote branches have no common commit in it
+        History is only needed to merge branches which diverged before the truncation
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            bool: True if history has been fetched
+        """
+        if not git.is_shallow(path) or git.backend.has_merge_base(path, branch):
+            return False
+        (fetched, error) = git.backend.unshallow(path, branch)
+        return fetched
+
+    @staticmethod
+    def get_ref(path: str, ref: str) -> str:
+        """Get the commit of a reference
+
+        Args:
+            path (str): working directory
+            ref (str): git reference
+
+        Returns:
+            str: commit hash, empty if the reference does not exist
+        """
+        return git.backend.get_ref(path, ref)
+
+    @staticmethod
+    def get_statepath(path: str, name: str) -> str:
+        """Get a state file of a store (in .git, never committed)
+
+        Args:
+            path (str): working directory
+            name (str): state name (push, fetch)
+
+        Returns:
+            str: state file path
+        """
+        return os.path.join(path, ".git", f"ppass-{name}.json")
+
+    @staticmethod
+    def load_state(path: str, name: str) -> dict:
+        """Load a state file
+
+        Args:
+            path (str): working directory
+            name (str): state name (push, fetch)
+
+        Returns:
+            dict: state values (empty if never saved)
+        """
+        try:
+            with open(git.get_statepath(path, name), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def update_state(path: str, name: str, **values):
+        """Update a state file
+
+        Args:
+            path (str): working directory
+            name (str): state name (push, fetch)
+            values: state values to set
+        """
+        filepath = git.get_statepath(path, name)
+        state = git.load_state(path, name)
+        state.update(values)
+        with open(f"{filepath}.{os.getpid()}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{filepath}.{os.getpid()}.tmp", filepath)
+
+    @staticmethod
+    def queue_push(path: str, branch: str):
+        """Queue a push to remote, and start the push worker
+        Returns immediately
+
+        Args:
+            path (str): working directory
+            branch (str): push branch
+        """
+        if not os.path.isdir(os.path.join(path, ".git")):
+            return
+        git.update_state(path, "push", state="queued", branch=branch, queued=time.time())
+        git.start_worker("push_worker", path, branch)
+
+    @staticmethod
+    def start_worker(worker: str, *args: str):
+        """Start a git worker in a detached process
+
+        Args:
+            worker (str): name of git static method to run, with the current backend
+            args (str): worker arguments
+        """
+        code = ("import sys; from ppass.modules.git import git; "
+                f"git.configure(sys.argv[1]); git.{worker}(*sys.argv[2:])")
+        subprocess.Popen([sys.executable, "-c", code, git.backend.name] + list(args), stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+
+    @staticmethod
+    def push_worker(path: str, branch: str):
+        """Drain the push queue: push until the remote branch is up to date, retrying with backoff
+        Run in a detached process by queue_push
+
+        Args:
+            path (str): working directory
+            branch (str): push branch
+        """
+        lockdir = os.path.join(path, ".git")
+        with open(os.path.join(lockdir, "ppass-push-wait.lock"), "w") as wait_lock:
+            try:
+                fcntl.flock(wait_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # A worker is already waiting: it will push all commits made until now
+                return
+            run_lock = open(os.path.join(lockdir, "ppass-push-run.lock"), "w")
+            fcntl.flock(run_lock, fcntl.LOCK_EX)
+        with run_lock:
+            attempt = 0
+            while True:
+                head = git.get_ref(path, branch)
+                if head == "" or head == git.get_ref(path, f"origin/{branch}"):
+                    git.update_state(path, "push", state="done", attempts=attempt)
+                    return
+                git.update_state(path, "push", state="pushing", attempts=attempt + 1, last_attempt=time.time())
+                (pushed, error) = git.backend.push(path, branch, quiet=True, timeout=git.push_timeout)
+                if pushed:
+                    attempt = 0
+                    git.update_state(path, "push", last_push=time.time(), last_error="")
+                    continue
+                if attempt >= len(git.push_delays):
+                    git.update_state(path, "push", state="failed", last_error=error)
+                    return
+                git.update_state(path, "push", state="retrying", last_error=error,
+                                 next_attempt=time.time() + git.push_delays[attempt])
+                time.sleep(git.push_delays[attempt])
+                attempt += 1
+
+    @staticmethod
+    def prefetch(path: str, branch: str, interval: int) -> dict:
+        """Start a background fetch of remote if the last one is older than interval
+        Returns immediately, with the state of the last fetch
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+            interval (int): minimum time between two fetches (seconds)
+
+        Returns:
+            dict: last fetch state (number of commits behind and ahead of remote, time, error)
+        """
+        if not os.path.isdir(os.path.join(path, ".git")):
+            return {}
+        state = git.load_state(path, "fetch")
+        if time.time() - state.get("last_fetch", 0) >= interval:
+            # Saved before starting the worker: commands started meanwhile do not start another one
+            git.update_state(path, "fetch", last_fetch=time.time())
+            git.start_worker("fetch_worker", path, branch)
+        return state
+
+    @staticmethod
+    def fetch_worker(path: str, branch: str):
+        """Fetch remote branch, then fast-forward the store if it is safe
+        Safe means: no local commit nor change to keep, no push nor commit running. Run in a detached process by
+        prefetch
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+        """
+        lockdir = os.path.join(path, ".git")
+        with open(os.path.join(lockdir, "ppass-fetch.lock"), "w") as fetch_lock:
+            try:
+                fcntl.flock(fetch_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+            (fetched, error) = git.backend.fetch(path, branch, git.push_timeout)
+            if not fetched:
+                git.update_state(path, "fetch", error=error)
+                return
+            git.ensure_history(path, branch)
+            (ahead, behind) = git.count_divergence(path, branch)
+            if behind != 0 and ahead == 0:
+                with open(os.path.join(lockdir, "ppass-push-run.lock"), "w") as run_lock, \
+                        open(os.path.join(lockdir, "ppass-commit.lock"), "w") as commit_lock:
+                    try:
+                        # Skipped while a push or a commit runs: it is done again by the next fetch
+                        fcntl.flock(run_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        fcntl.flock(commit_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        if git.backend.is_clean(path):
+                            git.backend.merge_ff(path, branch)
+                            (ahead, behind) = git.count_divergence(path, branch)
+                    except OSError:
+                        pass
+            git.update_state(path, "fetch", ahead=ahead, behind=behind, error="", last_success=time.time())
+
+    @staticmethod
+    def count_divergence(path: str, branch: str) -> (int, int):
+        """Count commits of local branch not in remote branch, and the opposite
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            (int, int): tuple of number of commits ahead, number of commits behind
+        """
+        return git.backend.count_divergence(path, branch)
+
+    @staticmethod
+    def get_status(path: str, branch: str) -> dict:
+        """Get the synchronisation status of the store with its remote
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            dict: branch, local and remote heads, number of commits ahead and behind, push and fetch states
+        """
+        head = git.get_ref(path, branch)
+        remote_head = git.get_ref(path, f"origin/{branch}")
+        ahead = 0
+        behind = 0
+        if head != "" and remote_head == "":
+            ahead = git.backend.count_commits(path, branch)
+        elif head != remote_head:
+            (ahead, behind) = git.count_divergence(path, branch)
+        status = {"branch": branch, "head": head, "remote_head": remote_head, "ahead": ahead, "behind": behind}
+        status["push"] = git.load_state(path, "push")
+        status["fetch"] = git.load_state(path, "fetch")
+        return status
+
+    @staticmethod
+    def estimate_loose_objects(path: str) -> int:
+        """Estimate the number of loose objects from one of the 256 object directories (same as git gc --auto)
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            int: approximate number of loose objects
+        """
+        try:
+            return len(os.listdir(os.path.join(path, ".git", "objects", "17"))) * 256
+        except OSError:
+            return 0
+
+    @staticmethod
+    def schedule_maintenance(path: str, loose_limit: int, interval: int) -> bool:
+        """Start the maintenance in the background if it is due
+        Due means: too many loose objects, or last maintenance older than interval. Returns immediately
+
+        Args:
+            path (str): working directory
+            loose_limit (int): number of loose objects triggering maintenance (0 to disable)
+            interval (int): time between two maintenances (seconds, 0 to disable)
+
+        Returns:
+            bool: True if maintenance has been started
+        """
+        if not os.path.isdir(os.path.join(path, ".git")):
+            return False
+        state = git.load_state(path, "maintain")
+        since = time.time() - state.get("last_start", 0)
+        if state.get("state", "done") != "done" and since < git.maintain_retry:
+            # Running, or failed recently
+            return False
+        due_time = interval > 0 and since >= interval
+        # Unreachable objects are only pruned once expired: if they were left by last run, wait before running again
+        due_loose = (loose_limit > 0 and git.estimate_loose_objects(path) >= loose_limit
+                     and (since >= git.maintain_retry or state.get("after", {}).get("loose", 0) < loose_limit))
+        if not (due_time or due_loose):
+            return False
+        git.update_state(path, "maintain", state="queued", last_start=time.time())
+        git.start_worker("maintain_worker", path)
+        return True
+
+    @staticmethod
+    def maintain_worker(path: str):
+        """Run the maintenance, saving its report or error in the maintain state
+        Run in a detached process by schedule_maintenance
+
+        Args:
+            path (str): working directory
+        """
+        try:
+            git.maintain(path)
+        except Exception as error:
+            git.update_state(path, "maintain", state="failed", error=str(error))
+
+    @staticmethod
+    def maintain(path: str) -> dict:
+        """Maintain the repository: pack loose objects, write commit-graph and multi-pack-index, prune
+        Safe while other git commands run. At most one maintenance runs at a time
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dict: object counts before and after, duration of each step (seconds, None if not supported)
+        """
+        lockdir = os.path.join(path, ".git")
+        assert os.path.isdir(lockdir), "Store is not a git repository"
+        with open(os.path.join(lockdir, "ppass-maintain.lock"), "w") as maintain_lock:
+            try:
+                fcntl.flock(maintain_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise AssertionError("Maintenance is already running")
+            start = time.time()
+            git.update_state(path, "maintain", state="running", last_start=start, error="")
+            before = git.backend.count_objects(path)
+            full = before["packs"] >= git.maintain_pack_limit
+            steps = {}
+            for (name, step) in (("repack", lambda: git.backend.repack(path, full)),
+                                 ("commit-graph", lambda: git.backend.write_commit_graph(path)),
+                                 ("multi-pack-index", lambda: git.backend.write_multi_pack_index(path)),
+                                 ("prune", lambda: git.backend.prune(path, git.maintain_expire))):
+                step_start = time.time()
+                done = step()
+                steps[name] = round(time.time() - step_start, 3) if done is not False else None
+            report = {"before": before, "after": git.backend.count_objects(path), "steps": steps,
+                      "full_repack": full, "duration": round(time.time() - start, 3)}
+            git.update_state(path, "maintain", state="done", last_run=time.time(), **report)
+        return report
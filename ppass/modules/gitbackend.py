@@ -0,0 +1,764 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Git backends: the git operations used by ppass, run by the git binary or in process
+"""
+
+import io
+import os
+import subprocess
+
+
+class GitBackend:
+    """Base git backend class
+
+    A backend runs the git operations on a store. Queueing, workers and states are handled by the git class.
+    Relative paths are relative to the working directory.
+    """
+    name: str = ""
+
+    def init(self, path: str, branch: str):
+        """Create the repository, with HEAD on given branch
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+        """
+        raise NotImplementedError
+
+    def set_config(self, path: str, section: str, key: str, value: str):
+        """Set a repository config value
+
+        Args:
+            path (str): working directory
+            section (str): config section
+            key (str): config key
+            value (str): config value
+        """
+        raise NotImplementedError
+
+    def add_remote(self, path: str, name: str, url: str):
+        """Add a remote
+
+        Args:
+            path (str): working directory
+            name (str): remote name
+            url (str): remote url
+        """
+        raise NotImplementedError
+
+    def add(self, path: str, paths: list[str]):
+        """Stage created or modified files (directories are recursive)
+
+        Args:
+            path (str): working directory
+            paths (list[str]): paths to stage
+        """
+        raise NotImplementedError
+
+    def add_all(self, path: str):
+        """Stage all changes of working directory, deletions included
+
+        Args:
+            path (str): working directory
+        """
+        raise NotImplementedError
+
+    def remove(self, path: str, paths: list[str]):
+        """Stage deleted files or directories (recursive)
+
+        Args:
+            path (str): working directory
+            paths (list[str]): paths to unstage
+        """
+        raise NotImplementedError
+
+    def commit(self, path: str, message: str) -> bool:
+        """Commit the staged changes
+        Commit hooks (pre-commit, commit-msg, ...) are run, a rejection by a hook is an error
+
+        Args:
+            path (str): working directory
+            message (str): commit message
+
+        Returns:
+            bool: False if there was nothing to commit
+        """
+        raise NotImplementedError
+
+    def get_ref(self, path: str, ref: str) -> str:
+        """Get the commit of a reference
+
+        Args:
+            path (str): working directory
+            ref (str): git reference (HEAD, branch, remote/branch)
+
+        Returns:
+            str: commit hash, empty if the reference does not exist
+        """
+        raise NotImplementedError
+
+    def count_commits(self, path: str, ref: str) -> int:
+        """Count commits reachable from a reference
+
+        Args:
+            path (str): working directory
+            ref (str): git reference
+
+        Returns:
+            int: number of commits
+        """
+        raise NotImplementedError
+
+    def count_divergence(self, path: str, branch: str) -> (int, int):
+        """Count commits of local branch not in remote branch, and the opposite
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            (int, int): tuple of number of commits ahead, number of commits behind
+        """
+        raise NotImplementedError
+
+    def is_clean(self, path: str) -> bool:
+        """Check that tracked files have no change, staged or not
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            bool: True if there is no change
+        """
+        raise NotImplementedError
+
+    def status(self, path: str):
+        """Print working directory status
+
+        Args:
+            path (str): working directory
+        """
+        raise NotImplementedError
+
+    def fetch(self, path: str, branch: str, timeout: int) -> (bool, str):
+        """Fetch remote branch, without output
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+            timeout (int): maximum duration (seconds)
+
+        Returns:
+            (bool, str): tuple of is fetched, error message
+        """
+        raise NotImplementedError
+
+    def merge_ff(self, path: str, branch: str) -> bool:
+        """Fast-forward local branch and working directory to the fetched remote branch
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            bool: False if local branch cannot be fast-forwarded
+        """
+        raise NotImplementedError
+
+    def pull(self, path: str, branch: str, depth: int = 0, partial: bool = False) -> bool:
+        """Pull remote branch, with output
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+            depth (int, optional): if not 0, history is truncated to this number of commits. Defaults to 0.
+            partial (bool, optional): if True, only the blobs needed are downloaded (blob-less). Defaults to False.
+
+        Returns:
+            bool: is pulled
+        """
+        raise NotImplementedError
+
+    def has_merge_base(self, path: str, branch: str) -> bool:
+        """Check that local history has a common commit with the fetched remote branch
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            bool: True if a common commit is found
+        """
+        raise NotImplementedError
+
+    def unshallow(self, path: str, branch: str) -> (bool, str):
+        """Fetch the full history of a shallow repository, without output
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+
+        Returns:
+            (bool, str): tuple of is fetched, error message
+        """
+        raise NotImplementedError
+
+    def count_objects(self, path: str) -> dict:
+        """Count objects of the repository
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dict: number and size (bytes) of loose objects, number of packed objects, number and size of packs
+        """
+        raise NotImplementedError
+
+    def repack(self, path: str, full: bool):
+        """Pack loose objects, and remove the ones already packed
+
+        Args:
+            path (str): working directory
+            full (bool): if True, all packs are merged into a single one
+        """
+        raise NotImplementedError
+
+    def write_commit_graph(self, path: str) -> bool:
+        """Write the commit-graph file, which speeds up history walks
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            bool: False if not supported by the backend
+        """
+        raise NotImplementedError
+
+    def write_multi_pack_index(self, path: str) -> bool:
+        """Write the multi-pack-index file, which speeds up object lookups across packs
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            bool: False if not supported by the backend
+        """
+        raise NotImplementedError
+
+    def prune(self, path: str, expire: int):
+        """Delete unreachable loose objects
+
+        Args:
+            path (str): working directory
+            expire (int): only objects older than this are deleted (seconds)
+        """
+        raise NotImplementedError
+
+    def push(self, path: str, branch: str, quiet: bool = False, timeout: int = None) -> (bool, str):
+        """Push branch to remote, and set it as upstream
+
+        Args:
+            path (str): working directory
+            branch (str): git branch
+            quiet (bool, optional): if True, nothing is printed. Defaults to False.
+            timeout (int, optional): maximum duration (seconds). Defaults to None.
+
+        Returns:
+            (bool, str): tuple of is pushed, error message
+        """
+        raise NotImplementedError
+
+
+class SubprocessBackend(GitBackend):
+    """Git backend running the git binary
+    """
+    name: str = "subprocess"
+    commit_attempts: int = 3
+
+    def run(self, path: str, args: list[str], **kwargs) -> subprocess.CompletedProcess:
+        """Run a git command with captured text output
+
+        Args:
+            path (str): working directory
+            args (list[str]): git arguments
+            kwargs: subprocess.run arguments
+
+        Returns:
+            subprocess.CompletedProcess: command result
+        """
+        return subprocess.run(["git", "-C", path] + args, capture_output=True, text=True, **kwargs)
+
+    def run_remote(self, path: str, args: list[str], timeout: int) -> (bool, str):
+        """Run a git command reaching the remote, never prompting for credentials
+
+        Args:
+            path (str): working directory
+            args (list[str]): git arguments
+            timeout (int): maximum duration (seconds)
+
+        Returns:
+            (bool, str): tuple of is successful, error message
+        """
+        try:
+            result = self.run(path, args, stdin=subprocess.DEVNULL, timeout=timeout,
+                              env=dict(os.environ, GIT_TERMINAL_PROMPT="0"))
+        except subprocess.TimeoutExpired:
+            return (False, f"Git {args[0]} timed out")
+        return (result.returncode == 0, result.stderr.strip())
+
+    def init(self, path: str, branch: str):
+        subprocess.run(["git", "-C", path, "init"], capture_output=False)
+        self.run(path, ["symbolic-ref", "HEAD", f"refs/heads/{branch}"])
+
+    def set_config(self, path: str, section: str, key: str, value: str):
+        self.run(path, ["config", f"{section}.{key}", value])
+
+    def add_remote(self, path: str, name: str, url: str):
+        self.run(path, ["remote", "add", name, url])
+
+    def add(self, path: str, paths: list[str]):
+        # Paths are given on stdin: their number is not limited by the command line length
+        result = subprocess.run(["git", "--literal-pathspecs", "-C", path, "add", "--pathspec-from-file=-",
+                                 "--pathspec-file-nul"], input="\0".join(paths), text=True, capture_output=True)
+        # A single missing path makes git reject the whole add
+        assert (result.returncode == 0), f"Git add failed: {result.stderr.strip()}"
+
+    def add_all(self, path: str):
+        result = self.run(path, ["add", "--all", "."])
+        assert (result.returncode == 0), f"Git add failed: {result.stderr.strip()}"
+
+    def remove(self, path: str, paths: list[str]):
+        result = subprocess.run(["git", "--literal-pathspecs", "-C", path, "rm", "-r", "--quiet", "--cached",
+                                 "--ignore-unmatch", "--pathspec-from-file=-", "--pathspec-file-nul"],
+                                input="\0".join(paths), text=True, capture_output=True)
+        assert (result.returncode == 0), f"Git rm failed: {result.stderr.strip()}"
+
+    def has_commit_hooks(self, path: str) -> bool:
+        """Check if commit hooks are installed (core.hooksPath or .git/hooks)
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            bool: True if a commit hook is installed
+        """
+        hooks_dir = self.run(path, ["rev-parse", "--path-format=absolute", "--git-path", "hooks"]).stdout.strip()
+        return any(os.access(os.path.join(hooks_dir, hook), os.X_OK)
+                   for hook in ("pre-commit", "prepare-commit-msg", "commit-msg", "post-commit"))
+
+    def commit(self, path: str, message: str) -> bool:
+        if self.has_commit_hooks(path):
+            if not self.has_changes(path, self.write_tree(path), self.get_ref(path, "HEAD")):
+                return False
+            # commit-tree and update-ref do not run hooks: git commit does
+            result = self.run(path, ["commit", "--quiet", "--no-status", "-m", message], stdin=subprocess.DEVNULL)
+            assert (result.returncode == 0), f"Git commit failed: {(result.stderr or result.stdout).strip()}"
+            return True
+        # Unlike git commit, the whole working directory is not checked again: time does not depend on store size
+        for attempt in range(self.commit_attempts):
+            tree = self.write_tree(path)
+            parent = self.get_ref(path, "HEAD")
+            if not self.has_changes(path, tree, parent):
+                return False
+            commit = self.run(path, ["commit-tree", tree, "-m", message] + (["-p", parent] if parent != "" else []))
+            assert (commit.stdout.strip() != ""), "Git commit failed"
+            # HEAD is only updated if it did not move meanwhile (else the commit is built again on the new HEAD)
+            result = self.run(path, ["update-ref", "-m", f"commit: {message}", "HEAD", commit.stdout.strip(),
+                                     parent if parent != "" else "0" * len(commit.stdout.strip())])
+            if result.returncode == 0:
+                return True
+        raise AssertionError(f"Git commit failed: HEAD changed during commit ({result.stderr.strip()})")
+
+    def write_tree(self, path: str) -> str:
+        """Write the index to a tree object
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: tree hash
+        """
+        tree = self.run(path, ["write-tree"]).stdout.strip()
+        assert (tree != ""), "Git index cannot be written"
+        return tree
+
+    def has_changes(self, path: str, tree: str, parent: str) -> bool:
+        """Check if a tree differs from the tree of a commit
+
+        Args:
+            path (str): working directory
+            tree (str): tree hash
+            parent (str): commit hash, "" if none
+
+        Returns:
+            bool: True if there is something to commit
+        """
+        return parent == "" or tree != self.run(path, ["rev-parse", f"{parent}^{{tree}}"]).stdout.strip()
+
+    def get_ref(self, path: str, ref: str) -> str:
+        result = self.run(path, ["rev-parse", "--verify", "--quiet", ref + "^{commit}"])
+        return result.stdout.strip() if result.returncode == 0 else ""
+
+    def count_commits(self, path: str, ref: str) -> int:
+        return int(self.run(path, ["rev-list", "--count", ref]).stdout.strip() or 0)
+
+    def count_divergence(self, path: str, branch: str) -> (int, int):
+        result = self.run(path, ["rev-list", "--left-right", "--count", f"{branch}...origin/{branch}"])
+        counts = result.stdout.split()
+        if result.returncode != 0 or len(counts) != 2:
+            return (0, 0)
+        return (int(counts[0]), int(counts[1]))
+
+    def is_clean(self, path: str) -> bool:
+        return self.run(path, ["status", "--porcelain", "--untracked-files=no"]).stdout.strip() == ""
+
+    def status(self, path: str):
+        subprocess.run(["git", "-C", path, "status"])
+
+    def fetch(self, path: str, branch: str, timeout: int) -> (bool, str):
+        return self.run_remote(path, ["fetch", "--quiet", "origin", branch], timeout)
+
+    def merge_ff(self, path: str, branch: str) -> bool:
+        result = self.run(path, ["merge", "--ff-only", "--quiet", f"origin/{branch}"], stdin=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def pull(self, path: str, branch: str, depth: int = 0, partial: bool = False) -> bool:
+        if depth != 0 or partial:
+            # git pull has no filter option: the filter is saved by fetch, and reused by later fetches
+            options = ([f"--depth={depth}"] if depth != 0 else []) + (["--filter=blob:none"] if partial else [])
+            result = subprocess.run(["git", "-C", path, "fetch"] + options + ["origin", branch])
+            if result.returncode != 0:
+                return False
+        result = subprocess.run(["git", "-C", path, "pull", "--no-rebase", "--no-edit", "origin", branch])
+        subprocess.run(["git", "-C", path, "checkout", branch])
+        return result.returncode == 0
+
+    def has_merge_base(self, path: str, branch: str) -> bool:
+        return self.run(path, ["merge-base", branch, f"origin/{branch}"]).returncode == 0
+
+    def unshallow(self, path: str, branch: str) -> (bool, str):
+        return self.run_remote(path, ["fetch", "--quiet", "--unshallow", "origin", branch], None)
+
+    def count_objects(self, path: str) -> dict:
+        values = dict(line.split(": ", 1) for line in self.run(path, ["count-objects", "-v"]).stdout.splitlines())
+        return {"loose": int(values.get("count", 0)), "loose_size": int(values.get("size", 0)) * 1024,
+                "packed": int(values.get("in-pack", 0)), "packs": int(values.get("packs", 0)),
+                "pack_size": int(values.get("size-pack", 0)) * 1024}
+
+    def repack(self, path: str, full: bool):
+        result = self.run(path, ["repack", "-d", "-l", "-q"] + (["-a"] if full else []), stdin=subprocess.DEVNULL)
+        assert (result.returncode == 0), f"Git repack failed: {result.stderr.strip()}"
+        self.run(path, ["prune-packed", "-q"])
+
+    def write_commit_graph(self, path: str) -> bool:
+        result = self.run(path, ["commit-graph", "write", "--reachable", "--no-progress"])
+        assert (result.returncode == 0), f"Git commit-graph failed: {result.stderr.strip()}"
+        return True
+
+    def write_multi_pack_index(self, path: str) -> bool:
+        result = self.run(path, ["multi-pack-index", "write", "--no-progress"])
+        assert (result.returncode == 0), f"Git multi-pack-index failed: {result.stderr.strip()}"
+        return True
+
+    def prune(self, path: str, expire: int):
+        result = self.run(path, ["prune", f"--expire={expire}.seconds.ago"])
+        assert (result.returncode == 0), f"Git prune failed: {result.stderr.strip()}"
+
+    def push(self, path: str, branch: str, quiet: bool = False, timeout: int = None) -> (bool, str):
+        if quiet:
+            return self.run_remote(path, ["push", "--quiet", "-u", "origin", branch], timeout)
+        result = subprocess.run(["git", "-C", path, "push", "-u", "origin", branch], timeout=timeout)
+        return (result.returncode == 0, "")
+
+
+class DulwichBackend(GitBackend):
+    """Git backend running in process, with dulwich (optional dependency)
+
+    No git process is started. Pulls are fast-forward only: diverged branches must be merged with the git binary.
+    Timeouts are not supported.
+    """
+    name: str = "dulwich"
+
+    def __init__(self):
+        """Init class
+        """
+        try:
+            from dulwich import porcelain, graph
+            from dulwich.objects import parse_timezone
+            from dulwich.repo import Repo
+        except ImportError:
+            raise AssertionError("Git backend <dulwich> requires dulwich: pip install ppass[dulwich]")
+        self.porcelain = porcelain
+        self.graph = graph
+        self.parse_timezone = parse_timezone
+        self.Repo = Repo
+
+    def open(self, path: str):
+        """Open the repository of a working directory
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dulwich.repo.Repo: repository, to be closed
+        """
+        return self.Repo(path)
+
+    def get_sha(self, repo, ref: str) -> bytes:
+        """Get the commit of a reference in an opened repository
+
+        Args:
+            repo (dulwich.repo.Repo): repository
+            ref (str): git reference (HEAD, branch, remote/branch)
+
+        Returns:
+            bytes: commit hash, None if the reference does not exist
+        """
+        for name in (ref, f"refs/heads/{ref}", f"refs/remotes/{ref}"):
+            try:
+                return repo.refs[name.encode()]
+            except KeyError:
+                continue
+        return None
+
+    def get_date(self, name: str) -> dict:
+        """Get a commit date set in the environment, in git internal format ("<timestamp> <+hhmm>", as git does)
+
+        Args:
+            name (str): date name (author, commit)
+
+        Returns:
+            dict: timestamp and timezone arguments of commit, empty if not set
+        """
+        variable = "GIT_AUTHOR_DATE" if name == "author" else "GIT_COMMITTER_DATE"
+        value = os.environ.get(variable, "").split()
+        if len(value) != 2:
+            return {}
+        assert (value[0].lstrip("@").isdigit()), f"{variable} must be in git internal format: <timestamp> <+hhmm>"
+        return {f"{name}_timestamp": int(value[0].lstrip("@")),
+                f"{name}_timezone": self.parse_timezone(value[1].encode())[0]}
+
+    def get_relpaths(self, path: str, paths: list[str]) -> list[bytes]:
+        """Convert paths to index paths, relative to the working directory
+
+        Args:
+            path (str): working directory
+            paths (list[str]): absolute or relative paths
+
+        Returns:
+            list[bytes]: index paths
+        """
+        root = os.path.abspath(path)
+        return [os.path.relpath(os.path.join(root, p), root).replace(os.sep, "/").encode() for p in paths]
+
+    def init(self, path: str, branch: str):
+        if os.path.isdir(os.path.join(path, ".git")):
+            repo = self.open(path)
+        else:
+            repo = self.Repo.init(path)
+        with repo:
+            repo.refs.set_symbolic_ref(b"HEAD", f"refs/heads/{branch}".encode())
+
+    def set_config(self, path: str, section: str, key: str, value: str):
+        with self.open(path) as repo:
+            config = repo.get_config()
+            config.set((section.encode(),), key.encode(), value.encode())
+            config.write_to_path()
+
+    def add_remote(self, path: str, name: str, url: str):
+        with self.open(path) as repo:
+            config = repo.get_config()
+            if not config.has_section((b"remote", name.encode())):
+                self.porcelain.remote_add(repo, name, url)
+
+    def add(self, path: str, paths: list[str]):
+        # Same as git add: a single missing path rejects the whole add
+        for relpath in paths:
+            assert (os.path.lexists(os.path.join(path, relpath))), \
+                f"Git add failed: pathspec '{relpath}' did not match any files"
+        files = []
+        for relpath in self.get_relpaths(path, paths):
+            fullpath = os.path.join(path, relpath.decode())
+            if not os.path.isdir(fullpath):
+                files.append(relpath)
+                continue
+            for (root, dirs, names) in os.walk(fullpath):
+                dirs[:] = [d for d in dirs if d != ".git"]
+                files += self.get_relpaths(path, [os.path.join(root, name) for name in names])
+        if len(files) != 0:
+            with self.open(path) as repo:
+                repo.get_worktree().stage(files)
+
+    def add_all(self, path: str):
+        with self.open(path) as repo:
+            self.porcelain.add(repo)
+            status = self.porcelain.status(repo, untracked_files="no")
+            if len(status.unstaged) != 0:
+                # Deleted files
+                repo.get_worktree().stage(status.unstaged)
+
+    def remove(self, path: str, paths: list[str]):
+        prefixes = self.get_relpaths(path, paths)
+        with self.open(path) as repo:
+            repo_index = repo.open_index()
+            removed = [name for name in repo_index
+                       if any(name == prefix or name.startswith(prefix + b"/") for prefix in prefixes)]
+            for name in removed:
+                del repo_index[name]
+            if len(removed) != 0:
+                repo_index.write()
+
+    def commit(self, path: str, message: str) -> bool:
+        with self.open(path) as repo:
+            tree = repo.open_index().commit(repo.object_store)
+            parent = self.get_sha(repo, "HEAD")
+            if parent is not None and repo[parent].tree == tree:
+                return False
+            # Hooks of .git/hooks are run (dulwich does not read core.hooksPath). Same message and dates as git commit
+            repo.get_worktree().commit(message=message.rstrip("\n").encode() + b"\n", tree=tree,
+                                       **self.get_date("author"), **self.get_date("commit"))
+        return True
+
+    def get_ref(self, path: str, ref: str) -> str:
+        with self.open(path) as repo:
+            sha = self.get_sha(repo, ref)
+        return sha.decode() if sha is not None else ""
+
+    def count_commits(self, path: str, ref: str) -> int:
+        with self.open(path) as repo:
+            sha = self.get_sha(repo, ref)
+            return 0 if sha is None else sum(1 for _ in repo.get_walker(include=[sha]))
+
+    def count_divergence(self, path: str, branch: str) -> (int, int):
+        with self.open(path) as repo:
+            local = self.get_sha(repo, branch)
+            remote = self.get_sha(repo, f"origin/{branch}")
+            if local is None or remote is None:
+                return (0, 0)
+            ahead = sum(1 for _ in repo.get_walker(include=[local], exclude=[remote]))
+            behind = sum(1 for _ in repo.get_walker(include=[remote], exclude=[local]))
+        return (ahead, behind)
+
+    def is_clean(self, path: str) -> bool:
+        with self.open(path) as repo:
+            status = self.porcelain.status(repo, untracked_files="no")
+        return not any(status.staged.values()) and len(status.unstaged) == 0
+
+    def status(self, path: str):
+        with self.open(path) as repo:
+            branch = repo.refs.get_symrefs().get(b"HEAD", b"").decode().replace("refs/heads/", "")
+            status = self.porcelain.status(repo)
+        print(f"On branch {branch}")
+        labels = {"add": "new file", "delete": "deleted", "modify": "modified"}
+        changes = [(labels[kind], name) for (kind, names) in status.staged.items() for name in names]
+        for (title, names) in (("Changes to be committed", changes),
+                               ("Changes not staged for commit", [("modified", name) for name in status.unstaged]),
+                               ("Untracked files", [("", name) for name in status.untracked])):
+            if len(names) != 0:
+                print(f"{title}:")
+                for (label, name) in names:
+                    name = name.decode() if isinstance(name, bytes) else name
+                    print(f"\t{label + ':   ' if label != '' else ''}{name}")
+        if len(changes) + len(status.unstaged) + len(status.untracked) == 0:
+            print("nothing to commit, working tree clean")
+
+    def fetch(self, path: str, branch: str, timeout: int, depth: int = 0, unshallow: bool = False) -> (bool, str):
+        errstream = io.BytesIO()
+        try:
+            with self.open(path) as repo:
+                self.porcelain.fetch(repo, "origin", outstream=io.StringIO(), errstream=errstream, quiet=True,
+                                     depth=depth if depth != 0 else None, unshallow=unshallow)
+        except Exception as error:
+            return (False, str(error) or errstream.getvalue().decode(errors="replace").strip())
+        return (True, "")
+
+    def has_merge_base(self, path: str, branch: str) -> bool:
+        with self.open(path) as repo:
+            local = self.get_sha(repo, branch)
+            remote = self.get_sha(repo, f"origin/{branch}")
+            if local is None or remote is None:
+                return False
+            try:
+                return len(self.graph.find_merge_base(repo, [local, remote])) != 0
+            except KeyError:
+                # Parent beyond the shallow boundary
+                return False
+
+    def unshallow(self, path: str, branch: str) -> (bool, str):
+        return self.fetch(path, branch, None, unshallow=True)
+
+    def merge_ff(self, path: str, branch: str) -> bool:
+        with self.open(path) as repo:
+            local = self.get_sha(repo, branch)
+            remote = self.get_sha(repo, f"origin/{branch}")
+            if remote is None or local == remote:
+                return remote is not None
+            if local is not None and not self.graph.can_fast_forward(repo, local, remote):
+                return False
+            repo.refs[f"refs/heads/{branch}".encode()] = remote
+            self.porcelain.reset(repo, "hard", remote)
+        return True
+
+    def pull(self, path: str, branch: str, depth: int = 0, partial: bool = False) -> bool:
+        assert (not partial), "Git backend <dulwich> does not support partial clones: use --depth"
+        (fetched, error) = self.fetch(path, branch, None, depth=depth)
+        assert fetched, f"Pull from remote failed: {error}"
+        if not self.merge_ff(path, branch):
+            # Without merge base, history may only be truncated (shallow clone): the caller can fetch it and retry
+            assert (not self.has_merge_base(path, branch)), \
+                f"Cannot fast-forward <{branch}> to <origin/{branch}>: branches have diverged"
+            return False
+        return True
+
+    def count_objects(self, path: str) -> dict:
+        with self.open(path) as repo:
+            result = self.porcelain.count_objects(repo, verbose=True)
+        return {"loose": result.count, "loose_size": result.size, "packed": result.in_pack or 0,
+                "packs": result.packs or 0, "pack_size": result.size_pack or 0}
+
+    def repack(self, path: str, full: bool):
+        # Only loose objects are packed: packs are never merged
+        with self.open(path) as repo:
+            self.porcelain.repack(repo)
+
+    def write_commit_graph(self, path: str) -> bool:
+        # Commit-graph files written by dulwich are rejected by git: the store must stay usable with git binary
+        return False
+
+    def write_multi_pack_index(self, path: str) -> bool:
+        return False
+
+    def prune(self, path: str, expire: int):
+        with self.open(path) as repo:
+            self.porcelain.prune(repo, grace_period=expire)
+
+    def push(self, path: str, branch: str, quiet: bool = False, timeout: int = None) -> (bool, str):
+        errstream = io.BytesIO()
+        try:
+            with self.open(path) as repo:
+                self.porcelain.push(repo, "origin", branch, outstream=io.BytesIO(), errstream=errstream)
+                sha = self.get_sha(repo, branch)
+                if sha is not None:
+                    repo.refs[f"refs/remotes/origin/{branch}".encode()] = sha
+                config = repo.get_config()
+                config.set((b"branch", branch.encode()), b"remote", b"origin")
+                config.set((b"branch", branch.encode()), b"merge", f"refs/heads/{branch}".encode())
+                config.write_to_path()
+        except Exception as error:
+            return (False, str(error) or errstream.getvalue().decode(errors="replace").strip())
+        return (True, "")
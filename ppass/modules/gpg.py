@@ -19,8 +19,20 @@
 """
 
 import os
+import re
 import json
-import gnupg
+import sys
+import time
+import hashlib
+import subprocess
+
+from typing import TYPE_CHECKING
+
+from ..appInfo import app
+from .armor import armor
+
+if TYPE_CHECKING:
+    import gnupg
 
 
 class Password:
@@ -31,6 +43,11 @@ class Password:
     username: str = ''
     url: str = ''
     comment: str = ''
+    fields: dict = None
+
+    def __init__(self):
+        # Extra "key: value" lines of the comment, in file order
+        self.fields = {}
 
     def to_json(self) -> json:
         """Convert object to JSON
@@ -44,23 +61,134 @@ class Password:
         json_item["username"] = self.username
         json_item["url"] = self.url
         json_item["comment"] = self.comment
+        json_item["fields"] = dict(self.fields)
         return json_item
 
 
 class gpg:
     """Static class for gpg actions
+
+    A single GPG session is created on first use and reused for all actions of the process.
     """
+    binary: str = "gpg"
+    homedir: str = ""
+    armored: bool = True
+    session: "gnupg.GPG" = None
+    keyring_files: tuple = ("pubring.kbx", "pubring.gpg", "secring.gpg", "trustdb.gpg", "private-keys-v1.d")
+    # pass-style fields ("key: value" lines)
+    field_pattern: re.Pattern = re.compile(r"([A-Za-z][\w-]{0,31}):(?!//)[ \t]*(.*)$")
+    username_keys: tuple = ("login", "username", "user")
+    url_keys: tuple = ("url",)
+    otpauth_prefix: str = "otpauth://"
+    # Decrypted contents kept in memory, by file path, for cache_ttl seconds (0: disabled, see agent)
+    cache_ttl: float = 0
+    cache: dict = {}
+
+    @staticmethod
+    def configure(binary: str = "gpg", homedir: str = "", armored: bool = True):
+        """Select gpg binary, home directory and format of encrypted files
+        The current session is dropped if binary or home directory change
+
+        Args:
+            binary (str, optional): gpg binary. Defaults to "gpg".
+            homedir (str, optional): gpg home directory. Defaults to "" (GNUPGHOME or ~/.gnupg).
+            armored (bool, optional): if False, files are written in binary OpenPGP format. Defaults to True.
+        """
+        gpg.armored = armored
+        binary = binary or "gpg"
+        if (binary, homedir) != (gpg.binary, gpg.homedir):
+            gpg.binary = binary
+            gpg.homedir = homedir
+            gpg.session = None
+
+    @staticmethod
+    def configure_cache(ttl: float):
+        """Keep decrypted contents in memory
+        A cached content is dropped when it expires, or when its file changes
+
+        Args:
+            ttl (float): lifetime of cached contents (seconds, 0 to disable)
+        """
+        gpg.cache_ttl = ttl
+        gpg.cache = {}
+
+    @staticmethod
+    def purge_cache():
+        """Drop expired contents from cache
+        """
+        now = time.monotonic()
+        for (filepath, item) in list(gpg.cache.items()):
+            if item[0] <= now:
+                gpg.cache.pop(filepath, None)
+
+    @staticmethod
+    def get_session() -> "gnupg.GPG":
+        """Get the GPG session, created on first call
+
+        Returns:
+            gnupg.GPG: GPG session
+        """
+        if gpg.session is None:
+            import gnupg
+            session = gnupg.GPG(gpgbinary=gpg.binary, gnupghome=(gpg.homedir or None))
+            session.encoding = "utf-8"
+            gpg.session = session
+        return gpg.session
+
+    @staticmethod
+    def get_homedir() -> str:
+        """Get the gpg home directory in use
+
+        Returns:
+            str: gpg home directory
+        """
+        if gpg.homedir != "":
+            return gpg.homedir
+        return os.environ.get("GNUPGHOME", "") or os.path.join(os.path.expanduser("~"), ".gnupg")
+
+    @staticmethod
+    def get_keyring_stamp() -> dict:
+        """Get the mtimes of keyring files
+
+        Returns:
+            dict: mtime (ns) of each existing keyring file
+        """
+        homedir = gpg.get_homedir()
+        stamp = {}
+        for name in gpg.keyring_files:
+            try:
+                stamp[name] = os.stat(os.path.join(homedir, name)).st_mtime_ns
+            except OSError:
+                pass
+        return stamp
 
     @staticmethod
     def get_identities():
         """Get available GPG identities
+        The list is cached until a keyring file changes
 
         Returns:
             any: list of gpg keys
         """
-        gpg_item = gnupg.GPG()
-        gpg_item.encoding = "utf-8"
-        return gpg_item.list_keys(True)
+        key = hashlib.sha1(f"{gpg.binary}:{os.path.abspath(gpg.get_homedir())}".encode("utf-8")).hexdigest()[:16]
+        filepath = os.path.join(app.default_cachepath(), f"identities-{key}.json")
+        stamp = gpg.get_keyring_stamp()
+        try:
+            with open(filepath, "r") as f:
+                data = json.load(f)
+            if data["stamp"] == stamp:
+                return data["keys"]
+        except (OSError, ValueError, KeyError):
+            pass
+        keys = list(gpg.get_session().list_keys(True))
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(f"{filepath}.{os.getpid()}.tmp", "w") as f:
+                json.dump({"stamp": stamp, "keys": keys}, f)
+            os.replace(f"{filepath}.{os.getpid()}.tmp", filepath)
+        except (OSError, TypeError):
+            pass
+        return keys
 
     @staticmethod
     def decrypt_file(filepath: str) -> str:
@@ -76,17 +204,28 @@ class gpg:
         assert (os.path.isfile(filepath)), f"{filepath} is not a file"
         assert (filepath.endswith(".gpg")), f"{filepath} is not a gpg file"
 
-        gpg_item = gnupg.GPG()
-        gpg_item.encoding = "utf-8"
+        if gpg.cache_ttl > 0:
+            stat = os.stat(filepath)
+            item = gpg.cache.get(filepath)
+            if item is not None and item[0] > time.monotonic() and item[1] == (stat.st_mtime_ns, stat.st_size):
+                return item[2]
+
+        gpg_item = gpg.get_session()
         stream = open(filepath, "rb")
         decrypted_data = gpg_item.decrypt_file(stream)
         stream.close()
 
+        if gpg.cache_ttl > 0 and decrypted_data.ok:
+            gpg.cache[filepath] = (time.monotonic() + gpg.cache_ttl, (stat.st_mtime_ns, stat.st_size),
+                                   str(decrypted_data))
         return str(decrypted_data)
 
     @staticmethod
     def gpg_to_password(filepath: str, content: str, username_prefix: str, url_prefix: str) -> Password:
         """Transform decrypted content to Password object
+        Content is read in a single pass. Username and url are read from ppass lines (with prefixes), or else from
+        pass-style lines (login: ..., url: ...). Other "key: value" lines and otpauth uri are kept in comment, and
+        also returned as fields.
 
         Args:
             filepath (str): path of file to decrypt
@@ -100,20 +239,43 @@ class gpg:
         password = Password()
         password.app = os.path.basename(filepath).replace(".gpg", "")
         lines = content.splitlines()
-        first_line = True
-        for line in lines:
-            if first_line:
-                first_line = False
-                password.password = line.strip()
-                continue
+        if len(lines) == 0:
+            return password
+        password.password = lines[0].strip()
+        has_username = False
+        has_url = False
+        comment = []
+        for index in range(1, len(lines)):
+            line = lines[index]
             if line.startswith(username_prefix):
-                password.username = line.replace(username_prefix, "").strip()
+                password.username = line[len(username_prefix):].strip()
+                has_username = True
                 continue
             if line.startswith(url_prefix):
-                password.url = line.replace(url_prefix, "").strip()
+                password.url = line[len(url_prefix):].strip()
+                has_url = True
                 continue
-            password.comment += "" if password.comment == "" else "\n"
-            password.comment += line
+            if line == "" and len(comment) == 0:
+                # Blank lines before comment are dropped
+                continue
+            if line.startswith(gpg.otpauth_prefix):
+                password.fields.setdefault("otpauth", line.strip())
+            else:
+                match = gpg.field_pattern.match(line)
+                if match is not None:
+                    key = match.group(1)
+                    value = match.group(2).strip()
+                    if key.lower() in gpg.username_keys and not has_username:
+                        password.username = value
+                        has_username = True
+                        continue
+                    if key.lower() in gpg.url_keys and not has_url:
+                        password.url = value
+                        has_url = True
+                        continue
+                    password.fields.setdefault(key, value)
+            comment.append(line)
+        password.comment = "\n".join(comment)
         return password
 
     @staticmethod
@@ -132,6 +294,34 @@ class gpg:
         assert (content != ""), "Decrypted file is empty"
         return gpg.gpg_to_password(filepath, content, username_prefix, url_prefix)
 
+    @staticmethod
+    def decrypt_many(filepaths: list[str], username_prefix: str, url_prefix: str, workers: int = 0) -> list:
+        """Decrypt several gpg files to Password objects, with a bounded pool of gpg processes
+
+        Args:
+            filepaths (list[str]): paths of files to decrypt
+            username_prefix (str): prefix for username line
+            url_prefix (str): prefix for url line
+            workers (int, optional): maximum number of parallel gpg processes. Defaults to 0 (one per cpu, up to 8).
+
+        Returns:
+            list: for each file, in input order, a Password object or the Exception raised while decrypting it
+        """
+        def decrypt(filepath: str):
+            try:
+                return gpg.decrypt_to_password(filepath, username_prefix, url_prefix)
+            except Exception as error:
+                return error
+
+        if len(filepaths) == 0:
+            return []
+        if workers <= 0:
+            workers = min(8, os.cpu_count() or 1)
+        from concurrent.futures import ThreadPoolExecutor
+        gpg.get_session()
+        with ThreadPoolExecutor(max_workers=min(workers, len(filepaths))) as executor:
+            return list(executor.map(decrypt, filepaths))
+
     @staticmethod
     def encrypt_data(content: str, identity: str) -> str:
         """Encrypt string to gpg
@@ -143,8 +333,7 @@ class gpg:
         Returns:
             str: encrypted content
         """
-        gpg_item = gnupg.GPG()
-        gpg_item.encoding = "utf-8"
+        gpg_item = gpg.get_session()
         encrypted = gpg_item.encrypt(content, identity)
         encrypted = str(encrypted).strip()
         assert (encrypted != ""), "Invalid identity"
@@ -153,6 +342,7 @@ class gpg:
     @staticmethod
     def encrypt_to_file(content: str, identity: str, filepath: str):
         """Encrypt string and save to file
+        The file is armored or binary, as configured (both formats are decrypted the same way)
 
         Args:
             content (str): data to encrypt
@@ -160,6 +350,116 @@ class gpg:
             filepath (str): file where to save encryted content
         """
         assert (not os.path.exists(filepath)), "File already exists"
+        if not gpg.armored:
+            encrypted = gpg.get_session().encrypt(content, identity, armor=False)
+            assert (encrypted.ok and len(encrypted.data) != 0), "Invalid identity"
+            f = open(filepath, "wb")
+            f.write(encrypted.data)
+            f.close()
+            return
         f = open(filepath, "w")
         f.writelines(gpg.encrypt_data(content, identity))
         f.close()
+
+    @staticmethod
+    def get_command(*args: str) -> list[str]:
+        """Get a gpg command line, with configured binary and home directory
+
+        Args:
+            args (str): gpg arguments
+
+        Returns:
+            list[str]: command line
+        """
+        command = [gpg.binary, "--batch", "--yes", "--no-tty"]
+        if gpg.homedir != "":
+            command += ["--homedir", gpg.homedir]
+        return command + list(args)
+
+    @staticmethod
+    def run_stream(command: list[str], source, filepath: str):
+        """Run a gpg command reading source, writing its output to a file or to stdout
+        Data goes from file to file through gpg: it is never loaded in memory
+
+        Args:
+            command (list[str]): gpg command line, without output
+            source: binary file object read by gpg
+            filepath (str): output file path, or "-" for stdout
+        """
+        if filepath == "-":
+            sys.stdout.flush()
+            result = subprocess.run(command, stdin=source, stdout=sys.stdout.buffer, stderr=subprocess.PIPE)
+            assert (result.returncode == 0), result.stderr.decode("utf-8", "replace").strip()
+            return
+        # Write to a temporary file first, so that a failure never leaves a partial file
+        tmppath = f"{filepath}.{os.getpid()}.tmp"
+        result = subprocess.run(command + ["--output", tmppath], stdin=source, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise Exception(result.stderr.decode("utf-8", "replace").strip())
+        os.replace(tmppath, filepath)
+
+    @staticmethod
+    def encrypt_stream(source: str, identity: str, filepath: str):
+        """Encrypt a file (binary OpenPGP format), without loading it in memory
+
+        Args:
+            source (str): path of file to encrypt, or "-" for stdin
+            identity (str): gpg identity
+            filepath (str): file where to save encrypted content
+        """
+        command = gpg.get_command("--encrypt", "--recipient", identity)
+        if source == "-":
+            gpg.run_stream(command, sys.stdin.buffer, filepath)
+            return
+        assert (os.path.isfile(source)), f"{source} is not a file"
+        with open(source, "rb") as stream:
+            gpg.run_stream(command, stream, filepath)
+
+    @staticmethod
+    def reencrypt_file(filepath: str, identity: str):
+        """Re-encrypt a gpg file for another identity, keeping its format (armored or binary)
+        gpg decrypts into a pipe read by a second gpg: plain data is never loaded in memory nor written to disk.
+        The file is replaced atomically, only if both steps succeed.
+
+        Args:
+            filepath (str): path of file to re-encrypt
+            identity (str): new gpg identity
+        """
+        assert (os.path.isfile(filepath)), f"{filepath} is not a file"
+        command = gpg.get_command("--encrypt", "--recipient", identity)
+        if armor.is_armored(filepath):
+            command.append("--armor")
+        import tempfile
+        tmppath = f"{filepath}.{os.getpid()}.tmp"
+        # Decrypt errors go to a temporary file, not a pipe: no one reads a pipe while encrypt runs, and a full
+        # pipe would block decrypt, so both processes
+        with open(filepath, "rb") as stream, tempfile.TemporaryFile() as errors:
+            decrypt = subprocess.Popen(gpg.get_command("--decrypt"), stdin=stream, stdout=subprocess.PIPE,
+                                       stderr=errors)
+            encrypt = subprocess.run(command + ["--output", tmppath], stdin=decrypt.stdout,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            decrypt.stdout.close()
+            decrypt.wait()
+            errors.seek(0)
+            decrypt_error = errors.read()
+        if decrypt.returncode != 0 or encrypt.returncode != 0:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            error = decrypt_error if decrypt.returncode != 0 else encrypt.stderr
+            raise Exception(error.decode("utf-8", "replace").strip())
+        os.replace(tmppath, filepath)
+
+    @staticmethod
+    def decrypt_stream(filepath: str, output: str):
+        """Decrypt a gpg file to a file or to stdout, without loading it in memory
+
+        Args:
+            filepath (str): path of file to decrypt
+            output (str): path of decrypted file, or "-" for stdout
+        """
+        assert (os.path.isfile(filepath)), f"{filepath} is not a file"
+        with open(filepath, "rb") as stream:
+            gpg.run_stream(gpg.get_command("--decrypt"), stream, output)
@@ -0,0 +1,211 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Persistent on-disk index of password files
+"""
+
+import os
+import json
+import hashlib
+
+from .walker import walker
+from ..appInfo import app
+
+
+class index:
+    """Static class for the store listing index
+
+    The index keeps, for each directory of the store, its mtime, its sub directories and its gpg files
+    (name, mtime, size). On refresh, only the directories whose mtime changed are scanned again.
+    When a store watcher is running (see watcher module), the index is saved by the watcher only: directories changed
+    since its last snapshot are scanned in memory.
+    """
+    version: int = 1
+    # Loaded indexes kept in memory, by index file path, while the file does not change (None: disabled, see agent)
+    memory: dict = None
+
+    @staticmethod
+    def get_filepath(path: str) -> str:
+        """Get the index file path of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: index file path
+        """
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(app.default_cachepath(), f"index-{key}.json")
+
+    @staticmethod
+    def get_pendingpath(path: str) -> str:
+        """Get the path of the file flagging pending watcher changes
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: pending flag file path
+        """
+        return index.get_filepath(path).replace(".json", ".pending")
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """Load the index of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dict: index content, with indexed directories and watcher pid (empty if there is no valid index)
+        """
+        filepath = index.get_filepath(path)
+        try:
+            if index.memory is not None:
+                stat = os.stat(filepath)
+                item = index.memory.get(filepath)
+                if item is not None and item[0] == (stat.st_mtime_ns, stat.st_size):
+                    return item[1]
+            with open(filepath, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != index.version or data.get("path") != os.path.abspath(path):
+            return {}
+        if index.memory is not None:
+            index.memory[filepath] = ((stat.st_mtime_ns, stat.st_size), data)
+        return data
+
+    @staticmethod
+    def save(path: str, dirs: dict, watcher: int = 0):
+        """Save the index of a store
+        Index is only a cache: write errors are ignored
+
+        Args:
+            path (str): working directory
+            dirs (dict): indexed directories
+            watcher (int, optional): pid of the store watcher keeping the index up to date. Defaults to 0.
+        """
+        filepath = index.get_filepath(path)
+        tmppath = f"{filepath}.{os.getpid()}.tmp"
+        data = {"version": index.version, "path": os.path.abspath(path), "watcher": watcher, "dirs": dirs}
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with open(tmppath, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmppath, filepath)
+        except OSError:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    @staticmethod
+    def is_watched(path: str, data: dict) -> bool:
+        """Check if the index is kept up to date by a running watcher, without pending changes
+
+        Args:
+            path (str): working directory
+            data (dict): index content
+
+        Returns:
+            bool: True if the index is saved by the watcher only
+        """
+        pid = data.get("watcher", 0)
+        if pid == 0 or os.path.exists(index.get_pendingpath(path)):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def scan_dir(dirpath: str, mtime: int) -> dict:
+        """Scan one directory of the store
+
+        Args:
+            dirpath (str): directory path
+            mtime (int): directory mtime (ns), read before scanning
+
+        Returns:
+            dict: indexed directory
+        """
+        (dirs, entries) = walker.scan_dir(dirpath)
+        files = []
+        for entry in entries:
+            stat = entry.stat()
+            files.append([entry.name, stat.st_mtime_ns, stat.st_size])
+        return {"mtime": mtime, "dirs": dirs, "files": files}
+
+    @staticmethod
+    def refresh(path: str, rebuild: bool = False) -> dict:
+        """Bring the index of a store up to date
+
+        Args:
+            path (str): working directory
+            rebuild (bool, optional): if True, ignore the existing index. Defaults to False.
+
+        Returns:
+            dict: indexed directories
+        """
+        data = index.load(path)
+        # Directories are checked even when watched: a change is only seen by the watcher once it reads its event
+        watched = not rebuild and index.is_watched(path, data)
+        old_dirs = {} if rebuild else data.get("dirs", {})
+        new_dirs = {}
+        changed = rebuild
+        stack = [""]
+        while len(stack) != 0:
+            rel = stack.pop()
+            dirpath = os.path.join(path, rel) if rel != "" else path
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+                item = old_dirs.get(rel)
+                if item is None or item["mtime"] != mtime:
+                    item = index.scan_dir(dirpath, mtime)
+                    changed = True
+            except (FileNotFoundError, NotADirectoryError):
+                changed = True
+                continue
+            new_dirs[rel] = item
+            stack.extend(os.path.join(rel, d) for d in item["dirs"])
+        if (changed or len(new_dirs) != len(old_dirs)) and not watched:
+            index.save(path, new_dirs, data.get("watcher", 0))
+        return new_dirs
+
+    @staticmethod
+    def iter_files(path: str, dirs: dict):
+        """Iterate indexed files, in the same order as a sorted top-down os.walk
+
+        Args:
+            path (str): working directory
+            dirs (dict): indexed directories
+
+        Yields:
+            (str, str, int, int): tuple of root directory, file name, mtime (ns), size
+        """
+        stack = [("", path)]
+        while len(stack) != 0:
+            (rel, root) = stack.pop()
+            item = dirs.get(rel)
+            if item is None:
+                continue
+            for (f, mtime, size) in item["files"]:
+                yield (root, f, mtime, size)
+            for d in reversed(item["dirs"]):
+                stack.append((os.path.join(rel, d), os.path.join(root, d)))
@@ -0,0 +1,150 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Encrypted cache of password files metadata (name, username, url)
+"""
+
+import os
+import json
+
+from .gpg import gpg
+from .index import index
+
+
+class metadata:
+    """Static class for the metadata cache
+
+    For each password file, the cache keeps its name, username, url, mtime and size, but never its password.
+    The whole cache is saved as one file, encrypted for the store identity: a query costs one decryption, and only
+    password files changed since the last query are decrypted again.
+    """
+    version: int = 2
+
+    @staticmethod
+    def get_filepath(path: str) -> str:
+        """Get the metadata cache file path of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: metadata cache file path
+        """
+        return index.get_filepath(path).replace(".json", ".metadata.gpg")
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """Decrypt the metadata cache of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            dict: metadata of each password file, by path relative to the store (empty if there is no valid cache)
+        """
+        filepath = metadata.get_filepath(path)
+        if not os.path.exists(filepath):
+            return {}
+        try:
+            data = json.loads(gpg.decrypt_file(filepath))
+        except (AssertionError, ValueError):
+            return {}
+        if data.get("version") != metadata.version:
+            return {}
+        return data.get("entries", {})
+
+    @staticmethod
+    def save(path: str, identity: str, entries: dict):
+        """Encrypt and save the metadata cache of a store
+
+        Args:
+            path (str): working directory
+            identity (str): gpg identity
+            entries (dict): metadata of each password file
+        """
+        filepath = metadata.get_filepath(path)
+        tmppath = f"{filepath}.{os.getpid()}.tmp"
+        content = json.dumps({"version": metadata.version, "entries": entries}, separators=(",", ":"))
+        encrypted = gpg.encrypt_data(content, identity)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(tmppath, "w") as f:
+            f.write(encrypted)
+        os.replace(tmppath, filepath)
+
+    @staticmethod
+    def refresh(path: str, identity: str, username_prefix: str, url_prefix: str) -> dict:
+        """Bring the metadata cache of a store up to date
+        Fails without saving the cache if a password file cannot be decrypted
+
+        Args:
+            path (str): working directory
+            identity (str): gpg identity
+            username_prefix (str): prefix for username line
+            url_prefix (str): prefix for url line
+
+        Returns:
+            dict: metadata of each password file, by path relative to the store
+        """
+        old_entries = metadata.load(path)
+        entries = {}
+        outdated = []
+        for (root, f, mtime, size) in index.iter_files(path, index.refresh(path)):
+            rel = os.path.relpath(os.path.join(root, f), path)
+            entry = old_entries.get(rel)
+            if entry is not None and entry["mtime"] == mtime and entry["size"] == size:
+                entries[rel] = entry
+            else:
+                outdated.append((rel, mtime, size))
+        filepaths = [os.path.join(path, rel) for (rel, mtime, size) in outdated]
+        results = gpg.decrypt_many(filepaths, username_prefix, url_prefix)
+        failed = []
+        for ((rel, mtime, size), result) in zip(outdated, results):
+            if isinstance(result, Exception):
+                # Not cached: the file is decrypted again on next query (missing key, gpg-agent down, ...)
+                failed.append((rel, result))
+                continue
+            entries[rel] = {"mtime": mtime, "size": size, "app": result.app, "username": result.username,
+                            "url": result.url}
+        assert (len(failed) == 0), f"Cannot decrypt {len(failed)} password files ({failed[0][0]}: {failed[0][1]})"
+        if len(outdated) != 0 or len(entries) != len(old_entries):
+            metadata.save(path, identity, entries)
+        return entries
+
+    @staticmethod
+    def filter(path: str, items: list, entries: dict, username: str = "", url: str = "") -> list:
+        """Keep password files whose username and url contain the given values
+
+        Args:
+            path (str): working directory
+            items (list[PasswordItem]): list of password files
+            entries (dict): metadata of each password file, see refresh
+            username (str, optional): username filter (case insensitive). Defaults to "" (no filter).
+            url (str, optional): url filter (case insensitive). Defaults to "" (no filter).
+
+        Returns:
+            list[PasswordItem]: filtered list of password files
+        """
+        username = username.lower()
+        url = url.lower()
+        found = []
+        for item in items:
+            entry = entries.get(os.path.relpath(item.path, path))
+            if entry is None:
+                continue
+            if username in entry["username"].lower() and url in entry["url"].lower():
+                found.append(item)
+        return found
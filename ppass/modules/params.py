@@ -22,10 +22,11 @@ import os
 import click
 
 from rich import print
-from rich.prompt import Prompt
 
 from .passwords import PasswordItem
 from .folders import FolderItem
+from .attachments import AttachmentItem
+from .search import search
 from .ui import ui
 from .gpg import gpg
 
@@ -58,6 +59,7 @@ class params:
         # If JSON mode, new_value must not be empty
         assert (new_value != "" or not is_json), f"Incorrect <{message}> value"
         if new_value == "":
+            from rich.prompt import Prompt
             if print_old:
                 print(f"Current value: {old_value}")
             if default_value == "":
@@ -81,6 +83,7 @@ class params:
         """
         new_value = value.strip()
         if new_value == "" and not is_json:
+            from rich.prompt import Prompt
             new_value = Prompt.ask(message, default="")
         return new_value
 
@@ -157,6 +160,7 @@ class params:
         new_value = value.strip()
         assert (new_value != "" or not is_json), "Incorrect password value"
         if new_value == "":
+            from rich.prompt import Prompt
             new_value1 = Prompt.ask("Password", password=True)
             new_value2 = Prompt.ask("Confirm password", password=True)
             assert (new_value1 == new_value2), "Incorrect password confirmation"
@@ -193,17 +197,31 @@ class params:
             return folder["name"]
 
     @staticmethod
-    def validate_password(is_json: bool, items: list[PasswordItem]) -> PasswordItem:
+    def validate_password(is_json: bool, items: list[PasswordItem], scores: list[int] = None,
+                          auto_select: bool = True) -> PasswordItem:
         """Password file paramater validation
 
         Args:
             is_json (bool): is cli in JSON mode
-            items (list[PasswordItem]): list of password files
+            items (list[PasswordItem]): list of password files, best match first
+            scores (list[int], optional): search scores of items. Defaults to None.
+            auto_select (bool, optional): if True, a best match clearly beating the others is selected.
+                Defaults to True.
 
         Returns:
             PasswordItem: validated password file
         """
         assert (len(items) != 0), "No password"
+        if scores is not None and not search.is_substring(scores[0]):
+            # No folder/name contains the filter: close matches are suggested, never acted upon without a choice
+            names = ", ".join(f"{item.root_name}/{item.f_name}" for item in items[:5])
+            assert (not is_json), f"No password (close matches: {names})"
+            password = ui.select_password(items)
+            assert (len(items) != 1 or ui.confirm("Use this password file")), "No password selected"
+            return password
+        if auto_select and scores is not None and search.is_clear_best(scores):
+            # Best match clearly beats the others
+            return items[0]
         if is_json:
             assert (len(items) == 1), "Multiple password items"
             return items[0]
@@ -211,3 +229,28 @@ class params:
             return ui.select_password(items)
         else:
             return items[0]
+
+    @staticmethod
+    def validate_attachment(is_json: bool, name: str, items: list[AttachmentItem]) -> AttachmentItem:
+        """Attachment parameter validation
+
+        Args:
+            is_json (bool): is cli in JSON mode
+            name (str): attachment name
+            items (list[AttachmentItem]): list of attachments
+
+        Returns:
+            AttachmentItem: validated attachment
+        """
+        assert (len(items) != 0), "No attachment"
+        found = list(filter(lambda i: i.name == name, items))
+        if len(found) == 0:
+            found = list(filter(lambda i: i.name.lower().startswith(name.lower()), items))
+        if len(found) == 1:
+            return found[0]
+        elif len(found) == 0:
+            raise Exception(f"Attachment <{name}> does not exist")
+        elif is_json:
+            raise Exception("Multiple attachments")
+        else:
+            return ui.select_attachment(found)
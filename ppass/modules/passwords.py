@@ -19,69 +19,214 @@
 """
 
 import os
+import json
 
+from .index import index
+from .search import SearchIndex
+from .walker import walker
 
-class PasswordItem(dict):
+
+class PasswordItem:
     """Helper class for password file
+    Immutable: only the directory and the file name are stored, other fields are computed
     """
-    def __init__(self, root: str, root_name: str, f: str, f_name: str, path: str):
-        dict.__init__(self, root=root, root_name=root_name, f=f, f_name=f_name, path=path)
-        self.root = root
-        self.root_name = root_name
-        self.f = f
-        self.f_name = f_name
-        self.path = path
+    __slots__ = ("root", "root_name", "f")
+
+    def __init__(self, root: str, root_name: str, f: str):
+        """Init class
+
+        Args:
+            root (str): directory path
+            root_name (str): directory path, relative to the store
+            f (str): file name
+        """
+        object.__setattr__(self, "root", root)
+        object.__setattr__(self, "root_name", root_name)
+        object.__setattr__(self, "f", f)
+
+    def __setattr__(self, name: str, value):
+        raise AttributeError("PasswordItem is immutable")
+
+    def __getitem__(self, key: str):
+        # Compatibility with the former dict based item
+        if key not in ("root", "root_name", "f", "f_name", "path"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PasswordItem) and (self.root, self.f) == (other.root, other.f)
+
+    def __hash__(self) -> int:
+        return hash((self.root, self.f))
+
+    def __repr__(self) -> str:
+        return f"PasswordItem({self.path!r})"
+
+    @property
+    def f_name(self) -> str:
+        """Password name (file name without extension)
+        """
+        return self.f.replace(".gpg", "")
+
+    @property
+    def path(self) -> str:
+        """File path
+        """
+        return os.path.join(self.root, self.f)
+
+    def to_json(self) -> json:
+        """Convert object to JSON
+
+        Returns:
+            json: password file in json format
+        """
+        return {"root": self.root, "root_name": self.root_name, "f": self.f, "f_name": self.f_name, "path": self.path}
 
 
 class passwords:
     """Static class for password files
     """
+    # Search indexes kept in memory, by store path, while no store directory changes (None: disabled, see agent)
+    memory: dict = None
 
     @staticmethod
-    def get_list(path: str, filter: str) -> list[PasswordItem]:
-        """Return the list of password files
+    def get_root_name(path: str, root: str) -> str:
+        """Get the folder name of a directory, relative to the store
+
+        Args:
+            path (str): working directory
+            root (str): directory path
+
+        Returns:
+            str: relative folder name ("" for the store directory itself)
+        """
+        rel = os.path.relpath(root, path)
+        return "" if rel == "." else rel
+
+    @staticmethod
+    def iter_files(path: str, use_index: bool = True):
+        """Iterate all password files of the store, sorted top-down
+
+        Args:
+            path (str): working directory
+            use_index (bool, optional): if True, read files from the store index. Defaults to True.
+
+        Yields:
+            (str, str): tuple of directory path, file name
+        """
+        if use_index:
+            for (root, f, mtime, size) in index.iter_files(path, index.refresh(path)):
+                yield (root, f)
+        else:
+            for (root, files) in walker.walk(path):
+                for entry in files:
+                    yield (root, entry.name)
+
+    @staticmethod
+    def iter_list(path: str, filter: str, use_index: bool = True, limit: int = None,
+                  files: list[tuple[str, str]] = None):
+        """Iterate password files whose folder/name contains a filter, in store order
+        Files are read lazily: iteration stops as soon as limit is reached
 
         Args:
             path (str): working directory
             filter (str): name filter
+            use_index (bool, optional): if True, read files from the store index. Defaults to True.
+            limit (int, optional): maximum number of password files. Defaults to None (no limit).
+            files (list[tuple[str, str]], optional): password files already read (root directory, file name), as
+                returned by get_search_index. Defaults to None (read from the store).
+
+        Yields:
+            PasswordItem: password file
+        """
+        assert (os.path.exists(path)), f"Path <{path}> does not exist"
+        assert (os.path.isdir(path)), f"Path <{path}> is not a valid directory"
+
+        if limit is not None and limit <= 0:
+            return
+        query = filter.lower()
+        root = None
+        count = 0
+        for (file_root, f) in (passwords.iter_files(path, use_index) if files is None else files):
+            if file_root != root:
+                # Files are grouped by directory: share one root name per directory
+                root = file_root
+                root_name = passwords.get_root_name(path, root)
+            f_name = f.replace(".gpg", "")
+            if query == "" or query in f"{root_name}/{f_name}".lower():
+                yield PasswordItem(root, root_name, f)
+                count += 1
+                if count == limit:
+                    return
+
+    @staticmethod
+    def get_search_index(path: str, use_index: bool = True) -> (list[tuple[str, str]], SearchIndex):
+        """Get the search index over the password files of a store
+        When kept in memory (long-lived processes), it is only built again when a store directory changes, with
+        trigram postings
+
+        Args:
+            path (str): working directory
+            use_index (bool, optional): if True, read files from the store index. Defaults to True.
+
+        Returns:
+            (list[tuple[str, str]], SearchIndex): tuple of password files (root directory, file name), search index
+        """
+        if use_index and passwords.memory is not None:
+            dirs = index.refresh(path)
+            # Directory mtimes change when a file is created, renamed or deleted
+            signature = tuple((rel, item["mtime"]) for (rel, item) in dirs.items())
+            item = passwords.memory.get(path)
+            if item is not None and item[0] == signature:
+                return item[1]
+            files = [(root, f) for (root, f, mtime, size) in index.iter_files(path, dirs)]
+        else:
+            files = list(passwords.iter_files(path, use_index))
+        root_names = {}
+        for (root, f) in files:
+            if root not in root_names:
+                root_names[root] = passwords.get_root_name(path, root)
+        search_index = SearchIndex([(root_names[root], f.replace(".gpg", "")) for (root, f) in files])
+        if use_index and passwords.memory is not None:
+            search_index.build()
+            passwords.memory[path] = (signature, (files, search_index))
+        return (files, search_index)
+
+    @staticmethod
+    def search(path: str, filter: str, use_index: bool = True,
+               loaded: (list[tuple[str, str]], SearchIndex) = None) -> list[tuple[int, PasswordItem]]:
+        """Return the ranked list of password files matching a filter
+
+        Args:
+            path (str): working directory
+            filter (str): search filter, on folder and file names
+            use_index (bool, optional): if True, read files from the store index. Defaults to True.
+            loaded ((list[tuple[str, str]], SearchIndex), optional): password files and search index already
+                returned by get_search_index. Defaults to None (read from the store).
 
         Returns:
-            list[PasswordItem]: list of password files
+            list[tuple[int, PasswordItem]]: list of (score, password file), best first
         """
         assert (os.path.exists(path)), f"Path <{path}> does not exist"
         assert (os.path.isdir(path)), f"Path <{path}> is not a valid directory"
 
-        items: list[PasswordItem] = []
-        for (root, dirs, files) in os.walk(path):
-            # Loop all directories (only one level)
-            dirs.sort()
-            files.sort()
-            is_root_ok = False
-
-            root_name = root.replace(os.path.join(path, ""), "")
-
-            if ".git" in root_name:
-                # Skip git directory
-                continue
-            if filter == "" or filter.lower() in root_name.lower():
-                # Check directory name vs filter
-                # is_root_ok = True
-                # TODO set this flag to True with enhanced filters
-                pass
-
-            for f in files:
-                # Loop all files
-                f_name = f.replace(".gpg", "")
-
-                is_file_ok = is_root_ok
-                if not f.endswith(".gpg"):
-                    # Skip non gpg files
-                    continue
-                if filter == "" or filter.lower() in f_name.lower():
-                    # Check file name vs filter
-                    is_file_ok = True
-                if is_file_ok:
-                    # Add to returned list
-                    items.append(PasswordItem(root, root_name, f, f_name, os.path.join(root, f)))
-
-        return items
+        (files, search_index) = passwords.get_search_index(path, use_index) if loaded is None else loaded
+        results = []
+        for (score, position) in search_index.rank(filter):
+            (root, f) = files[position]
+            results.append((score, PasswordItem(root, search_index.keys[position][0], f)))
+        return results
+
+    @staticmethod
+    def get_list(path: str, filter: str, use_index: bool = True) -> list[PasswordItem]:
+        """Return the list of password files
+
+        Args:
+            path (str): working directory
+            filter (str): search filter, on folder and file names
+            use_index (bool, optional): if True, read files from the store index. Defaults to True.
+
+        Returns:
+            list[PasswordItem]: list of password files, best match first
+        """
+        return [item for (score, item) in passwords.search(path, filter, use_index)]
@@ -0,0 +1,147 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Re-encryption of a whole store for a new identity
+"""
+
+import os
+import json
+
+from .gpg import gpg
+from .index import index
+from .walker import walker
+
+
+class rekey:
+    """Static class for store re-encryption
+
+    Files are re-encrypted by a pool of gpg processes, each one replaced atomically. Every re-encrypted file is
+    appended to a journal, so that an interrupted re-encryption resumes where it stopped.
+    The journal is removed once all files are re-encrypted.
+    """
+    version: int = 1
+
+    @staticmethod
+    def get_journalpath(path: str) -> str:
+        """Get the re-encryption journal path of a store
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            str: journal file path
+        """
+        return index.get_filepath(path).replace(".json", ".rekey")
+
+    @staticmethod
+    def list_files(path: str) -> list[str]:
+        """Get all gpg files of a store, including attachments
+
+        Args:
+            path (str): working directory
+
+        Returns:
+            list[str]: sorted paths relative to the store
+        """
+        files = []
+        for (root, dirs, names) in os.walk(path):
+            dirs[:] = [d for d in dirs if d not in walker.vcs_names]
+            for name in names:
+                if name.endswith(".gpg"):
+                    files.append(os.path.relpath(os.path.join(root, name), path))
+        files.sort()
+        return files
+
+    @staticmethod
+    def load_journal(path: str, identity: str) -> set:
+        """Get files already re-encrypted by an interrupted re-encryption
+
+        Args:
+            path (str): working directory
+            identity (str): new gpg identity
+
+        Returns:
+            set: paths relative to the store (empty if the journal is missing or for another identity)
+        """
+        try:
+            with open(rekey.get_journalpath(path), "r") as f:
+                header = json.loads(f.readline())
+                if header != {"version": rekey.version, "path": path, "identity": identity}:
+                    return set()
+                # A partial last line (interrupted write) never matches a file
+                return set(line.rstrip("\n") for line in f)
+        except (OSError, ValueError):
+            return set()
+
+    @staticmethod
+    def get_pending(path: str, identity: str) -> (list[str], int):
+        """Get files remaining to re-encrypt
+
+        Args:
+            path (str): working directory
+            identity (str): new gpg identity
+
+        Returns:
+            (list[str], int): tuple of relative paths of files to re-encrypt, number of files already re-encrypted
+        """
+        done = rekey.load_journal(path, identity)
+        if len(done) == 0 and os.path.exists(rekey.get_journalpath(path)):
+            os.remove(rekey.get_journalpath(path))
+        files = rekey.list_files(path)
+        pending = [f for f in files if f not in done]
+        return (pending, len(files) - len(pending))
+
+    @staticmethod
+    def run(path: str, identity: str, files: list[str], workers: int = 0, callback=None) -> list:
+        """Re-encrypt files for a new identity
+
+        Args:
+            path (str): working directory
+            identity (str): new gpg identity
+            files (list[str]): paths relative to the store, see get_pending
+            workers (int, optional): maximum number of parallel files. Defaults to 0 (one per cpu, up to 8).
+            callback (optional): function called with (relative path, error) after each file. Defaults to None.
+
+        Returns:
+            list: list of (relative path, error message) of files that could not be re-encrypted
+        """
+        journalpath = rekey.get_journalpath(path)
+        os.makedirs(os.path.dirname(journalpath), exist_ok=True)
+        if not os.path.exists(journalpath):
+            with open(journalpath, "w") as f:
+                f.write(json.dumps({"version": rekey.version, "path": path, "identity": identity}) + "\n")
+        if workers <= 0:
+            workers = min(8, os.cpu_count() or 1)
+        errors = []
+        if len(files) != 0:
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+            executor = ThreadPoolExecutor(max_workers=min(workers, len(files)))
+            with open(journalpath, "a") as journal, executor:
+                futures = {executor.submit(gpg.reencrypt_file, os.path.join(path, f), identity): f for f in files}
+                for future in as_completed(futures):
+                    error = future.exception()
+                    if error is None:
+                        journal.write(futures[future] + "\n")
+                        journal.flush()
+                    else:
+                        errors.append((futures[future], str(error)))
+                    if callback is not None:
+                        callback(futures[future], error)
+        if len(errors) == 0:
+            os.remove(journalpath)
+        errors.sort()
+        return errors
@@ -18,31 +18,91 @@
 """Utils for JSON response
 """
 
+import sys
 import json
-import rich
 
 
 class rjson:
     """Static class for JSON response
+
+    Responses are written directly to stdout: unlike rich, no console markup is interpreted in values.
+    In NDJSON mode, each item of a list response is written on its own line, as soon as it is available.
     """
+    compact: bool = False
+    ndjson: bool = False
+    encoder: json.JSONEncoder = None
+
+    @staticmethod
+    def configure(compact: bool = False, ndjson: bool = False):
+        """Select output format
+
+        Args:
+            compact (bool, optional): if True, no indentation nor spaces. Defaults to False.
+            ndjson (bool, optional): if True, one compact JSON value per line. Defaults to False.
+        """
+        rjson.compact = compact or ndjson
+        rjson.ndjson = ndjson
+        rjson.encoder = None
+
+    @staticmethod
+    def get_encoder() -> json.JSONEncoder:
+        """Get the JSON encoder for the selected format, created on first call
+
+        Returns:
+            json.JSONEncoder: JSON encoder
+        """
+        if rjson.encoder is None:
+            if rjson.compact:
+                rjson.encoder = json.JSONEncoder(separators=(",", ":"), default=rjson.to_json)
+            else:
+                rjson.encoder = json.JSONEncoder(indent=4, default=rjson.to_json)
+        return rjson.encoder
+
+    @staticmethod
+    def write(item):
+        """Write a JSON value to stdout, followed by a new line
+
+        Args:
+            item: JSON value
+        """
+        sys.stdout.write(rjson.get_encoder().encode(item) + "\n")
+        sys.stdout.flush()
 
     @staticmethod
     def success(data: json = {}, message: str = ""):
         """Success response
 
         Args:
-            data (json, optional): JSON data content. Defaults to {}.
+            data (json, optional): JSON data content, lists can be given as iterators. Defaults to {}.
             message (str, optional): Success message. Defaults to "".
         """
+        is_list = not isinstance(data, (dict, str)) and hasattr(data, "__iter__")
+        if rjson.ndjson and is_list:
+            encode = rjson.get_encoder().encode
+            write = sys.stdout.write
+            for item in data:
+                write(encode(item) + "\n")
+            sys.stdout.flush()
+            return
         json_item = {}
         json_item["success"] = True
         json_item["message"] = message
-        json_item["data"] = data
-        try:
-            rich.print(json.dumps(json_item, indent=4))
-        except Exception:
-            json_item["data"] = data.to_json()
-            rich.print(json.dumps(json_item, indent=4))
+        json_item["data"] = list(data) if is_list and not isinstance(data, list) else data
+        rjson.write(json_item)
+
+    @staticmethod
+    def to_json(item) -> json:
+        """Convert objects not natively serializable (password, password file, folder)
+
+        Args:
+            item: object with a to_json method
+
+        Returns:
+            json: object in json format
+        """
+        if not hasattr(item, "to_json"):
+            raise TypeError(f"Object of type {type(item).__name__} is not JSON serializable")
+        return item.to_json()
 
     @staticmethod
     def error(message: str = ""):
@@ -55,4 +115,4 @@ class rjson:
         json_item["success"] = False
         json_item["message"] = message
         json_item["data"] = None
-        rich.print(json.dumps(json_item, indent=4))
+        rjson.write(json_item)
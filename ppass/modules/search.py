@@ -0,0 +1,207 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Ranked search over folder and password names
+"""
+
+import re
+import bisect
+import itertools
+
+
+class SearchIndex:
+    """Search index over (folder, name) keys
+
+    Trigram postings are only built on demand (see build): they cost about as much as 400 queries, and are only
+    worth it in the agent, which keeps the index of a store in memory (see passwords.get_search_index).
+    Without them, queries are answered with a linear scan.
+    """
+
+    def __init__(self, keys: list[tuple[str, str]]):
+        """Init class
+
+        Args:
+            keys (list[tuple[str, str]]): list of (folder, name) keys
+        """
+        self.keys = keys
+        # All lower case "folder/name" keys, one per line, with the offset of each line
+        self.text = "\n".join(f"{folder}/{name}" for (folder, name) in keys).lower()
+        self.offsets = [0] + list(itertools.accumulate(len(folder) + len(name) + 2 for (folder, name) in keys))
+        self.postings: dict[str, list[int]] = None
+
+    def build(self):
+        """Build trigram postings over "folder/name" keys
+        """
+        postings: dict[str, list[int]] = {}
+        for position in range(len(self.keys)):
+            text = self.get_text(position)
+            for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                postings.setdefault(trigram, []).append(position)
+        self.postings = postings
+
+    def get_text(self, position: int) -> str:
+        """Get a lower case "folder/name" key
+
+        Args:
+            position (int): key position
+
+        Returns:
+            str: lower case key
+        """
+        return self.text[self.offsets[position]:self.offsets[position + 1] - 1]
+
+    def find_all(self, query: str) -> list[int]:
+        """Get the positions of keys containing the query
+
+        Args:
+            query (str): lower case query
+
+        Returns:
+            list[int]: sorted positions
+        """
+        if self.postings is not None and len(query) >= 3:
+            lists = [self.postings.get(query[i:i + 3], []) for i in range(len(query) - 2)]
+            lists.sort(key=len)
+            found = set(lists[0])
+            for positions in lists[1:]:
+                found.intersection_update(positions)
+            return sorted(p for p in found if query in self.get_text(p))
+        found = []
+        start = self.text.find(query)
+        while start >= 0:
+            position = bisect.bisect_right(self.offsets, start) - 1
+            found.append(position)
+            # Skip to next key
+            start = self.text.find(query, self.offsets[position + 1])
+        return found
+
+    def rank(self, query: str) -> list[tuple[int, int]]:
+        """Rank keys against a query
+        Substring matches are always preferred: subsequence matches are only returned when there is none.
+
+        Args:
+            query (str): search query
+
+        Returns:
+            list[tuple[int, int]]: list of (score, position), best first
+        """
+        query = query.lower()
+        if query == "":
+            return [(0, position) for position in range(len(self.keys))]
+        results = []
+        for position in self.find_all(query):
+            (folder, name) = self.keys[position]
+            score = search.score_substring(query, folder.lower(), name.lower())
+            if score > 0:
+                results.append((score, position))
+        if len(results) == 0:
+            pattern = search.subsequence_pattern(query)
+            for match in pattern.finditer(self.text):
+                position = bisect.bisect_right(self.offsets, match.start()) - 1
+                if len(results) == 0 or results[-1][1] != position:
+                    results.append((search.score_span(match.end() - match.start()), position))
+        results.sort(key=lambda r: (-r[0], self.keys[r[1]][0], self.keys[r[1]][1]))
+        return results
+
+
+class search:
+    """Static class for search scoring
+    """
+    exact_score: int = 1000
+    prefix_score: int = 800
+    name_score: int = 600
+    path_score: int = 400
+    subsequence_score: int = 200
+    tier: int = 200
+
+    @staticmethod
+    def score_substring(query: str, folder: str, name: str) -> int:
+        """Score a key containing the query
+
+        Args:
+            query (str): lower case query
+            folder (str): lower case folder name
+            name (str): lower case password name
+
+        Returns:
+            int: score (0 if the key does not contain the query)
+        """
+        if name == query:
+            return search.exact_score
+        position = name.find(query)
+        if position == 0:
+            # Shorter names first
+            return search.prefix_score - min(len(name) - len(query), search.tier - 1)
+        if position > 0:
+            # Earlier matches first
+            return search.name_score - min(position, search.tier - 1)
+        position = f"{folder}/{name}".find(query)
+        if position >= 0:
+            return search.path_score - min(position, search.tier - 1)
+        return 0
+
+    @staticmethod
+    def subsequence_pattern(query: str) -> re.Pattern:
+        """Compile a pattern matching the query as a subsequence, within one key
+
+        Args:
+            query (str): lower case query
+
+        Returns:
+            re.Pattern: compiled pattern
+        """
+        return re.compile("[^\n]*?".join(re.escape(c) for c in query))
+
+    @staticmethod
+    def score_span(span: int) -> int:
+        """Score a subsequence match
+
+        Args:
+            span (int): length of the matched text
+
+        Returns:
+            int: score
+        """
+        # Compact matches first
+        return search.subsequence_score - min(span, search.tier - 1)
+
+    @staticmethod
+    def is_substring(score: int) -> bool:
+        """Check if a score is the one of a key containing the query (not a subsequence match)
+
+        Args:
+            score (int): search score
+
+        Returns:
+            bool: True if the key contains the query
+        """
+        return score > search.subsequence_score
+
+    @staticmethod
+    def is_clear_best(scores: list[int]) -> bool:
+        """Check if the first result clearly beats the others
+        Subsequence matches are never a clear best
+
+        Args:
+            scores (list[int]): sorted scores, best first
+
+        Returns:
+            bool: True if the first result contains the query, and its score is at least one tier above the second one
+        """
+        if len(scores) == 0 or not search.is_substring(scores[0]):
+            return False
+        return len(scores) == 1 or scores[0] - scores[1] >= search.tier
@@ -20,14 +20,15 @@
 
 import json
 
+from typing import TYPE_CHECKING
 from rich import print
-from rich.prompt import Confirm
-from rich.prompt import IntPrompt
-from rich.console import Console
-from rich.table import Table
 
 from .gpg import Password
 
+if TYPE_CHECKING:
+    from rich.table import Table
+    from rich.progress import Progress
+
 
 class ui:
     """Static class for handling cli ui
@@ -42,6 +43,16 @@ class ui:
         """
         print(f"[bright_black]{message}[/]")
 
+    @staticmethod
+    def create_progress() -> "Progress":
+        """Create a progress bar, removed when finished
+
+        Returns:
+            Progress: rich progress object, to use as context manager
+        """
+        from rich.progress import Progress
+        return Progress(transient=True)
+
     @staticmethod
     def print_error(*messages, must_exit: bool = True):
         """Print error
@@ -65,6 +76,7 @@ class ui:
         Returns:
             bool: confirmation value
         """
+        from rich.prompt import Confirm
         response = Confirm.ask(message, default=default_value)
         return response
 
@@ -78,7 +90,7 @@ class ui:
         Returns:
             json: list of folders in JSON format
         """
-        json_items = list(map(lambda p: [p["name"]], data))
+        json_items = list(map(lambda p: [p.name], data))
         json_content = {}
         json_content["headers"] = [{"name": "Folder"}]
         json_content["rows"] = json_items
@@ -99,6 +111,37 @@ class ui:
         json_content = ui.show_folders(data)
         return ui.select_table(json_content)
 
+    @staticmethod
+    def show_attachments(data) -> json:
+        """Show the list of attachments
+
+        Args:
+            data: list of attachments
+
+        Returns:
+            json: list of attachments in JSON format
+        """
+        json_items = list(map(lambda a: [a.name, str(a.size)], data))
+        json_content = {}
+        json_content["headers"] = [{"name": "Attachment"}, {"name": "Size"}]
+        json_content["rows"] = json_items
+        json_content["content"] = data
+        ui.show_table(json_content, show_unique=True)
+        return json_content
+
+    @staticmethod
+    def select_attachment(data) -> json:
+        """Select an attachment
+
+        Args:
+            data: list of attachments
+
+        Returns:
+            json: selected attachment
+        """
+        json_content = ui.show_attachments(data)
+        return ui.select_table(json_content)
+
     @staticmethod
     def show_identities(data) -> json:
         """Show the list of identities
@@ -135,14 +178,19 @@ class ui:
         """Show the list of password files
 
         Args:
-            data: list of password files
+            data: list of password files, or iterator of password files to display while they are produced
 
         Returns:
             json: list of password files in JSON format
         """
-        json_items = list(map(lambda p: [p["root_name"], p["f_name"]], data))
         json_content = {}
         json_content["headers"] = [{"name": "Folder"}, {"name": "File"}]
+        if not isinstance(data, list):
+            data = ui.stream_table(json_content["headers"], map(lambda p: ([p.root_name, p.f_name], p), data))
+            json_content["rows"] = list(map(lambda p: [p.root_name, p.f_name], data))
+            json_content["content"] = data
+            return json_content
+        json_items = list(map(lambda p: [p.root_name, p.f_name], data))
         json_content["rows"] = json_items
         json_content["content"] = data
         ui.show_table(json_content, show_unique=True)
@@ -176,27 +224,71 @@ class ui:
         if not show_unique and len(json_content["rows"]) == 1:
             return
 
+        from rich.console import Console
         console = Console()
-        table = Table(show_header=True,
+        table = ui.create_table(json_content["headers"], show_index=show_index)
+        index = 1
+        for line in json_content["rows"]:
+            if show_index:
+                table.add_row(str(index), *line)
+            else:
+                table.add_row(*line)
+            index += 1
+        console.print(table)
+
+    @staticmethod
+    def create_table(headers: list, show_header: bool = True, show_index: bool = True,
+                     row_styles: list[str] = ["bright_white on grey7", ""]) -> "Table":
+        """Create an empty table
+
+        Args:
+            headers (list): column headers
+            show_header (bool, optional): if True show the header line. Defaults to True.
+            show_index (bool, optional): if True add a column with autoindex. Defaults to True.
+            row_styles (list[str], optional): alternate row styles. Defaults to ["bright_white on grey7", ""].
+
+        Returns:
+            Table: table
+        """
+        from rich.table import Table
+        table = Table(show_header=show_header,
                       header_style="bold magenta underline",
                       box=None,
                       expand=True,
                       show_edge=False,
-                      row_styles=["bright_white on grey7", ""])
+                      row_styles=row_styles)
         if show_index:
             table.add_column("N.", width=3)
-        for header in json_content["headers"]:
+        for header in headers:
             if "ratio" not in header:
                 header["ratio"] = 1
             table.add_column(header["name"], ratio=header["ratio"])
-        index = 1
-        for line in json_content["rows"]:
-            if show_index:
-                table.add_row(str(index), *line)
-            else:
-                table.add_row(*line)
-            index += 1
-        console.print(table)
+        return table
+
+    @staticmethod
+    def stream_table(headers: list, rows) -> list:
+        """Display table rows while they are produced
+        Each row is printed as a one line table, with the same columns as show_table
+
+        Args:
+            headers (list): column headers
+            rows: iterable of (row, content) tuples
+
+        Returns:
+            list: list of displayed contents
+        """
+        from rich.console import Console
+        console = Console()
+        contents = []
+        for (line, content) in rows:
+            contents.append(content)
+            style = "bright_white on grey7" if len(contents) % 2 == 1 else ""
+            table = ui.create_table(headers, show_header=(len(contents) == 1), row_styles=[style])
+            table.add_row(str(len(contents)), *line)
+            console.print(table)
+        if len(contents) == 0:
+            print("[italic]No data available[/]")
+        return contents
 
     @staticmethod
     def select_table(json_content: json) -> json:
@@ -215,11 +307,106 @@ class ui:
         if len(json_content["rows"]) > 1:
             list_index = list(range(1, len(json_content["rows"]) + 1))
             list_index_str = list(map(str, list_index))
+            from rich.prompt import IntPrompt
             selected_index = IntPrompt.ask("[yellow italic]Select line[/]", choices=list_index_str, show_choices=False)
             print("")
 
         return json_content["content"][selected_index - 1]
 
+    @staticmethod
+    def decrypt_results(items: list, results: list) -> json:
+        """Combine password files and their decryption results
+
+        Args:
+            items (list): list of password files
+            results (list): for each file, a Password object or an Exception
+
+        Returns:
+            json: list of results in JSON format
+        """
+        json_items = []
+        for (item, result) in zip(items, results):
+            json_item = {}
+            json_item["path"] = item.path
+            json_item["error"] = str(result) if isinstance(result, Exception) else ""
+            json_item["password"] = None if isinstance(result, Exception) else result.to_json()
+            json_items.append(json_item)
+        return json_items
+
+    @staticmethod
+    def show_decrypt_results(data: json):
+        """Show details of several passwords
+
+        Args:
+            data (json): list of results, see decrypt_results
+        """
+        for json_item in data:
+            if json_item["error"] != "":
+                ui.print_error(f"{json_item['path']}: {json_item['error']}", must_exit=False)
+            else:
+                password = Password()
+                for (key, value) in json_item["password"].items():
+                    setattr(password, key, value)
+                ui.show_password(password)
+
+    @staticmethod
+    def show_push_status(data: json):
+        """Show the push queue and fetch states
+
+        Args:
+            data (json): synchronisation status, see git.get_status
+        """
+        state = data["push"].get("state", "")
+        print("")
+        if data["ahead"] == 0:
+            print(f"[green]Push: remote is up to date ({data['branch']})[/]")
+        else:
+            print(f"[yellow]Push: {data['ahead']} commits not pushed ({data['branch']}), {state or 'not queued'}[/]")
+        if data["push"].get("last_error", "") != "":
+            print(f"[red]Last push error: {data['push']['last_error']}[/]")
+        if data["behind"] != 0:
+            print(f"[yellow]Fetch: {data['behind']} commits of remote not merged ({data['branch']})[/]")
+        if data["fetch"].get("error", "") != "":
+            print(f"[red]Last fetch error: {data['fetch']['error']}[/]")
+
+    @staticmethod
+    def show_maintenance(data: json):
+        """Show the object counts before and after a repository maintenance, and the duration of each step
+
+        Args:
+            data (json): maintenance report, see git.maintain
+        """
+        table = ui.create_table([{"name": ""}, {"name": "Before"}, {"name": "After"}], show_index=False)
+        for (key, label) in (("loose", "Loose objects"), ("loose_size", "Loose size (KiB)"),
+                             ("packed", "Packed objects"), ("packs", "Packs"), ("pack_size", "Packs size (KiB)")):
+            (before, after) = (data["before"][key], data["after"][key])
+            if key.endswith("size"):
+                (before, after) = (before // 1024, after // 1024)
+            table.add_row(label, str(before), str(after))
+        from rich.console import Console
+        Console().print(table)
+        print("")
+        for (step, duration) in data["steps"].items():
+            if duration is None:
+                print(f"[italic]{step}: not supported by git backend[/]")
+            else:
+                print(f"{step}{' (full)' if step == 'repack' and data['full_repack'] else ''}: {duration:.3f}s")
+        print(f"[green]Maintenance done in {data['duration']:.3f}s[/]")
+
+    @staticmethod
+    def show_agent(data: json):
+        """Show the agent status
+
+        Args:
+            data (json): agent status, see agent.status
+        """
+        import time
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data["started"]))
+        print(f"[green]Agent running[/] (pid {data['pid']}, started {started})")
+        print(f"Socket: {data['socket']}")
+        print(f"Requests: {data['requests']}")
+        print(f"Cached contents: {data['cached']} (kept {data['ttl']}s)")
+
     @staticmethod
     def show_password(password: Password):
         """Show password details
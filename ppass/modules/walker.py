@@ -0,0 +1,90 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Walk the password store
+"""
+
+import os
+
+
+class walker:
+    """Static class for walking the password store
+
+    Hidden and version control directories are pruned before descending into them.
+    """
+    vcs_names: tuple = (".git", ".hg", ".svn", ".bzr", "_darcs", "CVS")
+
+    @staticmethod
+    def is_pruned(name: str) -> bool:
+        """Check if a directory must be skipped
+
+        Args:
+            name (str): directory name
+
+        Returns:
+            bool: True if the directory is hidden or a version control directory
+        """
+        return name.startswith(".") or name in walker.vcs_names
+
+    @staticmethod
+    def scan_dir(dirpath: str) -> (list[str], list[os.DirEntry]):
+        """Scan one directory
+
+        Args:
+            dirpath (str): directory path
+
+        Returns:
+            (list[str], list[os.DirEntry]): tuple of sorted sub directory names, sorted gpg file entries
+        """
+        dirs = []
+        files = []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # Symbolic links to directories are not followed (same as os.walk)
+                    if not walker.is_pruned(entry.name) and not entry.is_symlink():
+                        dirs.append(entry.name)
+                elif entry.name.endswith(".gpg"):
+                    files.append(entry)
+        dirs.sort()
+        files.sort(key=lambda e: e.name)
+        return (dirs, files)
+
+    @staticmethod
+    def walk(path: str):
+        """Walk the store top-down, directories and files sorted by name
+
+        Args:
+            path (str): working directory
+
+        Yields:
+            (str, list[os.DirEntry]): tuple of directory path, gpg file entries
+        """
+        stack = [path]
+        while len(stack) != 0:
+            root = stack.pop()
+            try:
+                (dirs, files) = walker.scan_dir(root)
+            except OSError:
+                continue
+            yield (root, files)
+            for d in reversed(dirs):
+                stack.append(os.path.join(root, d))
@@ -0,0 +1,246 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Keep the store index up to date from inotify events (Linux only)
+"""
+
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+
+from .index import index
+from .walker import walker
+
+
+class StoreWatcher:
+    """Store watcher
+
+    Every directory of the store is watched. Events are coalesced until the store is quiet, then only the
+    directories they were raised for are scanned again, and the index is saved for other ppass processes.
+    """
+    IN_MODIFY: int = 0x00000002
+    IN_ATTRIB: int = 0x00000004
+    IN_CLOSE_WRITE: int = 0x00000008
+    IN_MOVED_FROM: int = 0x00000040
+    IN_MOVED_TO: int = 0x00000080
+    IN_CREATE: int = 0x00000100
+    IN_DELETE: int = 0x00000200
+    IN_DELETE_SELF: int = 0x00000400
+    IN_MOVE_SELF: int = 0x00000800
+    IN_Q_OVERFLOW: int = 0x00004000
+    IN_IGNORED: int = 0x00008000
+    IN_ONLYDIR: int = 0x01000000
+
+    watch_mask: int = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                       | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, path: str, quiet_delay: float = 0.05, max_delay: float = 1.0):
+        """Init class
+
+        Args:
+            path (str): working directory
+            quiet_delay (float, optional): seconds without event ending a burst. Defaults to 0.05.
+            max_delay (float, optional): maximum seconds before applying a burst. Defaults to 1.0.
+        """
+        assert (os.path.isdir(path)), f"Path <{path}> is not a valid directory"
+        libc_name = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        assert (hasattr(self.libc, "inotify_init1")), "inotify is not available on this platform"
+        self.path = path
+        self.quiet_delay = quiet_delay
+        self.max_delay = max_delay
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify initialisation failed")
+        self.wds: dict[int, str] = {}
+        self.rels: dict[str, int] = {}
+        self.dirs: dict = {}
+
+    def get_dirpath(self, rel: str) -> str:
+        """Get the path of a store directory
+
+        Args:
+            rel (str): directory path, relative to the store
+
+        Returns:
+            str: directory path
+        """
+        return os.path.join(self.path, rel) if rel != "" else self.path
+
+    def add_tree(self, rel: str):
+        """Watch and scan a directory and all its sub directories
+
+        Args:
+            rel (str): directory path, relative to the store
+        """
+        stack = [rel]
+        while len(stack) != 0:
+            rel = stack.pop()
+            dirpath = self.get_dirpath(rel)
+            # Watch before scanning, so that no change is missed
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.watch_mask)
+            if wd < 0:
+                continue
+            self.wds[wd] = rel
+            self.rels[rel] = wd
+            try:
+                self.dirs[rel] = index.scan_dir(dirpath, os.stat(dirpath).st_mtime_ns)
+            except OSError:
+                self.drop_tree(rel)
+                continue
+            stack.extend(os.path.join(rel, d) for d in self.dirs[rel]["dirs"])
+
+    def drop_tree(self, rel: str):
+        """Stop watching a directory and all its sub directories
+
+        Args:
+            rel (str): directory path, relative to the store
+        """
+        prefix = os.path.join(rel, "")
+        for item in [r for r in self.rels if r == rel or r.startswith(prefix)]:
+            wd = self.rels.pop(item)
+            self.wds.pop(wd, None)
+            self.dirs.pop(item, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def rescan(self, rel: str):
+        """Scan again a directory, then add or drop its changed sub directories
+
+        Args:
+            rel (str): directory path, relative to the store
+        """
+        if rel not in self.dirs:
+            return
+        dirpath = self.get_dirpath(rel)
+        try:
+            item = index.scan_dir(dirpath, os.stat(dirpath).st_mtime_ns)
+        except OSError:
+            self.drop_tree(rel)
+            return
+        old_subdirs = set(self.dirs[rel]["dirs"])
+        new_subdirs = set(item["dirs"])
+        self.dirs[rel] = item
+        # Drop first: a renamed directory is dropped then watched again under its new name
+        for d in old_subdirs - new_subdirs:
+            self.drop_tree(os.path.join(rel, d))
+        for d in new_subdirs - old_subdirs:
+            self.add_tree(os.path.join(rel, d))
+
+    def read_events(self) -> (set[str], bool):
+        """Read available events
+
+        Returns:
+            (set[str], bool): tuple of changed directories, is a full rescan required
+        """
+        changed: set[str] = set()
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = self.event_header.unpack_from(data, offset)
+            offset += self.event_header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                return (changed, True)
+            rel = self.wds.get(wd)
+            if rel is None:
+                continue
+            if mask & self.IN_IGNORED:
+                self.wds.pop(wd, None)
+                if self.rels.get(rel) == wd:
+                    self.rels.pop(rel)
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                # Handled when scanning the parent directory
+                changed.add(os.path.dirname(rel) if rel != "" else "")
+            else:
+                changed.add(rel)
+        return (changed, False)
+
+    def wait_burst(self, timeout: float = None) -> (set[str], bool):
+        """Wait for events, and coalesce them until the store is quiet
+
+        Args:
+            timeout (float, optional): maximum seconds to wait for a first event. Defaults to None (forever).
+
+        Returns:
+            (set[str], bool): tuple of changed directories, is a full rescan required
+        """
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        changed: set[str] = set()
+        overflow = False
+        deadline = time.monotonic() + self.max_delay
+        while len(ready) != 0:
+            (burst, burst_overflow) = self.read_events()
+            if len(changed) == 0 and not overflow and (len(burst) != 0 or burst_overflow):
+                # Flag the snapshot as outdated as soon as the first change is seen
+                open(index.get_pendingpath(self.path), "w").close()
+            changed |= burst
+            overflow = overflow or burst_overflow
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            (ready, _, _) = select.select([self.fd], [], [], min(self.quiet_delay, remaining))
+        return (changed, overflow)
+
+    def apply(self, changed: set[str], overflow: bool):
+        """Apply changes to the snapshot and publish it
+
+        Args:
+            changed (set[str]): changed directories
+            overflow (bool): if True, the whole store is scanned again
+        """
+        if overflow:
+            self.drop_tree("")
+            self.add_tree("")
+        else:
+            # Parents first, so that dropped sub directories are not scanned
+            for rel in sorted(changed, key=lambda r: (r.count(os.sep), r)):
+                self.rescan(rel)
+        index.save(self.path, self.dirs, os.getpid())
+        # Events raised while applying are not in this snapshot: changes stay pending until the next burst
+        (ready, _, _) = select.select([self.fd], [], [], 0)
+        if len(ready) == 0 and os.path.exists(index.get_pendingpath(self.path)):
+            os.remove(index.get_pendingpath(self.path))
+
+    def start(self):
+        """Watch the whole store and publish the first snapshot
+        """
+        self.add_tree("")
+        index.save(self.path, self.dirs, os.getpid())
+
+    def run(self):
+        """Watch the store until interrupted
+        """
+        self.start()
+        try:
+            while True:
+                (changed, overflow) = self.wait_burst()
+                if len(changed) != 0 or overflow:
+                    self.apply(changed, overflow)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop watching, the index is then checked again by each process
+        """
+        index.save(self.path, self.dirs, 0)
+        if os.path.exists(index.get_pendingpath(self.path)):
+            os.remove(index.get_pendingpath(self.path))
+        os.close(self.fd)
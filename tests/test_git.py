@@ -0,0 +1,304 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Git stores against local bare repositories
+"""
+
+import os
+import time
+import threading
+import subprocess
+import importlib.util
+
+import pytest
+
+from ppass.modules.git import git
+
+backends = ["subprocess", pytest.param("dulwich", marks=pytest.mark.skipif(importlib.util.find_spec("dulwich") is None,
+                                                                         reason="dulwich is not installed"))]
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    """Isolate git from the user configuration, and let detached workers import ppass
+    """
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH", "")])))
+    backend = git.backend
+    yield
+    git.backend = backend
+
+
+@pytest.fixture
+def remote(tmp_path) -> str:
+    """Empty bare repository
+    """
+    path = str(tmp_path / "remote.git")
+    subprocess.run(["git", "init", "--quiet", "--bare", "--initial-branch=main", path], check=True)
+    return path
+
+
+def run_git(path: str, *args: str) -> str:
+    """Run a git command, and return its output
+    """
+    return subprocess.run(["git", "-C", path] + list(args), capture_output=True, text=True, check=True).stdout.strip()
+
+
+def write(path: str, name: str, content: str) -> str:
+    """Write a store file, and return its path
+    """
+    filepath = os.path.join(path, name)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w") as f:
+        f.write(content)
+    return filepath
+
+
+def create_store(path: str, remote: str, backend: str, pull: bool = False, **options) -> str:
+    """Initialise a store with a git backend, and return its path
+    """
+    git.configure(backend)
+    os.makedirs(path)
+    git.init(path, remote, "main", "Test", "test@example.com", pull=pull, **options)
+    return path
+
+
+def wait_pushed(path: str, remote: str, timeout: float = 30) -> dict:
+    """Wait until the push worker is done, and return the push state
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = git.load_state(path, "push")
+        if state.get("state") == "failed":
+            return state
+        if state.get("state") == "done" and run_git(remote, "rev-parse", "main") == git.get_ref(path, "main"):
+            return state
+        time.sleep(0.1)
+    return git.load_state(path, "push")
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_queued_push_lands(tmp_path, remote: str, backend: str):
+    store = create_store(str(tmp_path / "store"), remote, backend)
+    filepath = write(store, "bank/chase.gpg", "secret")
+    assert git.commit(store, "Password file created", "main", added=[filepath])
+    state = wait_pushed(store, remote)
+    assert state["state"] == "done", state
+    assert run_git(remote, "rev-parse", "main") == git.get_ref(store, "main")
+    assert run_git(remote, "show", "main:bank/chase.gpg") == "secret"
+    assert git.get_status(store, "main")["ahead"] == 0
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_commits_are_queued_while_pushing(tmp_path, remote: str, backend: str):
+    store = create_store(str(tmp_path / "store"), remote, backend)
+    for index in range(5):
+        filepath = write(store, f"entry{index}.gpg", str(index))
+        assert git.commit(store, f"Password file {index} created", "main", added=[filepath])
+    state = wait_pushed(store, remote)
+    assert state["state"] == "done", state
+    assert run_git(remote, "rev-list", "--count", "main") == "6"
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_nothing_to_commit_queues_no_push(tmp_path, remote: str, backend: str):
+    store = create_store(str(tmp_path / "store"), remote, backend)
+    assert wait_pushed(store, remote)["state"] == "done"
+    assert not git.commit(store, "Nothing", "main", added=[os.path.join(store, ".gitignore")])
+    assert git.load_state(store, "push")["state"] == "done"
+
+
+def make_changes(path: str, backend: str) -> list[str]:
+    """Run the same changes on a store, and return its commits (newest first)
+    """
+    git.configure(backend)
+    added = [write(path, "bank/chase.gpg", "1"), write(path, "bank/us/wells.gpg", "2"), write(path, "mail.gpg", "3")]
+    git.commit(path, "Password files created", "main", added=added)
+    git.commit(path, "File modified", "main", added=[write(path, "mail.gpg", "4")])
+    os.remove(os.path.join(path, "bank", "us", "wells.gpg"))
+    git.commit(path, "Password file deleted", "main", removed=[os.path.join(path, "bank", "us", "wells.gpg")])
+    write(path, "web/site.gpg", "5")
+    git.commit(path, "All changes", "main")
+    git.commit(path, "Folder deleted\n", "main", removed=[os.path.join(path, "bank")])
+    return run_git(path, "rev-list", "main").splitlines()
+
+
+def test_backends_make_identical_commits(tmp_path, monkeypatch):
+    pytest.importorskip("dulwich")
+    monkeypatch.setenv("GIT_AUTHOR_DATE", "1650000000 +0200")
+    monkeypatch.setenv("GIT_COMMITTER_DATE", "1650000100 -0130")
+    commits = {}
+    for backend in ("subprocess", "dulwich"):
+        remote = str(tmp_path / f"{backend}.git")
+        subprocess.run(["git", "init", "--quiet", "--bare", "--initial-branch=main", remote], check=True)
+        store = create_store(str(tmp_path / backend), remote, backend)
+        commits[backend] = make_changes(store, backend)
+        assert wait_pushed(store, remote)["state"] == "done"
+    assert len(commits["subprocess"]) == 6
+    assert commits["dulwich"] == commits["subprocess"]
+    # Same commits: same trees, messages, authors and dates
+    assert run_git(str(tmp_path / "dulwich"), "ls-tree", "-r", "--name-only", "main").splitlines() == \
+        [".gitignore", "mail.gpg", "web/site.gpg"]
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_pull_from_other_backend(tmp_path, remote: str, backend: str):
+    other = "dulwich" if backend == "subprocess" else "subprocess"
+    if importlib.util.find_spec("dulwich") is None:
+        other = backend
+    source = create_store(str(tmp_path / "source"), remote, other)
+    make_changes(source, other)
+    assert wait_pushed(source, remote)["state"] == "done"
+    store = create_store(str(tmp_path / "store"), remote, backend, pull=True)
+    assert git.get_ref(store, "main") == git.get_ref(source, "main")
+    assert git.backend.is_clean(store)
+    assert sorted(os.listdir(store)) == [".git", ".gitignore", "mail.gpg", "web"]
+    filepath = write(store, "web/site.gpg", "6")
+    git.commit(store, "File modified", "main", added=[filepath])
+    assert wait_pushed(store, remote)["state"] == "done"
+    git.configure(other)
+    git.pull(source, "main")
+    assert git.get_ref(source, "main") == git.get_ref(store, "main")
+    with open(os.path.join(source, "web", "site.gpg")) as f:
+        assert f.read() == "6"
+
+
+@pytest.fixture
+def history(tmp_path, remote: str) -> str:
+    """Bare repository with 6 commits, pushed from a store (returned)
+    """
+    subprocess.run(["git", "-C", remote, "config", "uploadpack.allowFilter", "true"], check=True)
+    source = create_store(str(tmp_path / "source"), remote, "subprocess")
+    for index in range(5):
+        filepath = write(source, "bank/chase.gpg", f"version {index}")
+        git.commit(source, f"Version {index}", "main", added=[filepath])
+    assert wait_pushed(source, remote)["state"] == "done"
+    return source
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_shallow_init(tmp_path, remote: str, history: str, backend: str):
+    store = create_store(str(tmp_path / "store"), remote, backend, pull=True, depth=2)
+    assert git.is_shallow(store)
+    assert run_git(store, "rev-list", "--count", "main") == "2"
+    assert git.get_ref(store, "main") == git.get_ref(history, "main")
+    with open(os.path.join(store, "bank", "chase.gpg")) as f:
+        assert f.read() == "version 4"
+    # Later commits are pulled on top of the truncated history, and local ones pushed
+    git.configure("subprocess")
+    git.commit(history, "Version 5", "main", added=[write(history, "bank/chase.gpg", "version 5")])
+    assert wait_pushed(history, remote)["state"] == "done"
+    git.configure(backend)
+    git.pull(store, "main")
+    assert git.get_ref(store, "main") == git.get_ref(history, "main")
+    git.commit(store, "Password file created", "main", added=[write(store, "mail.gpg", "mail")])
+    assert wait_pushed(store, remote)["state"] == "done"
+    assert run_git(remote, "rev-list", "--count", "main") == "8"
+
+
+def test_shallow_history_fetched_when_needed(tmp_path, remote: str, history: str):
+    store = create_store(str(tmp_path / "store"), remote, "subprocess", pull=True, depth=1)
+    assert not git.ensure_history(store, "main")
+    # Remote rewritten below the truncation: local and remote branches have no common commit in local history
+    run_git(history, "reset", "--hard", "HEAD~3")
+    git.commit(history, "Rewritten", "main", added=[write(history, "bank/chase.gpg", "rewritten")])
+    run_git(history, "push", "--quiet", "--force", "origin", "main")
+    run_git(store, "fetch", "--quiet", "origin", "main")
+    assert git.ensure_history(store, "main")
+    assert not git.is_shallow(store)
+    assert run_git(store, "rev-list", "--count", "main") == "6"
+
+
+def test_partial_init(tmp_path, remote: str, history: str):
+    store = create_store(str(tmp_path / "store"), remote, "subprocess", pull=True, partial=True)
+    assert run_git(store, "config", "remote.origin.partialclonefilter") == "blob:none"
+    assert run_git(store, "rev-list", "--count", "main") == "6"
+    # Past versions are not downloaded until they are read
+    missing = run_git(store, "rev-list", "--objects", "--missing=print", "main").splitlines()
+    assert len([line for line in missing if line.startswith("?")]) == 4
+    assert run_git(store, "show", "main~2:bank/chase.gpg") == "version 2"
+
+
+def test_partial_init_not_supported_by_dulwich(tmp_path, remote: str, history: str):
+    pytest.importorskip("dulwich")
+    with pytest.raises(AssertionError, match="partial"):
+        create_store(str(tmp_path / "store"), remote, "dulwich", pull=True, partial=True)
+
+
+@pytest.fixture
+def clones(tmp_path, remote: str) -> (str, str):
+    """Two stores sharing a remote: the first one pushes, the second one prefetches
+    """
+    upstream = create_store(str(tmp_path / "upstream"), remote, "subprocess")
+    assert wait_pushed(upstream, remote)["state"] == "done"
+    store = create_store(str(tmp_path / "store"), remote, "subprocess", pull=True)
+    git.configure("subprocess")
+    git.commit(upstream, "Upstream change", "main", added=[write(upstream, "bank/chase.gpg", "upstream")])
+    assert wait_pushed(upstream, remote)["state"] == "done"
+    return (upstream, store)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_prefetch_fast_forwards(clones: (str, str), backend: str):
+    (upstream, store) = clones
+    git.configure(backend)
+    git.fetch_worker(store, "main")
+    assert git.get_ref(store, "main") == git.get_ref(upstream, "main")
+    assert git.load_state(store, "fetch")["behind"] == 0
+    with open(os.path.join(store, "bank", "chase.gpg")) as f:
+        assert f.read() == "upstream"
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_prefetch_keeps_local_commits(clones: (str, str), backend: str):
+    (upstream, store) = clones
+    git.configure(backend)
+    # Committed without queueing a push (the remote would reject it): as if the store was offline
+    git.backend.add(store, [write(store, "mail.gpg", "local")])
+    assert git.backend.commit(store, "Local change")
+    local = git.get_ref(store, "main")
+    git.fetch_worker(store, "main")
+    assert git.get_ref(store, "main") == local
+    state = git.load_state(store, "fetch")
+    assert (state["ahead"], state["behind"]) == (1, 1)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_prefetch_keeps_concurrent_commit(clones: (str, str), backend: str, monkeypatch):
+    (upstream, store) = clones
+    git.configure(backend)
+    filepath = write(store, "mail.gpg", "local")
+    committer = threading.Thread(target=git.commit, args=(store, "Local change", "main"), kwargs={"added": [filepath]})
+    is_clean = git.backend.is_clean
+
+    def commit_while_fast_forwarding(path: str) -> bool:
+        # The commit starts once the fast-forward holds the locks: it must wait for it, then build on the new head
+        committer.start()
+        time.sleep(0.5)
+        return is_clean(path)
+
+    monkeypatch.setattr(git.backend, "is_clean", commit_while_fast_forwarding)
+    git.fetch_worker(store, "main")
+    committer.join()
+    assert run_git(store, "rev-parse", "main~1") == git.get_ref(upstream, "main")
+    assert run_git(store, "log", "--format=%s", "main").splitlines()[:2] == ["Local change", "Upstream change"]
+    assert run_git(store, "status", "--porcelain") == ""
+    for (name, content) in (("mail.gpg", "local"), ("bank/chase.gpg", "upstream")):
+        with open(os.path.join(store, name)) as f:
+            assert f.read() == content
@@ -0,0 +1,112 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Entry parser compared with the former line by line parser
+"""
+
+import os
+
+import pytest
+
+from ppass.modules.gpg import Password, gpg
+
+username_prefix = "└─ USERNAME ::"
+url_prefix = "└─ URL      ::"
+
+
+def old_gpg_to_password(filepath: str, content: str, username_prefix: str, url_prefix: str) -> Password:
+    """Former parser: ppass prefixes only, all other lines are comment
+    """
+    password = Password()
+    password.app = os.path.basename(filepath).replace(".gpg", "")
+    first_line = True
+    for line in content.splitlines():
+        if first_line:
+            first_line = False
+            password.password = line.strip()
+            continue
+        if line.startswith(username_prefix):
+            password.username = line.replace(username_prefix, "").strip()
+            continue
+        if line.startswith(url_prefix):
+            password.url = line.replace(url_prefix, "").strip()
+            continue
+        password.comment += "" if password.comment == "" else "\n"
+        password.comment += line
+    return password
+
+
+def parse(content: str) -> Password:
+    return gpg.gpg_to_password("/store/bank/chase.gpg", content, username_prefix, url_prefix)
+
+
+ppass_contents = [
+    "secret",
+    "secret\n",
+    f"  secret  \n{username_prefix} john \n{url_prefix} https://example.com\n",
+    f"secret\n{username_prefix} john\n{url_prefix} https://example.com\nfirst line\n\nthird line\n  indented\n",
+    f"secret\n{username_prefix} john\nnote: a\npin: 1234\nnote: b\nnote : spaced\n{url_prefix} https://example.com",
+    f"secret\n{username_prefix} first\n{username_prefix} second\n{url_prefix} a\n{url_prefix} b\nend",
+    f"secret\r\n{username_prefix} john\r\nwindows\r\nline endings\r\n",
+    f"secret\n{username_prefix} john\nsee https://example.com: home\nratio: 1:2\n: no key\nkey:\n",
+    f"secret\n{username_prefix}{url_prefix} shared\nnote {username_prefix} inside\n",
+]
+
+
+@pytest.mark.parametrize("content", ppass_contents)
+def test_matches_former_parser(content: str):
+    new = parse(content)
+    old = old_gpg_to_password("/store/bank/chase.gpg", content, username_prefix, url_prefix)
+    assert (new.app, new.password, new.username, new.url, new.comment) == \
+        (old.app, old.password, old.username, old.url, old.comment)
+
+
+def test_fields_keep_first_value_in_file_order():
+    password = parse(f"secret\n{username_prefix} john\nnote: a\npin: 1234\nnote: b\nPin: 0000\nfree text\n")
+    assert list(password.fields.items()) == [("note", "a"), ("pin", "1234"), ("Pin", "0000")]
+    assert password.comment == "note: a\npin: 1234\nnote: b\nPin: 0000\nfree text"
+
+
+def test_multi_line_notes_are_kept():
+    notes = "line one\n\nline-three: with colon\n\n\nline six\n"
+    password = parse(f"secret\n{username_prefix} john\n{url_prefix} https://example.com\n{notes}")
+    assert password.comment == notes.rstrip("\n")
+    assert password.fields == {"line-three": "with colon"}
+
+
+def test_pass_style_fields():
+    otpauth = "otpauth://totp/bank?secret=ABC"
+    password = parse(f"secret\nlogin: john\nURL: https://example.com\n{otpauth}\nlogin: jane\nurl: other\n")
+    assert (password.username, password.url) == ("john", "https://example.com")
+    assert password.fields == {"otpauth": otpauth, "login": "jane", "url": "other"}
+    assert password.comment == f"{otpauth}\nlogin: jane\nurl: other"
+
+
+def test_prefixes_win_over_pass_style_fields():
+    password = parse(f"secret\nlogin: jane\n{username_prefix} john\nurl: other\n{url_prefix} https://example.com")
+    assert (password.username, password.url) == ("john", "https://example.com")
+    assert password.comment == ""
+
+
+def test_blank_lines_before_comment_are_dropped():
+    password = parse(f"secret\n{username_prefix} john\n\n\nnote\n")
+    assert password.comment == "note"
+
+
+def test_empty_content():
+    password = parse("")
+    assert (password.app, password.password, password.comment, password.fields) == ("chase", "", "", {})
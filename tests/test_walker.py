@@ -0,0 +1,96 @@
+# Copyright (C) 2022 Sebastien Guerri
+#
+# This file is part of ppass.
+#
+# ppass is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# ppass is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Store walker compared with an os.walk listing
+"""
+
+import os
+
+import pytest
+
+from ppass.modules.walker import walker
+
+
+def walk_listing(path: str) -> list[tuple[str, list[str]]]:
+    """List the store with os.walk, sorted top-down, pruning hidden and version control directories
+
+    Args:
+        path (str): working directory
+
+    Returns:
+        list[tuple[str, list[str]]]: list of (directory path, sorted gpg file names)
+    """
+    listing = []
+    for (root, dirs, files) in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in walker.vcs_names)
+        listing.append((root, sorted(f for f in files if f.endswith(".gpg"))))
+    return listing
+
+
+def touch(path: str, *names: str):
+    """Create empty files, and their directories
+
+    Args:
+        path (str): directory path
+        names (str): relative file paths
+    """
+    for name in names:
+        os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+        open(os.path.join(path, name), "w").close()
+
+
+@pytest.fixture
+def store(tmp_path) -> str:
+    """Store with hidden and version control directories, symbolic links and nested gpg files
+    """
+    path = str(tmp_path / "store")
+    touch(path, "top.gpg", "notes.txt", "bank/chase.gpg", "bank/us/wells.gpg", "bank/us/deep/er/est.gpg",
+          "mail/gmail.gpg", "mail/gmail-old.gpg", "mail/Zed.gpg", "mail/readme.md",
+          "my.github/token.gpg", "web.git/site.gpg", "empty/.keep",
+          ".git/objects/ab/cdef.gpg", ".git/refs/heads/main", ".hidden/secret.gpg", "bank/.cache/old.gpg",
+          ".hg/store.gpg", "CVS/entry.gpg", "mail/_darcs/patch.gpg", "mail/.svn/wc.gpg")
+    os.symlink(os.path.join(path, "bank"), os.path.join(path, "bank-link"))
+    os.symlink(os.path.join(path, "mail", "gmail.gpg"), os.path.join(path, "gmail-link.gpg"))
+    os.symlink(os.path.join(path, "missing.gpg"), os.path.join(path, "broken.gpg"))
+    os.symlink(path, os.path.join(path, "mail", "loop"))
+    return path
+
+
+def test_walk_matches_os_walk(store: str):
+    listing = [(root, [entry.name for entry in files]) for (root, files) in walker.walk(store)]
+    assert listing == walk_listing(store)
+
+
+def test_walk_prunes_hidden_and_vcs_directories(store: str):
+    roots = [os.path.relpath(root, store) for (root, files) in walker.walk(store)]
+    assert roots == [".", "bank", "bank/us", "bank/us/deep", "bank/us/deep/er", "empty", "mail", "my.github",
+                     "web.git"]
+
+
+def test_walk_lists_gpg_file_links(store: str):
+    (root, files) = next(walker.walk(store))
+    assert [entry.name for entry in files] == ["broken.gpg", "gmail-link.gpg", "top.gpg"]
+
+
+def test_scan_dir_does_not_follow_directory_links(store: str):
+    (dirs, files) = walker.scan_dir(os.path.join(store, "mail"))
+    assert dirs == []
+    assert [entry.name for entry in files] == ["Zed.gpg", "gmail-old.gpg", "gmail.gpg"]
+
+
+def test_walk_missing_store(tmp_path):
+    assert list(walker.walk(str(tmp_path / "missing"))) == []